@@ -0,0 +1,81 @@
+"""
+Бенчмарк пакетного API
+Роль: Тестировщик - операций в секунду через /api/batch и по одной
+
+Записывает одинаковую смесь расходов и выплат через отдельные запросы
+POST /api/expenses и /api/payments и через POST /api/batch пакетами
+разного размера. Запросы идут через тестовый клиент Flask, поэтому
+сетевые задержки не учитываются: разница - это разбор запроса,
+соединение с БД и фиксация транзакции на каждую операцию.
+
+Запуск: python -m benchmarks.bench_batch [--operations N] [--batch-sizes 10,100,500]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import src.web.api
+from src.database import Database
+from src.web.app import app
+
+
+def build_operations(count: int):
+    """Чередование расходов и выплат по ним"""
+    operations = []
+    for i in range(count // 2):
+        creditor, debtor = f"user{i % 50}", f"user{(i + 1) % 50}"
+        operations.append({'type': 'expense', 'description': f"e{i}", 'amount': 1000,
+                           'creator': creditor, 'participants': [debtor]})
+        operations.append({'type': 'payment', 'debtor': debtor, 'creditor': creditor,
+                           'amount': 100})
+    return operations
+
+
+def post_individually(client, operations):
+    for operation in operations:
+        if operation['type'] == 'expense':
+            client.post('/api/expenses', json={
+                'description': operation['description'], 'amount': operation['amount'],
+                'creator': operation['creator'], 'participants': operation['participants']})
+        else:
+            client.post('/api/payments', json={
+                'debtor': operation['debtor'], 'creditor': operation['creditor'],
+                'amount': operation['amount']})
+
+
+def post_batches(client, operations, batch_size: int):
+    for start in range(0, len(operations), batch_size):
+        response = client.post('/api/batch', json={'operations': operations[start:start + batch_size]})
+        assert response.status_code == 200, response.data
+
+
+def measure(label: str, operations, run):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        src.web.api.db = Database(db_path=path)
+        with app.test_client() as client:
+            start = time.perf_counter()
+            run(client, operations)
+            elapsed = time.perf_counter() - start
+        print(f"{label:<28} {len(operations) / elapsed:10,.0f} операций/с")
+    finally:
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--operations', type=int, default=2000)
+    parser.add_argument('--batch-sizes', default='10,100,500')
+    args = parser.parse_args()
+
+    operations = build_operations(args.operations)
+    measure("по одной операции", operations, post_individually)
+    for batch_size in map(int, args.batch_sizes.split(',')):
+        measure(f"/api/batch по {batch_size}", operations,
+                lambda client, ops, size=batch_size: post_batches(client, ops, size))
+
+
+if __name__ == '__main__':
+    main()
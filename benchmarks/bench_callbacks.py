@@ -0,0 +1,83 @@
+"""
+Бенчмарк реестра callback_data
+Роль: Тестировщик - скорость выдачи/разбора токенов и память под нагрузкой
+
+Запуск: python -m benchmarks.bench_callbacks [--entries N]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from src.callbacks import CallbackRegistry, SQLiteCallbackRegistry
+
+
+def payload(i: int) -> dict:
+    return {'debtor': f"user_{i}", 'creditor': f"creditor_{i % 100}",
+            'debtor_id': i, 'creditor_id': i % 100, 'amount': 1000 + i % 500}
+
+
+def legacy_encode(data: dict) -> str:
+    return f"pay_debt:{data['debtor']}:{data['creditor']}:{data['amount']}"
+
+
+def legacy_decode(data: str) -> dict:
+    _, debtor, creditor, amount = data.split(":")
+    return {'debtor': debtor, 'creditor': creditor, 'amount': float(amount)}
+
+
+def timed(label: str, count: int, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed * 1e6 / count:8.2f} мкс/оп")
+    return result
+
+
+def bench_memory(entries: int):
+    tracemalloc.start()
+    registry = CallbackRegistry(max_entries=entries)
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(entries):
+        registry.issue("pay_debt", payload(i))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{'память реестра на ' + str(entries) + ' токенов':<36} "
+          f"{(after - before) / 2 ** 20:8.2f} МиБ ({(after - before) / entries:.0f} байт/токен)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--sqlite-ops', type=int, default=2000)
+    args = parser.parse_args()
+    n = args.entries
+
+    payloads = [payload(i) for i in range(n)]
+    encoded = timed("старый формат: encode", n, lambda: [legacy_encode(p) for p in payloads])
+    timed("старый формат: decode", n, lambda: [legacy_decode(d) for d in encoded])
+
+    registry = CallbackRegistry(max_entries=n)
+    tokens = timed("реестр в памяти: issue", n,
+                   lambda: [registry.issue("pay_debt", p) for p in payloads])
+    timed("реестр в памяти: resolve", n, lambda: [registry.resolve(t) for t in tokens])
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        m = args.sqlite_ops
+        sqlite_registry = SQLiteCallbackRegistry(path)
+        tokens = timed("реестр SQLite: issue", m,
+                       lambda: [sqlite_registry.issue("pay_debt", p) for p in payloads[:m]])
+        timed("реестр SQLite: resolve", m, lambda: [sqlite_registry.resolve(t) for t in tokens])
+    finally:
+        os.unlink(path)
+
+    longest = max(len(d.encode()) for d in encoded)
+    print(f"{'макс. длина callback_data, байт':<36} {longest:8d} -> {len(tokens[0].encode())}")
+    bench_memory(n)
+
+
+if __name__ == '__main__':
+    main()
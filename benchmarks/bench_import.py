@@ -0,0 +1,57 @@
+"""
+Бенчмарк импорта CSV
+Роль: Тестировщик - строк в секунду через src.importer
+
+Собирает в памяти CSV из чередующихся расходов и частичных выплат по ним
+(долги пар копятся, как в долгой истории группы) и импортирует его в
+пустую БД пачками разного размера.
+
+Запуск: python -m benchmarks.bench_import [--rows N] [--chunk-sizes 1000,5000]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from src.database import Database
+from src.importer import import_csv
+
+
+def build_csv(rows: int) -> str:
+    """Расход на троих и выплата по нему на каждые две строки"""
+    lines = ["type,date,description,amount,creditor,debtor,participants"]
+    for i in range(rows // 2):
+        creditor, debtor, other = f"user{i % 50}", f"user{(i + 1) % 50}", f"user{(i + 2) % 50}"
+        lines.append(f"expense,2024-05-01 12:00:00,e{i},900,{creditor},,{debtor};{other};{creditor}")
+        lines.append(f"payment,2024-05-02,,100,{creditor},{debtor},")
+    return "\n".join(lines) + "\n"
+
+
+def measure(text: str, rows: int, chunk_size: int):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        db = Database(db_path=path)
+        start = time.perf_counter()
+        summary = import_csv(db, io.StringIO(text), chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+        assert summary['error_count'] == 0, summary['errors'][:5]
+        print(f"пачки по {chunk_size:<8} {elapsed:6.2f} с {rows / elapsed:10,.0f} строк/с")
+    finally:
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-sizes', default='1000,5000,20000')
+    args = parser.parse_args()
+
+    text = build_csv(args.rows)
+    for chunk_size in map(int, args.chunk_sizes.split(',')):
+        measure(text, args.rows, chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Бенчмарк команды "скинул"
+Роль: Тестировщик - задержка выплаты с итогом на большом реестре долгов
+
+Сравнивает прежнюю последовательность (get_debt_amount, pay_debt,
+get_debt_amount, get_debts по кредитору) с pay_debt_and_summarize.
+
+Запуск: python -m benchmarks.bench_payment [--users N] [--expenses N]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from src.database import Database
+
+
+def legacy_pay(db: Database, debtor: str, creditor: str, amount: float):
+    current = db.get_debt_amount(debtor, creditor)
+    if current == 0 or amount > current:
+        return
+    db.pay_debt(debtor, creditor, amount)
+    if db.get_debt_amount(debtor, creditor) == 0:
+        [d for d in db.get_debts(creditor_username=creditor) if d['debtor'] != debtor]
+
+
+def measure(label: str, calls):
+    timings = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<40} медиана {statistics.median(timings):7.3f} мс, "
+          f"p95 {sorted(timings)[int(len(timings) * 0.95)]:7.3f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--expenses', type=int, default=5000)
+    parser.add_argument('--payments', type=int, default=300)
+    args = parser.parse_args()
+
+    users = [f"user{i}" for i in range(args.users)]
+    pairs = [(users[(i + 1) % len(users)], users[i % len(users)]) for i in range(args.payments)]
+
+    def build_ledger(path: str) -> Database:
+        db = Database(db_path=path)
+        for i in range(args.expenses):
+            creditor = users[i % len(users)]
+            participants = [users[(i + k) % len(users)] for k in range(1, 4)]
+            db.create_expense(f"e{i}", 3000, creditor, participants)
+        return db
+
+    paths = []
+    try:
+        for label, pay in (("get_* + pay_debt (старое)", legacy_pay),
+                           ("pay_debt_and_summarize", Database.pay_debt_and_summarize)):
+            fd, path = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+            paths.append(path)
+            db = build_ledger(path)
+            # Частичная выплата: реестр не меняется между замерами
+            measure(label + ", частично", [lambda p=p: pay(db, p[0], p[1], 1) for p in pairs])
+            # Полная выплата: ответ перечисляет остальных должников кредитора
+            owed = [db.get_debt_amount(*p) for p in pairs]
+            measure(label + ", полностью", [
+                lambda p=p, a=a: pay(db, p[0], p[1], a) for p, a in zip(pairs, owed)])
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
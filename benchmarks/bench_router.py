@@ -0,0 +1,93 @@
+"""
+Бенчмарк классификации текстовых команд
+Роль: Тестировщик - сообщений в секунду на реалистичном корпусе
+
+Сравнивает маршрутизатор DebtBot с прежней цепочкой re.match, которая
+проверяла шаблоны по очереди. Измеряется только классификация, без БД.
+
+Запуск: python -m benchmarks.bench_router [--rounds N]
+"""
+import argparse
+import random
+import re
+import time
+
+from src.bot import DebtBot
+
+CORPUS = [
+    # Обычная переписка составляет большую часть сообщений в чате
+    ("привет всем", 20),
+    ("кто идёт обедать?", 15),
+    ("ок", 15),
+    ("спасибо за пиццу, было вкусно", 10),
+    ("пицца 4200 @Петя @Маша @Вася", 8),
+    ("кофе 600 @Маша", 6),
+    ("скинул @Вася 700", 8),
+    ("скинул Васе 1400", 4),
+    ("долги", 6),
+    ("долги @Вася", 3),
+    ("долги по расходам", 2),
+    ("статистика", 2),
+    ("статистика @Петя", 1),
+    ("история", 2),
+    ("история пицца", 1),
+    ("расход пицца", 1),
+    ("отменить кофе", 1),
+]
+
+
+def legacy_classify(message: str):
+    """Прежний порядок проверок из process_message"""
+    message = message.strip()
+    if re.match(r'^(\w+)\s+(\d+(?:\.\d+)?)\s+(.+)$', message):
+        return 'expense'
+    if re.match(r'скинул\s+@?(\w+)\s+(\d+(?:\.\d+)?)', message):
+        return 'payment'
+    if message.strip() == "долги":
+        return 'debts'
+    if re.match(r'долги\s+@?(\w+)', message):
+        return 'creditor_debts'
+    if message.strip() == "статистика":
+        return 'statistics'
+    if re.match(r'статистика\s+@?(\w+)', message):
+        return 'user_statistics'
+    if message.strip() == "история":
+        return 'history'
+    if re.match(r'история\s+(\w+)', message):
+        return 'expense_history'
+    if re.match(r'расход\s+(\w+)', message):
+        return 'expense_details'
+    if message.strip() == "долги по расходам":
+        return 'debts_by_expense'
+    if re.match(r'отменить\s+(\w+)', message):
+        return 'cancel'
+    return None
+
+
+def build_corpus(size: int):
+    rng = random.Random(42)
+    messages = [text for text, weight in CORPUS for _ in range(weight)]
+    return [rng.choice(messages) for _ in range(size)]
+
+
+def measure(label: str, messages, classify):
+    start = time.perf_counter()
+    for message in messages:
+        classify(message)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(messages) / elapsed:12,.0f} сообщений/с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=200000)
+    args = parser.parse_args()
+
+    messages = build_corpus(args.rounds)
+    router = DebtBot(db=None).router
+    measure("цепочка re.match", messages, legacy_classify)
+    measure("маршрутизатор", messages, router.resolve)
+
+
+if __name__ == '__main__':
+    main()
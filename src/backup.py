@@ -0,0 +1,333 @@
+"""
+Резервные копии БД через online backup API SQLite
+Роль: DevOps - копии без остановки бота и без долгих блокировок
+
+Копия пишется во временный файл небольшими шагами (BACKUP_PAGES_PER_STEP
+страниц): между шагами блокировка чтения снимается и бот с веб-приложением
+успевают записать свои изменения. Готовая копия проверяется через
+PRAGMA integrity_check и только потом получает имя debts-ГГГГММДД-ЧЧММСС.db;
+старые копии сверх BACKUP_KEEP удаляются.
+
+Запуск: python -m src.backup create [--dir КАТАЛОГ] [--keep N]
+        python -m src.backup list
+        python -m src.backup verify КОПИЯ
+        python -m src.backup restore (КОПИЯ | --at ДАТА) НОВАЯ_БД
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Union
+
+from src.database import Database
+
+logger = logging.getLogger(__name__)
+
+# Каталог копий (в docker-compose - смонтированный ./data)
+BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join('data', 'backups'))
+# Сколько последних копий хранить
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', 14))
+# Период копирования в боте, секунды (0 - не копировать)
+BACKUP_INTERVAL = float(os.getenv('BACKUP_INTERVAL', 6 * 3600))
+# Страниц за шаг и пауза между шагами: запись в БД ждёт не дольше одного шага
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE = 0.005
+# Сколько раз копия может начаться заново из-за записи в БД, прежде чем
+# копировать одним шагом
+BACKUP_MAX_RESTARTS = 3
+
+BACKUP_PREFIX = 'debts-'
+BACKUP_SUFFIX = '.db'
+BACKUP_TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+
+class BackupError(RuntimeError):
+    """Копия не создана или не прошла проверку"""
+
+
+class _BackupRestarted(Exception):
+    """БД изменилась во время копирования - SQLite начал копию заново"""
+
+
+def _copy(source: sqlite3.Connection, target: sqlite3.Connection, pages: int,
+          pause: float, max_restarts: int) -> int:
+    """
+    Скопировать БД шагами по pages страниц
+
+    Если другое соединение пишет в БД между шагами, SQLite начинает копию
+    сначала. После max_restarts таких перезапусков оставшаяся копия
+    делается одним шагом - это одна короткая блокировка чтения.
+
+    Returns:
+        Количество перезапусков
+    """
+    restarts = 0
+    while True:
+        last_remaining = None
+
+        def step(status, remaining, total):
+            nonlocal last_remaining
+            if last_remaining is not None and remaining > last_remaining:
+                raise _BackupRestarted()
+            last_remaining = remaining
+            # Пауза без блокировки: писатели не ждут конца всей копии
+            time.sleep(pause)
+
+        try:
+            source.backup(target, pages=pages if restarts < max_restarts else -1,
+                          progress=step)
+            return restarts
+        except _BackupRestarted:
+            restarts += 1
+
+
+def check_integrity(path: str) -> List[str]:
+    """Ошибки PRAGMA integrity_check (пустой список - файл цел)"""
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    return [] if problems == ['ok'] else problems
+
+
+def backup_name(moment: datetime) -> str:
+    return f"{BACKUP_PREFIX}{moment.strftime(BACKUP_TIME_FORMAT)}{BACKUP_SUFFIX}"
+
+
+def list_backups(directory: str = BACKUP_DIR) -> List[Dict]:
+    """
+    Копии в каталоге, старые первыми
+
+    Returns:
+        [{'path', 'created_at' (UTC), 'size'}]
+    """
+    if not os.path.isdir(directory):
+        return []
+    backups = []
+    for name in os.listdir(directory):
+        if not (name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)):
+            continue
+        try:
+            created_at = datetime.strptime(name[len(BACKUP_PREFIX):-len(BACKUP_SUFFIX)],
+                                           BACKUP_TIME_FORMAT)
+        except ValueError:
+            continue
+        path = os.path.join(directory, name)
+        backups.append({'path': path, 'created_at': created_at, 'size': os.path.getsize(path)})
+    backups.sort(key=lambda backup: backup['created_at'])
+    return backups
+
+
+def check_keep(keep: int) -> int:
+    """Проверить число хранимых копий: при keep < 1 ротация удалила бы все копии"""
+    if keep < 1:
+        raise ValueError(f"Нужно хранить хотя бы одну копию (keep={keep})")
+    return keep
+
+
+def rotate_backups(directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> List[str]:
+    """
+    Удалить копии сверх keep последних; вернуть удалённые пути
+
+    Raises:
+        ValueError: keep < 1
+    """
+    check_keep(keep)
+    removed = []
+    for backup in list_backups(directory)[:-keep]:
+        os.unlink(backup['path'])
+        removed.append(backup['path'])
+    return removed
+
+
+def create_backup(db_path: str, directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+                  pages: int = BACKUP_PAGES_PER_STEP, pause: float = BACKUP_STEP_PAUSE,
+                  now: Optional[datetime] = None) -> Dict:
+    """
+    Снять копию БД, проверить её и удалить старые копии
+
+    Returns:
+        {'path', 'size', 'seconds', 'restarts', 'removed'}
+
+    Raises:
+        BackupError: копия не прошла integrity_check (файл копии удаляется)
+        ValueError: keep < 1 (проверяется до копирования)
+    """
+    check_keep(keep)
+    os.makedirs(directory, exist_ok=True)
+    now = now or datetime.now(timezone.utc)
+    path = os.path.join(directory, backup_name(now))
+    partial = path + '.partial'
+
+    started = time.perf_counter()
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(partial)
+    try:
+        restarts = _copy(source, target, pages, pause, BACKUP_MAX_RESTARTS)
+    finally:
+        target.close()
+        source.close()
+
+    problems = check_integrity(partial)
+    if problems:
+        os.unlink(partial)
+        raise BackupError(f"Копия {path} повреждена: {'; '.join(problems[:5])}")
+    # Под окончательным именем появляется только проверенная копия
+    os.replace(partial, path)
+
+    return {
+        'path': path,
+        'size': os.path.getsize(path),
+        'seconds': time.perf_counter() - started,
+        'restarts': restarts,
+        'removed': rotate_backups(directory, keep)
+    }
+
+
+def find_backup(moment: Union[datetime, str], directory: str = BACKUP_DIR) -> Optional[Dict]:
+    """Последняя копия, снятая не позже moment (UTC)"""
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    found = None
+    for backup in list_backups(directory):
+        if backup['created_at'] > moment.replace(tzinfo=None):
+            break
+        found = backup
+    return found
+
+
+def restore_backup(backup_path: str, target_path: str) -> Database:
+    """
+    Развернуть копию в новую БД (для разборов и отчётов, рабочая БД не трогается)
+
+    Копия проверяется перед восстановлением; после него схема доводится до
+    текущей версии миграциями Database.init_db.
+
+    Raises:
+        BackupError: копия повреждена или target_path уже существует
+    """
+    if os.path.exists(target_path):
+        raise BackupError(f"{target_path} уже существует - восстановление только в новую БД")
+    problems = check_integrity(backup_path)
+    if problems:
+        raise BackupError(f"Копия {backup_path} повреждена: {'; '.join(problems[:5])}")
+
+    source = sqlite3.connect(f'file:{backup_path}?mode=ro', uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return Database(db_path=target_path)
+
+
+class BackupScheduler:
+    """
+    Периодические резервные копии в процессе бота
+
+    Копирование идёт в отдельном потоке, поэтому обработка сообщений не
+    останавливается; ошибка копии пишется в лог и не прерывает расписание.
+    """
+
+    def __init__(self, db: Database, directory: str = BACKUP_DIR,
+                 interval: float = BACKUP_INTERVAL, keep: int = BACKUP_KEEP):
+        self.db = db
+        self.directory = directory
+        self.interval = interval
+        self.keep = check_keep(keep)
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> Dict:
+        """Снять одну копию"""
+        result = await asyncio.to_thread(create_backup, self.db.db_path, self.directory, self.keep)
+        logger.info("Резервная копия %s (%d байт, %.1f с)",
+                    result['path'], result['size'], result['seconds'])
+        return result
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка резервного копирования")
+
+    def start(self):
+        """Запустить расписание (при interval <= 0 копии не снимаются)"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить расписание"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Резервные копии БД")
+    parser.add_argument('--db', default=os.getenv('DATABASE_PATH', 'debts.db'))
+    parser.add_argument('--dir', default=BACKUP_DIR, help="Каталог копий")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help="Снять копию")
+    create.add_argument('--keep', type=int, default=BACKUP_KEEP, help="Сколько копий хранить")
+    commands.add_parser('list', help="Список копий")
+    verify = commands.add_parser('verify', help="Проверить копию")
+    verify.add_argument('path')
+    restore = commands.add_parser('restore', help="Развернуть копию в новую БД")
+    restore.add_argument('path', nargs='?', help="Файл копии")
+    restore.add_argument('--at', help="Последняя копия не позже этого времени UTC (YYYY-MM-DD [HH:MM:SS])")
+    restore.add_argument('target', help="Путь новой БД")
+    args = parser.parse_args(argv)
+    if args.command == 'create' and args.keep < 1:
+        parser.error("--keep должен быть не меньше 1")
+
+    try:
+        if args.command == 'create':
+            result = create_backup(args.db, args.dir, args.keep)
+            print(f"{result['path']}: {result['size']} байт за {result['seconds']:.2f} с")
+            for path in result['removed']:
+                print(f"удалена {path}")
+        elif args.command == 'list':
+            for backup in list_backups(args.dir):
+                print(f"{backup['created_at']:%Y-%m-%d %H:%M:%S}  {backup['size']:>12}  {backup['path']}")
+        elif args.command == 'verify':
+            problems = check_integrity(args.path)
+            print('\n'.join(problems) if problems else "ok")
+            return 1 if problems else 0
+        else:
+            if bool(args.path) == bool(args.at):
+                parser.error("укажите файл копии или --at")
+            path = args.path
+            if args.at:
+                backup = find_backup(args.at, args.dir)
+                if backup is None:
+                    print(f"Нет копий не позже {args.at}", file=sys.stderr)
+                    return 1
+                path = backup['path']
+            restore_backup(path, args.target)
+            print(f"{path} -> {args.target}")
+    except BackupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,8 +3,54 @@ Telegram бот для отслеживания долгов
 Роль: Разработчик
 """
 import re
-from typing import Optional, Dict
-from src.database import Database
+from itertools import chain
+from typing import Hashable, Iterable, Optional, Dict, Union
+from src.database import Database, format_amendment
+from src.reports import DEFAULT_PAGE_ROWS, ReportPage, ReportSessions
+from src.router import CommandRouter
+
+# Шаблоны команд компилируются один раз при импорте
+EXPENSE_PATTERN = re.compile(r'^(\w+)\s+(\d+(?:\.\d+)?)\s+(.+)$')
+PAYMENT_PATTERN = re.compile(r'скинул\s+@?(\w+)\s+(\d+(?:\.\d+)?)')
+MENTION_PATTERN = re.compile(r'@(\w+)')
+
+HELP_TEXT = """Доступные команды:
+• "описание сумма @участник1 @участник2" - создать расход
+• "скинул @кредитор сумма" - выплатить долг
+• "долги" - показать все долги
+• "долги @кредитор" - долги конкретному человеку
+• "долги по расходам" - долги сгруппированные по расходам
+• "расход описание" - детали расхода
+• "история" - история операций
+• "история описание" - история конкретного расхода
+• "отменить описание" - отменить расход (только создатель)
+• "изменить описание сумма [@участники]" - изменить расход (только создатель)
+• "статистика" - общая статистика
+• "статистика @пользователь" - статистика по пользователю
+• "ещё" - продолжение длинного отчёта"""
+
+# Строк истории на страницу отчёта
+HISTORY_PAGE_ROWS = 20
+
+
+def format_expense_details(expense: Dict) -> str:
+    """Текст с деталями расхода (для команды "расход X" и кнопки расхода)"""
+    lines = [
+        f"📋 Расход: {expense['description']}",
+        f"💰 Сумма: {int(expense['total_amount'])}р",
+        f"👤 Создатель: {expense['creator_username']}",
+        f"📅 Создан: {expense['created_at'].strftime('%d.%m.%Y %H:%M')}",
+        "",
+        "💳 Долги:"
+    ]
+    
+    for debt in expense['debts']:
+        if debt['remaining'] > 0:
+            lines.append(f"  • {debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р")
+        else:
+            lines.append(f"  ✅ {debt['debtor']} заплатил {int(debt['paid'])}р")
+    
+    return '\n'.join(lines)
 
 
 class DebtBot:
@@ -12,6 +58,27 @@ class DebtBot:
     
     def __init__(self, db: Database):
         self.db = db
+        self.reports = ReportSessions()
+        self.router = self._build_router()
+    
+    def _build_router(self) -> CommandRouter:
+        """Таблица команд: обработчики получают имя пользователя и группы шаблона"""
+        router = CommandRouter()
+        router.exact("долги", self._all_debts)
+        router.exact("долги по расходам", self._debts_by_expense)
+        router.exact("статистика", lambda username: self._statistics())
+        router.exact("история", self._history)
+        router.exact("ещё", self._more)
+        router.exact("еще", self._more)
+        router.keyword("скинул", r'@?(\w+)\s+(\d+(?:\.\d+)?)', self._pay_debt)
+        router.keyword("долги", r'@?(\w+)', self._creditor_debts)
+        router.keyword("статистика", r'@?(\w+)', lambda username, target: self._user_statistics(target))
+        router.keyword("история", r'(\w+)', self._expense_history)
+        router.keyword("расход", r'(\w+)', lambda username, description: self._expense_details(description))
+        router.keyword("отменить", r'(\w+)', self._cancel_expense)
+        router.keyword("изменить", r'(\w+)\s+(\d+(?:\.\d+)?)(?:\s+(.+))?$', self._amend_expense)
+        router.fallback(EXPENSE_PATTERN.pattern, self._route_expense)
+        return router
     
     def parse_expense_command(self, message: str, creator_username: str) -> Optional[str]:
         """
@@ -22,21 +89,30 @@ class DebtBot:
             Ответ бота или None если команда не распознана
         """
         # Паттерн: слово, число, упоминания
-        pattern = r'^(\w+)\s+(\d+(?:\.\d+)?)\s+(.+)$'
-        match = re.match(pattern, message)
+        match = EXPENSE_PATTERN.match(message)
         
         if not match:
             return None
         
-        description = match.group(1)
+        return self._create_expense(creator_username, *match.groups())
+    
+    def _route_expense(self, creator_username: str, description: str,
+                       amount_text: str, participants_text: str) -> Optional[str]:
+        """Расход из сообщения без ключевого слова; без @ сообщение не считается командой"""
+        if '@' not in participants_text:
+            return None
+        return self._create_expense(creator_username, description, amount_text, participants_text)
+    
+    def _create_expense(self, creator_username: str, description: str,
+                        amount_text: str, participants_text: str) -> str:
+        """Создать расход из разобранной команды"""
         try:
-            amount = float(match.group(2))
+            amount = float(amount_text)
         except ValueError:
             return "Неверный формат суммы. Используйте число"
         
-        participants_text = match.group(3)
         # Извлекаем упоминания
-        participants = re.findall(r'@(\w+)', participants_text)
+        participants = MENTION_PATTERN.findall(participants_text)
         
         if not participants:
             return "Укажите участников через @"
@@ -65,43 +141,35 @@ class DebtBot:
             Ответ бота или None если команда не распознана
         """
         # Паттерн: "скинул" + имя + сумма
-        pattern = r'скинул\s+@?(\w+)\s+(\d+(?:\.\d+)?)'
-        match = re.match(pattern, message)
+        match = PAYMENT_PATTERN.match(message)
         
         if not match:
             return None
         
-        creditor_username = match.group(1)
+        return self._pay_debt(debtor_username, *match.groups())
+    
+    def _pay_debt(self, debtor_username: str, creditor_username: str, amount_text: str) -> str:
+        """Выплатить долг из разобранной команды"""
         try:
-            amount = float(match.group(2))
+            amount = float(amount_text)
         except ValueError:
             return "Неверный формат суммы"
         
-        # Проверяем текущий долг
-        current_debt = self.db.get_debt_amount(debtor_username, creditor_username)
+        # Проверка, выплата и итог - одна транзакция в БД
+        result = self.db.pay_debt_and_summarize(debtor_username, creditor_username, amount)
         
-        if current_debt == 0:
+        if result['status'] == 'no_debt':
             return f"У вас нет долга перед {creditor_username}"
         
-        if amount > current_debt:
-            return f"Сумма выплаты ({int(amount)}р) больше долга ({int(current_debt)}р)"
-        
-        # Выплачиваем долг
-        success = self.db.pay_debt(debtor_username, creditor_username, amount)
-        
-        if not success:
-            return f"Ошибка при выплате долга"
+        if result['status'] == 'too_much':
+            return f"Сумма выплаты ({int(amount)}р) больше долга ({int(result['owed'])}р)"
         
-        # Проверяем остаток
-        remaining_debt = self.db.get_debt_amount(debtor_username, creditor_username)
-        
-        if remaining_debt == 0:
+        if result['remaining'] == 0:
             # Полностью погашен
-            remaining_debts = self.db.get_debts(creditor_username=creditor_username)
-            remaining_names = []
-            for debt in remaining_debts:
-                if debt['debtor'] != debtor_username:
-                    remaining_names.append(f"{debt['debtor']} ({int(debt['remaining'])}р)")
+            remaining_names = [
+                f"{debt['debtor']} ({int(debt['remaining'])}р)"
+                for debt in result['other_debtors']
+            ]
             
             if remaining_names:
                 names_str = ', '.join(remaining_names)
@@ -109,201 +177,191 @@ class DebtBot:
             else:
                 return f"Принял! {debtor_username} больше не должен."
         else:
-            return f"Принял! {debtor_username} должен ещё {int(remaining_debt)}р"
+            return f"Принял! {debtor_username} должен ещё {int(result['remaining'])}р"
     
-    def parse_debts_command(self, message: str) -> Optional[str]:
+    def parse_debts_command(self, message: str, username: Optional[str] = None) -> Optional[str]:
         """
         Парсит команду просмотра долгов
         Формат: "долги" или "долги @кредитор"
         
         Returns:
-            Ответ бота или None если команда не распознана
+            Ответ бота (первая страница отчёта) или None если команда не распознана
         """
-        if message.strip() == "долги":
-            debts = self.db.get_debts()
-            
-            if not debts:
-                return "Нет активных долгов 🎉"
-            
-            debt_lines = []
-            for debt in debts:
-                days = (debt['created_at'] - debt['created_at']).days if hasattr(debt['created_at'], 'days') else 0
-                from datetime import datetime
-                if isinstance(debt['created_at'], datetime):
-                    days = (datetime.now() - debt['created_at']).days
-                
-                overdue = " ⚠️ ПРОСРОЧЕНО" if days > 7 else ""
-                debt_lines.append(f"{debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р" + overdue)
-            
-            return '\n'.join(debt_lines)
-        
-        # "долги @кредитор"
-        pattern = r'долги\s+@?(\w+)'
-        match = re.match(pattern, message)
-        
-        if match:
-            creditor_username = match.group(1)
-            debts = self.db.get_debts(creditor_username=creditor_username)
-            
-            if not debts:
-                return f"Нет долгов перед {creditor_username}"
-            
-            debt_lines = []
-            for debt in debts:
-                debt_lines.append(f"{debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р")
-            
-            return '\n'.join(debt_lines)
+        route = self.router.resolve(message)
+        if route is None:
+            return None
         
-        return None
+        handler, groups = route
+        if handler not in (self._all_debts, self._creditor_debts, self._debts_by_expense):
+            return None
+        return str(handler(username, *groups))
     
-    def process_message(self, message: str, username: str) -> str:
+    def _report(self, username: Hashable, title: str, rows: Iterable[str],
+                empty_text: str, page_rows: int = DEFAULT_PAGE_ROWS) -> Union[str, ReportPage]:
         """
-        Обрабатывает сообщение пользователя
-        
-        Args:
-            message: Текст сообщения
-            username: Имя пользователя
+        Первая страница отчёта; продолжение доступно по команде "ещё"
         
-        Returns:
-            Ответ бота
+        Строки читаются из источника лениво, только на нужную страницу.
         """
-        message = message.strip()
-        
-        # Пробуем разные команды
-        response = self.parse_expense_command(message, username)
-        if response:
-            return response
-        
-        response = self.parse_payment_command(message, username)
-        if response:
-            return response
-        
-        response = self.parse_debts_command(message)
-        if response:
-            return response
-        
-        # Статистика
-        if message.strip() == "статистика":
-            stats = self.db.get_statistics()
-            return f"""📊 Общая статистика:
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return empty_text
+        return self.reports.start(username, title, chain([first], rows), page_rows)
+    
+    def _more(self, username: Hashable) -> str:
+        """Следующая страница последнего отчёта пользователя"""
+        page = self.reports.more(username)
+        if page is None:
+            return "Продолжения нет: отчёт показан полностью"
+        return page
+    
+    def _all_debts(self, username: Hashable) -> Union[str, ReportPage]:
+        """Все активные долги"""
+        def rows():
+            for debt in self.db.iter_debts():
+                # Просрочка вычисляется в SQL (см. OVERDUE_DAYS)
+                overdue = " ⚠️ ПРОСРОЧЕНО" if debt['overdue'] else ""
+                yield f"{debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р" + overdue
+        
+        return self._report(username, "💳 Все долги:", rows(), "Нет активных долгов 🎉")
+    
+    def _creditor_debts(self, username: Hashable, creditor_username: str) -> Union[str, ReportPage]:
+        """Долги перед конкретным кредитором"""
+        rows = (
+            f"{debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р"
+            for debt in self.db.iter_debts(creditor_username=creditor_username)
+        )
+        return self._report(username, f"💳 Долги перед {creditor_username}:", rows,
+                            f"Нет долгов перед {creditor_username}")
+    
+    def _statistics(self) -> str:
+        """Общая статистика"""
+        stats = self.db.get_statistics()
+        return f"""📊 Общая статистика:
 • Активных долгов: {stats['debt_count']}
 • Общая сумма: {int(stats['total_debt'])}р
 • Должников: {stats['debtors_count']}
 • Кредиторов: {stats['creditors_count']}"""
-        
-        # Статистика по пользователю
-        pattern = r'статистика\s+@?(\w+)'
-        match = re.match(pattern, message)
-        if match:
-            username = match.group(1)
-            stats = self.db.get_statistics(username=username)
-            return f"""📊 Статистика для {username}:
+    
+    def _user_statistics(self, username: str) -> str:
+        """Статистика по пользователю"""
+        stats = self.db.get_statistics(username=username)
+        return f"""📊 Статистика для {username}:
 • Активных долгов: {stats['debt_count']}
 • Общая сумма: {int(stats['total_debt'])}р"""
+    
+    @staticmethod
+    def _history_rows(operations: Iterable[Dict]) -> Iterable[str]:
+        for op in operations:
+            date_str = op['created_at'].strftime('%d.%m %H:%M')
+            yield f"{date_str} | {op['username']}: {op['description']}"
+    
+    def _history(self, username: Hashable) -> Union[str, ReportPage]:
+        """История операций"""
+        return self._report(username, "📜 История операций:",
+                            self._history_rows(self.db.iter_operation_history()),
+                            "История пуста", page_rows=HISTORY_PAGE_ROWS)
+    
+    def _expense_history(self, username: Hashable, description: str) -> Union[str, ReportPage]:
+        """История конкретного расхода"""
+        expense = self.db.get_expense_by_description(description)
+        if not expense:
+            return f"Расход '{description}' не найден"
+        
+        return self._report(username, f"📜 История расхода '{description}':",
+                            self._history_rows(self.db.iter_operation_history(expense_id=expense['id'])),
+                            f"История расхода '{description}' пуста")
+    
+    def _expense_details(self, description: str) -> str:
+        """Детали расхода"""
+        expense = self.db.get_expense_by_description(description)
+        if not expense:
+            return "Расход не найден"
         
-        # История операций
-        if message.strip() == "история":
-            history = self.db.get_operation_history(limit=20)
-            if not history:
-                return "История пуста"
-            
-            history_lines = []
-            for op in history:
-                date_str = op['created_at'].strftime('%d.%m %H:%M')
-                history_lines.append(f"{date_str} | {op['username']}: {op['description']}")
-            
-            return "📜 История операций:\n" + '\n'.join(history_lines)
-        
-        # История конкретного расхода
-        pattern = r'история\s+(\w+)'
-        match = re.match(pattern, message)
-        if match:
-            description = match.group(1)
-            expense = self.db.get_expense_by_description(description)
-            if not expense:
-                return f"Расход '{description}' не найден"
-            
-            history = self.db.get_operation_history(expense_id=expense['id'])
-            if not history:
-                return f"История расхода '{description}' пуста"
-            
-            history_lines = []
-            for op in history:
-                date_str = op['created_at'].strftime('%d.%m %H:%M')
-                history_lines.append(f"{date_str} | {op['username']}: {op['description']}")
-            
-            return f"📜 История расхода '{description}':\n" + '\n'.join(history_lines)
-        
-        # Детали расхода
-        pattern = r'расход\s+(\w+)'
-        match = re.match(pattern, message)
-        if match:
-            description = match.group(1)
-            expense = self.db.get_expense_by_description(description)
-            if not expense:
-                return "Расход не найден"
-            
-            lines = [
-                f"📋 Расход: {expense['description']}",
-                f"💰 Сумма: {int(expense['total_amount'])}р",
-                f"👤 Создатель: {expense['creator_username']}",
-                f"📅 Создан: {expense['created_at'].strftime('%d.%m.%Y %H:%M')}",
-                "",
-                "💳 Долги:"
-            ]
-            
-            for debt in expense['debts']:
-                if debt['remaining'] > 0:
-                    lines.append(f"  • {debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р")
-                else:
-                    lines.append(f"  ✅ {debt['debtor']} заплатил {int(debt['paid'])}р")
-            
-            return '\n'.join(lines)
+        return format_expense_details(expense)
+    
+    def _debts_by_expense(self, username: Hashable) -> Union[str, ReportPage]:
+        """Долги, сгруппированные по расходам"""
+        def rows():
+            expense_id = None
+            for debt in self.db.iter_debts(by_expense=True):
+                if debt['expense_id'] != expense_id:
+                    expense_id = debt['expense_id']
+                    yield f"\n📦 {debt['description']}:"
+                yield f"  • {debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р"
+        
+        return self._report(username, "💳 Долги по расходам:", rows(), "Нет активных долгов 🎉")
+    
+    def _cancel_expense(self, username: str, description: str) -> str:
+        """Отменить расход (только создатель)"""
+        expense = self.db.get_expense_by_description(description)
         
-        # Долги по расходам (группировка)
-        if message.strip() == "долги по расходам":
-            grouped = self.db.get_debts_grouped_by_expense()
-            
-            if not grouped:
-                return "Нет активных долгов 🎉"
-            
-            lines = []
-            for description, debts in grouped.items():
-                lines.append(f"\n📦 {description}:")
-                for debt in debts:
-                    lines.append(f"  • {debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р")
-            
-            return "💳 Долги по расходам:" + '\n'.join(lines)
-        
-        # Отмена расхода
-        pattern = r'отменить\s+(\w+)'
-        match = re.match(pattern, message)
-        if match:
-            description = match.group(1)
-            expense = self.db.get_expense_by_description(description)
-            
-            if not expense:
-                return "Расход не найден"
-            
-            # Проверяем что пользователь - создатель
-            success = self.db.cancel_expense(expense['id'], username)
-            
-            if not success:
-                return "Вы не можете отменить этот расход. Только создатель может отменить"
-            
-            return f"Расход '{description}' отменён. Все долги удалены"
+        if not expense:
+            return "Расход не найден"
         
-        # Неизвестная команда
-        return """Доступные команды:
-• "описание сумма @участник1 @участник2" - создать расход
-• "скинул @кредитор сумма" - выплатить долг
-• "долги" - показать все долги
-• "долги @кредитор" - долги конкретному человеку
-• "долги по расходам" - долги сгруппированные по расходам
-• "расход описание" - детали расхода
-• "история" - история операций
-• "история описание" - история конкретного расхода
-• "отменить описание" - отменить расход (только создатель)
-• "статистика" - общая статистика
-• "статистика @пользователь" - статистика по пользователю"""
-
+        # Проверяем что пользователь - создатель
+        success = self.db.cancel_expense(expense['id'], username)
+        
+        if not success:
+            return "Вы не можете отменить этот расход. Только создатель может отменить"
+        
+        return f"Расход '{description}' отменён. Все долги удалены"
+    
+    def _amend_expense(self, username: str, description: str, amount_text: str,
+                       participants_text: Optional[str] = None) -> str:
+        """Изменить сумму и участников расхода (только создатель)"""
+        expense = self.db.get_expense_by_description(description, creator_username=username)
+        if not expense:
+            if self.db.get_expense_by_description(description):
+                return "Вы не можете изменить этот расход. Только создатель может изменить"
+            return "Расход не найден"
+        
+        participants = None
+        if participants_text:
+            participants = MENTION_PATTERN.findall(participants_text)
+            if not participants:
+                return "Укажите участников через @"
+        
+        amount = float(amount_text)
+        if amount <= 0:
+            return "Сумма должна быть больше нуля"
+        
+        diff = self.db.amend_expense(expense['id'], username, total_amount=amount,
+                                     participants=participants)
+        if diff is None:
+            # Расход отменили между поиском и изменением
+            return "Расход не найден"
+        if not any(diff.values()):
+            return f"Расход '{description}' не изменился: сумма и участники те же"
+        return f"Расход '{description}' изменён: {format_amendment(diff)}"
+    
+    def handle_command(self, message: str, username: str) -> Optional[Union[str, ReportPage]]:
+        """
+        Выполняет текстовую команду
+        
+        Args:
+            message: Текст сообщения
+            username: Имя (или id) пользователя
+        
+        Returns:
+            Ответ бота, страница длинного отчёта (уже разбитая на сообщения)
+            или None, если сообщение не является командой
+        """
+        return self.router.dispatch(message, username)
+    
+    def process_message(self, message: str, username: str) -> str:
+        """
+        Обрабатывает сообщение пользователя
+        
+        Args:
+            message: Текст сообщения
+            username: Имя пользователя
+        
+        Returns:
+            Ответ бота (список команд, если команда не распознана)
+        """
+        response = self.handle_command(message, username)
+        if response is None:
+            return HELP_TEXT
+        return str(response)
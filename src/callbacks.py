@@ -0,0 +1,211 @@
+"""
+Компактные callback_data для inline-кнопок
+Роль: Архитектор - данные действий хранятся на сервере, в кнопке только токен
+"""
+import json
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Длина токена в символах (6 случайных байт в base64url)
+TOKEN_LENGTH = 8
+# Время жизни токена по умолчанию, секунды
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def _new_token() -> str:
+    return secrets.token_urlsafe(6)
+
+
+def _payload_key(action: str, payload: Dict[str, Any]) -> str:
+    """Ключ действия с данными: одинаковые кнопки получают один токен"""
+    return json.dumps([action, payload], ensure_ascii=False, sort_keys=True)
+
+
+def split_callback(data: str) -> Tuple[str, str]:
+    """
+    Разделить callback_data на действие и токен
+
+    Returns:
+        Кортеж (действие, токен)
+    """
+    action, _, token = data.rpartition(":")
+    return action, token
+
+
+class CallbackRegistry:
+    """
+    Реестр токенов callback_data в памяти процесса
+
+    Кнопка получает callback_data вида "<действие>:<токен>" фиксированной
+    длины, а данные действия остаются на сервере и не могут быть подменены
+    клиентом. Записи живут ttl секунд; при переполнении вытесняются самые
+    старые, так что память ограничена max_entries.
+
+    Повторная выдача того же действия с теми же данными возвращает живой
+    токен (со сброшенным сроком), поэтому перерисованная клавиатура
+    совпадает с прежней и правку сообщения можно пропустить.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = 100000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # Токены в порядке выдачи: при одинаковом ttl это и порядок истечения
+        self._entries: "OrderedDict[str, Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        # Ключ действия с данными -> выданный токен
+        self._tokens: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            self._tokens.pop(_payload_key(entry[1], entry[2]), None)
+
+    def _purge(self, now: float):
+        while self._entries:
+            token, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._remove(token)
+
+    def issue(self, action: str, payload: Dict[str, Any]) -> str:
+        """
+        Сохранить данные действия и выдать callback_data
+
+        Args:
+            action: Имя действия (префикс для фильтра обработчика)
+            payload: Данные действия
+
+        Returns:
+            Строка "<действие>:<токен>"
+        """
+        now = self.clock()
+        self._purge(now)
+        key = _payload_key(action, payload)
+        token = self._tokens.get(key)
+        if token is not None:
+            # Продлеваем живой токен; он становится последним в порядке истечения
+            self._entries[token] = (now + self.ttl, action, payload)
+            self._entries.move_to_end(token)
+            return f"{action}:{token}"
+
+        while len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+        token = _new_token()
+        while token in self._entries:
+            token = _new_token()
+        self._entries[token] = (now + self.ttl, action, payload)
+        self._tokens[key] = token
+        return f"{action}:{token}"
+
+    def resolve(self, data: str) -> Optional[Dict[str, Any]]:
+        """
+        Получить данные действия по callback_data
+
+        Returns:
+            Данные действия или None, если токен неизвестен или истёк
+        """
+        action, token = split_callback(data)
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires_at, stored_action, payload = entry
+        if stored_action != action or expires_at <= self.clock():
+            return None
+        return payload
+
+    def discard(self, data: str):
+        """Удалить токен, чтобы кнопку нельзя было нажать повторно"""
+        _, token = split_callback(data)
+        self._remove(token)
+
+
+class SQLiteCallbackRegistry:
+    """
+    Реестр токенов callback_data в SQLite
+
+    Тот же интерфейс, что у CallbackRegistry, но токены переживают
+    перезапуск бота и доступны нескольким процессам.
+    """
+
+    def __init__(self, db_path: str, ttl: float = DEFAULT_TTL,
+                 clock: Callable[[], float] = time.time):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.clock = clock
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS callback_tokens (
+                token TEXT PRIMARY KEY,
+                action TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_callback_tokens_expires ON callback_tokens(expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_callback_tokens_payload ON callback_tokens(action, payload)")
+        conn.commit()
+        conn.close()
+
+    def __len__(self) -> int:
+        conn = sqlite3.connect(self.db_path)
+        count = conn.execute("SELECT COUNT(*) FROM callback_tokens").fetchone()[0]
+        conn.close()
+        return count
+
+    def issue(self, action: str, payload: Dict[str, Any]) -> str:
+        """Сохранить данные действия и выдать callback_data (живой токен переиспользуется)"""
+        now = self.clock()
+        stored = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DELETE FROM callback_tokens WHERE expires_at <= ?", (now,))
+        row = cursor.execute(
+            "SELECT token FROM callback_tokens WHERE action = ? AND payload = ?",
+            (action, stored)).fetchone()
+        if row:
+            token = row[0]
+            cursor.execute("UPDATE callback_tokens SET expires_at = ? WHERE token = ?",
+                           (now + self.ttl, token))
+        while not row:
+            token = _new_token()
+            cursor.execute("""
+                INSERT OR IGNORE INTO callback_tokens (token, action, payload, expires_at)
+                VALUES (?, ?, ?, ?)
+            """, (token, action, stored, now + self.ttl))
+            if cursor.rowcount:
+                break
+        conn.commit()
+        conn.close()
+        return f"{action}:{token}"
+
+    def resolve(self, data: str) -> Optional[Dict[str, Any]]:
+        """Получить данные действия по callback_data"""
+        action, token = split_callback(data)
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute("""
+            SELECT payload FROM callback_tokens
+            WHERE token = ? AND action = ? AND expires_at > ?
+        """, (token, action, self.clock())).fetchone()
+        conn.close()
+        return json.loads(row[0]) if row else None
+
+    def discard(self, data: str):
+        """Удалить токен, чтобы кнопку нельзя было нажать повторно"""
+        _, token = split_callback(data)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DELETE FROM callback_tokens WHERE token = ?", (token,))
+        conn.commit()
+        conn.close()
+
+
+# Реестр, которым пользуются клавиатуры и обработчики бота
+callback_registry = CallbackRegistry()
@@ -2,21 +2,262 @@
 Модуль для работы с базой данных SQLite
 Архитектор: проектирование схемы БД
 """
+import hashlib
+import json
+import math
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Any, Callable, List, Dict, Iterable, Iterator, Optional, Union
 from dataclasses import dataclass
 
 
+# Через сколько дней долг считается просроченным
+OVERDUE_DAYS = 7
+# Просрочен долг, которому больше OVERDUE_DAYS полных дней (timedelta.days > 7):
+# created_at <= datetime('now', OVERDUE_MODIFIER)
+OVERDUE_MODIFIER = f'-{OVERDUE_DAYS + 1} days'
+# Сколько расходов держать в кэше деталей
+EXPENSE_CACHE_SIZE = 256
+# Сколько хранить ответы по ключам идемпотентности, секунды
+IDEMPOTENCY_TTL = 24 * 60 * 60
+# Сколько последних расходов отдаёт get_dashboard
+DASHBOARD_EXPENSES_LIMIT = 50
+# Сколько последних поколений реестра хранить в row_changes: клиент с более
+# старой версией получает reset и загружает всё заново
+CHANGES_RETENTION = 10000
+# Сколько последних событий журнала хранить всегда: их читают и процессы без
+# позиции в event_cursors (кэш расходов, поток SSE)
+EVENTS_RETENTION = 10000
+# Выгрузки: поля строк в порядке колонок, запрос и условие по пользователю
+EXPORT_QUERIES = {
+    'expenses': (
+        ['id', 'created_at', 'description', 'total_amount', 'creator', 'cancelled',
+         'debts_count', 'paid_total', 'outstanding'],
+        """
+            SELECT e.id, e.created_at, e.description, e.total_amount,
+                   COALESCE(u.username, u.display_name) as creator,
+                   e.is_cancelled as cancelled,
+                   COUNT(d.id) as debts_count,
+                   COALESCE(SUM(d.paid_amount), 0) as paid_total,
+                   COALESCE(SUM(d.amount - d.paid_amount), 0) as outstanding
+            FROM expenses e
+            JOIN users u ON u.id = e.creator_id
+            LEFT JOIN debts d ON d.expense_id = e.id
+            WHERE {where}
+            GROUP BY e.id
+        """,
+        'e',
+        "(e.creator_id = ? OR EXISTS (SELECT 1 FROM debts p WHERE p.expense_id = e.id AND p.debtor_id = ?))",
+    ),
+    'debts': (
+        ['id', 'created_at', 'expense_id', 'description', 'debtor', 'creditor',
+         'amount', 'paid', 'remaining'],
+        """
+            SELECT d.id, d.created_at, d.expense_id, e.description,
+                   COALESCE(ud.username, ud.display_name) as debtor,
+                   COALESCE(uc.username, uc.display_name) as creditor,
+                   d.amount, d.paid_amount as paid, d.amount - d.paid_amount as remaining
+            FROM debts d
+            JOIN expenses e ON e.id = d.expense_id
+            JOIN users ud ON ud.id = d.debtor_id
+            JOIN users uc ON uc.id = d.creditor_id
+            WHERE {where}
+        """,
+        'd',
+        "(d.debtor_id = ? OR d.creditor_id = ?)",
+    ),
+    'history': (
+        ['id', 'created_at', 'operation_type', 'username', 'counterparty', 'expense_id',
+         'amount', 'description'],
+        """
+            SELECT h.id, h.created_at, h.op, h.expense_id, h.amount, h.details,
+                   COALESCE(u.username, u.display_name) as username,
+                   COALESCE(c.username, c.display_name) as counterparty,
+                   e.description as expense_description
+            FROM operation_history h
+            JOIN users u ON u.id = h.user_id
+            LEFT JOIN users c ON c.id = h.counterparty_id
+            LEFT JOIN expenses e ON e.id = h.expense_id
+            WHERE {where}
+        """,
+        'h',
+        "(h.user_id = ? OR h.counterparty_id = ?)",
+    ),
+}
+# Коды операций в operation_history.op
+HISTORY_OPS = {
+    'note': 0,
+    'expense_created': 1,
+    'payment': 2,
+    'expense_cancelled': 3,
+    'expense_amended': 4,
+}
+HISTORY_OP_NAMES = {code: name for name, code in HISTORY_OPS.items()}
+# Текст операций собирается при чтении: {expense} - текущее описание
+# расхода, {counterparty} - имя второй стороны, {details} - сводка изменений
+HISTORY_TEMPLATES = {
+    'expense_created': "Создан расход '{expense}' на {amount}р",
+    'payment': "Выплата {amount}р {counterparty}",
+    'expense_cancelled': "Отменён расход '{expense}'",
+    'expense_amended': "Изменён расход '{expense}': {details}",
+}
+# Строк импорта на одну транзакцию
+IMPORT_CHUNK_SIZE = 5000
+# Сколько ошибок импорта перечислять (остальные только считаются)
+IMPORT_MAX_ERRORS = 1000
+# Сортировки списка расходов: имя -> выражение SQL
+EXPENSE_SORT_KEYS = {
+    'created_at': 'e.created_at',
+    'total_amount': 'e.total_amount',
+    'outstanding': 'outstanding',
+}
+
+# Ссылка на пользователя: username или внутренний id из таблицы users
+UserRef = Union[str, int]
+
+
+class IdempotencyKeyConflict(ValueError):
+    """Ключ идемпотентности уже использован для другой операции"""
+
+
+class BatchOperationError(ValueError):
+    """Операция пакета не выполнена; весь пакет откатывается"""
+    
+    def __init__(self, index: int, message: str):
+        super().__init__(message)
+        self.index = index
+
+
+def is_user_name(value: Any) -> bool:
+    """Годится ли значение из внешнего ввода (JSON) как имя пользователя"""
+    return isinstance(value, str) and bool(value.strip())
+
+
+def parse_amount(value: Any) -> float:
+    """
+    Сумма из внешнего ввода (JSON): положительное конечное число или строка с ним
+    
+    Raises:
+        ValueError: значение не сумма (в том числе bool, inf и NaN)
+    """
+    # bool - подкласс int, но суммой не является
+    if not isinstance(value, (int, float, str)) or isinstance(value, bool):
+        raise ValueError("Неверная сумма")
+    amount = float(value)
+    if not math.isfinite(amount):
+        raise ValueError("Неверная сумма")
+    if amount <= 0:
+        raise ValueError("Сумма должна быть положительной")
+    return amount
+
+
+def format_timestamp(value: Union[datetime, str]) -> str:
+    """Привести дату к формату SQLite (CURRENT_TIMESTAMP)"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Разобрать дату из SQLite формата"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except:
+            return datetime.now()
+
+
+def format_amendment(diff: Dict) -> str:
+    """
+    Компактное описание изменений расхода для истории и ответов
+    
+    Пример: "сумма 2000→3000р; +Коля 1000р; −Маша; Петя 1000→1000р"
+    """
+    parts = []
+    if diff['description']:
+        parts.append(f"описание '{diff['description'][0]}'→'{diff['description'][1]}'")
+    if diff['total_amount']:
+        old, new = diff['total_amount']
+        parts.append(f"сумма {int(old)}→{int(new)}р")
+    for name, amount in diff['added']:
+        parts.append(f"+{name} {int(amount)}р")
+    for name in diff['removed']:
+        parts.append(f"−{name}")
+    for name, old, new in diff['changed']:
+        parts.append(f"{name} {int(old)}→{int(new)}р")
+    for name, amount in diff['refunds'].items():
+        parts.append(f"{name}: к возврату {int(amount)}р")
+    return '; '.join(parts) if parts else "без изменений"
+
+
+def format_history_amount(amount: Optional[float]) -> str:
+    """Сумма в тексте истории: целые без дробной части"""
+    if amount is None:
+        return ''
+    return str(int(amount)) if float(amount).is_integer() else str(amount)
+
+
+def render_history(op: int, amount: Optional[float], details: Optional[str],
+                   counterparty: Optional[str], expense: Optional[str]) -> str:
+    """
+    Текст записи истории по шаблону HISTORY_TEMPLATES
+    
+    details без места в шаблоне (заметки, старые записи, которые миграция
+    не смогла разобрать) - уже готовый текст.
+    """
+    template = HISTORY_TEMPLATES.get(HISTORY_OP_NAMES.get(op))
+    if details and (template is None or '{details}' not in template):
+        return details
+    if template is None:
+        return ''
+    return template.format(amount=format_history_amount(amount), details=details or '',
+                           counterparty=counterparty or '?', expense=expense or 'расход')
+
+
+def parse_history_description(operation_type: str, description: Optional[str]) -> tuple:
+    """
+    Разобрать текст старой записи истории для миграции
+    
+    Returns:
+        (имя второй стороны или None, details или None)
+    """
+    description = description or ''
+    if operation_type == 'payment':
+        match = re.match(r"Выплата [\d.]+р (.+)$", description, re.S)
+        return (match.group(1), None) if match else (None, description or None)
+    if operation_type == 'expense_amended':
+        match = re.match(r"Изменён расход '.*?': (.*)$", description, re.S)
+        return None, match.group(1) if match else description or None
+    if operation_type in ('expense_created', 'expense_cancelled'):
+        return None, None
+    return None, description or None
+
+
+@dataclass
+class User:
+    """Модель пользователя"""
+    id: int
+    telegram_id: Optional[int]
+    username: Optional[str]
+    display_name: Optional[str]
+
+
 @dataclass
 class Expense:
     """Модель расхода"""
     id: int
     description: str
     total_amount: float
-    creator_username: str
+    creator_id: int
     created_at: datetime
-    participants: List[str]
+    participants: List[int]
 
 
 @dataclass
@@ -24,8 +265,8 @@ class Debt:
     """Модель долга"""
     id: int
     expense_id: int
-    debtor_username: str
-    creditor_username: str
+    debtor_id: int
+    creditor_id: int
     amount: float
     paid_amount: float
     created_at: datetime
@@ -36,6 +277,20 @@ class Database:
     
     def __init__(self, db_path: str = "debts.db"):
         self.db_path = db_path
+        # Кэш username -> id пользователя (только подтверждённые в БД записи);
+        # сбрасывается, когда любой процесс меняет users_version
+        self._user_ids: Dict[str, int] = {}
+        self._users_version: Optional[int] = None
+        # Соединение, в котором users_version уже сверялся
+        self._users_checked_conn: Optional[sqlite3.Connection] = None
+        # Кэш telegram_id -> (id, username, display_name) для register_user
+        self._telegram_users: Dict[int, tuple] = {}
+        # LRU-кэш деталей расходов; изменения из других процессов
+        # отслеживаются по журналу событий
+        self._expense_cache: "OrderedDict[int, Dict]" = OrderedDict()
+        self._expense_cache_event_id: Optional[int] = None
+        self._expense_cache_lock = threading.Lock()
+        self.idempotency_ttl = IDEMPOTENCY_TTL
         self.init_db()
     
     def get_connection(self):
@@ -49,15 +304,27 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Таблица пользователей: компактный id вместо имени во всех таблицах
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE,
+                username TEXT UNIQUE,
+                display_name TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
         # Таблица расходов
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS expenses (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 description TEXT NOT NULL,
                 total_amount REAL NOT NULL,
-                creator_username TEXT NOT NULL,
+                creator_id INTEGER NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_cancelled INTEGER DEFAULT 0
+                is_cancelled INTEGER DEFAULT 0,
+                FOREIGN KEY (creator_id) REFERENCES users(id)
             )
         """)
         
@@ -66,122 +333,784 @@ class Database:
             CREATE TABLE IF NOT EXISTS debts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 expense_id INTEGER NOT NULL,
-                debtor_username TEXT NOT NULL,
-                creditor_username TEXT NOT NULL,
+                debtor_id INTEGER NOT NULL,
+                creditor_id INTEGER NOT NULL,
                 amount REAL NOT NULL,
                 paid_amount REAL DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (expense_id) REFERENCES expenses(id)
+                removed INTEGER DEFAULT 0,
+                reminded INTEGER DEFAULT 0,
+                FOREIGN KEY (expense_id) REFERENCES expenses(id),
+                FOREIGN KEY (debtor_id) REFERENCES users(id),
+                FOREIGN KEY (creditor_id) REFERENCES users(id)
             )
         """)
         
         # Таблица истории операций
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS operation_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                expense_id INTEGER,
+                op INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                counterparty_id INTEGER,
+                amount REAL,
+                details TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (expense_id) REFERENCES expenses(id),
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (counterparty_id) REFERENCES users(id)
+            )
+        """)
+        
+        # Миграция старой схемы, где пользователи хранились строками
+        self._migrate_usernames_to_ids(cursor)
+        # Миграция истории с готовым текстом на структурные поля
+        self._migrate_history_descriptions(cursor)
+        # Отметка участника, удалённого из расхода после частичной выплаты
+        cursor.execute("PRAGMA table_info(debts)")
+        debt_columns = [column['name'] for column in cursor.fetchall()]
+        if 'removed' not in debt_columns:
+            cursor.execute("ALTER TABLE debts ADD COLUMN removed INTEGER DEFAULT 0")
+        # Импортированный долг, уже просроченный при импорте: напоминание по
+        # нему не отправляется (позиция напоминаний идёт по created_at)
+        if 'reminded' not in debt_columns:
+            cursor.execute("ALTER TABLE debts ADD COLUMN reminded INTEGER DEFAULT 0")
+        
+        # Журнал событий для фоновых подписчиков (уведомления и т.п.)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Позиции подписчиков в журнале событий
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS event_cursors (
+                consumer TEXT PRIMARY KEY,
+                last_event_id INTEGER NOT NULL
+            )
+        """)
+        
+        # Счётчик поколений реестра: увеличивается при каждой записи,
+        # по нему веб-приложение отвечает 304 без чтения таблиц
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO ledger_meta (key, value) VALUES ('generation', 0)")
+        
+        # Последнее поколение, в котором менялась строка: по нему клиент
+        # получает только изменения с известной ему версии
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS row_changes (
+                entity TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                PRIMARY KEY (entity, row_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_row_changes_version ON row_changes(version)
+        """)
+        # Изменения до появления таблицы не записаны: более старым версиям
+        # клиента отвечаем полной перезагрузкой
+        cursor.execute("""
+            INSERT OR IGNORE INTO ledger_meta (key, value)
+            SELECT 'changes_since', value FROM ledger_meta WHERE key = 'generation'
+        """)
+        # Счётчик изменений привязки username -> id (слияния, смена владельца
+        # username): по нему процессы сбрасывают свои кэши id пользователей
+        cursor.execute("INSERT OR IGNORE INTO ledger_meta (key, value) VALUES ('users_version', 0)")
+        
+        # Результаты операций по ключам идемпотентности: повтор запроса с тем
+        # же ключом возвращает сохранённый результат без новой записи
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)
+        """)
+        
+        # Позиции напоминаний о просроченных долгах (created_at, id последнего долга)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reminder_watermarks (
+                name TEXT PRIMARY KEY,
+                last_created_at TIMESTAMP NOT NULL,
+                last_debt_id INTEGER NOT NULL
+            )
+        """)
+        
+        # Индекс по возрасту долга для выборки только что просроченных
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_debts_created_at ON debts(created_at, id)
+        """)
+        
+        # Индексы по id пользователей
+        for obsolete in ('idx_debts_pair', 'idx_debts_creditor', 'idx_debts_pair_active'):
+            cursor.execute(f"DROP INDEX IF EXISTS {obsolete}")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_debts_pair_created ON debts(debtor_id, creditor_id, created_at)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_debts_debtor_created ON debts(debtor_id, created_at)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_debts_creditor_created ON debts(creditor_id, created_at)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_debts_expense ON debts(expense_id)
+        """)
+        
+        # Поиск расхода по описанию ("расход X", "отменить X")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_expenses_description ON expenses(description, created_at)
+        """)
+        
+        # Список расходов: по дате и по создателю
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_expenses_created ON expenses(created_at, id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_expenses_creator_created ON expenses(creator_id, created_at, id)
+        """)
+        
+        # Индексы для постраничного чтения истории от новых к старым
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_history_created ON operation_history(created_at, id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_history_expense_created ON operation_history(expense_id, created_at, id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_history_counterparty_created
+            ON operation_history(counterparty_id, created_at, id)
+        """)
+        
+        conn.commit()
+        conn.close()
+    
+    def _migrate_usernames_to_ids(self, cursor):
+        """
+        Перевести таблицы со строковых имён на id из таблицы users
+        
+        Старые таблицы пересоздаются с id-колонками, имена переносятся
+        в users, чаты из user_chats становятся telegram_id.
+        """
+        cursor.execute("PRAGMA table_info(expenses)")
+        if 'creator_username' not in [column['name'] for column in cursor.fetchall()]:
+            return
+        
+        cursor.execute("""
+            INSERT OR IGNORE INTO users (username)
+            SELECT creator_username FROM expenses
+            UNION SELECT debtor_username FROM debts
+            UNION SELECT creditor_username FROM debts
+            UNION SELECT username FROM operation_history
+        """)
+        
+        cursor.execute("""
+            SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'user_chats'
+        """)
+        if cursor.fetchone():
+            cursor.execute("""
+                UPDATE users SET telegram_id = (
+                    SELECT chat_id FROM user_chats c WHERE c.username = users.username
+                )
+                WHERE telegram_id IS NULL
+            """)
+            cursor.execute("DROP TABLE user_chats")
+        
+        cursor.execute("""
+            CREATE TABLE expenses_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                description TEXT NOT NULL,
+                total_amount REAL NOT NULL,
+                creator_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_cancelled INTEGER DEFAULT 0,
+                FOREIGN KEY (creator_id) REFERENCES users(id)
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO expenses_new (id, description, total_amount, creator_id, created_at, is_cancelled)
+            SELECT e.id, e.description, e.total_amount, u.id, e.created_at, e.is_cancelled
+            FROM expenses e JOIN users u ON u.username = e.creator_username
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE debts_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                expense_id INTEGER NOT NULL,
+                debtor_id INTEGER NOT NULL,
+                creditor_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                paid_amount REAL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (expense_id) REFERENCES expenses(id),
+                FOREIGN KEY (debtor_id) REFERENCES users(id),
+                FOREIGN KEY (creditor_id) REFERENCES users(id)
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO debts_new (id, expense_id, debtor_id, creditor_id, amount, paid_amount, created_at)
+            SELECT d.id, d.expense_id, ud.id, uc.id, d.amount, d.paid_amount, d.created_at
+            FROM debts d
+            JOIN users ud ON ud.username = d.debtor_username
+            JOIN users uc ON uc.username = d.creditor_username
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE operation_history_new (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 expense_id INTEGER,
                 operation_type TEXT NOT NULL,
-                username TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
                 description TEXT,
                 amount REAL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (expense_id) REFERENCES expenses(id)
+                FOREIGN KEY (expense_id) REFERENCES expenses(id),
+                FOREIGN KEY (user_id) REFERENCES users(id)
             )
         """)
+        cursor.execute("""
+            INSERT INTO operation_history_new (id, expense_id, operation_type, user_id, description, amount, created_at)
+            SELECT h.id, h.expense_id, h.operation_type, u.id, h.description, h.amount, h.created_at
+            FROM operation_history h JOIN users u ON u.username = h.username
+        """)
+        
+        for table in ('expenses', 'debts', 'operation_history'):
+            cursor.execute(f"DROP TABLE {table}")
+            cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    
+    def _migrate_history_descriptions(self, cursor):
+        """
+        Перевести историю с готового текста на структурные поля
+        
+        operation_type становится кодом op, имя кредитора из текста выплаты -
+        counterparty_id, сводка изменений расхода - details. Текст, который
+        не удалось разобрать, целиком сохраняется в details и показывается
+        как есть. Таблица пересоздаётся без колонок operation_type и description.
+        """
+        cursor.execute("PRAGMA table_info(operation_history)")
+        if 'description' not in [column['name'] for column in cursor.fetchall()]:
+            return
+        
+        user_ids = {}
+        for row in cursor.execute("SELECT id, username, display_name FROM users ORDER BY id DESC"):
+            for name in (row['display_name'], row['username']):
+                if name:
+                    user_ids[name] = row['id']
+        
+        def converted_rows():
+            for row in cursor.execute("""
+                SELECT id, expense_id, operation_type, user_id, description, amount, created_at
+                FROM operation_history
+            """).fetchall():
+                counterparty, details = parse_history_description(row['operation_type'],
+                                                                  row['description'])
+                counterparty_id = user_ids.get(counterparty)
+                if counterparty is not None and counterparty_id is None:
+                    details = row['description']
+                op = HISTORY_OPS.get(row['operation_type'])
+                if op is None:
+                    op = HISTORY_OPS['note']
+                    details = row['description'] or row['operation_type']
+                yield (row['id'], row['expense_id'], op, row['user_id'], counterparty_id,
+                       row['amount'], details, row['created_at'])
+        
+        cursor.execute("""
+            CREATE TABLE operation_history_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                expense_id INTEGER,
+                op INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                counterparty_id INTEGER,
+                amount REAL,
+                details TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (expense_id) REFERENCES expenses(id),
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (counterparty_id) REFERENCES users(id)
+            )
+        """)
+        cursor.executemany("""
+            INSERT INTO operation_history_new (id, expense_id, op, user_id, counterparty_id,
+                                               amount, details, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, list(converted_rows()))
+        cursor.execute("DROP TABLE operation_history")
+        cursor.execute("ALTER TABLE operation_history_new RENAME TO operation_history")
+    
+    def _user_id(self, cursor, user: UserRef, create: bool = True) -> Optional[int]:
+        """
+        Получить id пользователя
+        
+        Args:
+            cursor: Курсор текущей транзакции
+            user: username или id пользователя
+            create: Создать пользователя, если username ещё не встречался
+        
+        Returns:
+            id пользователя или None если не найден и create=False
+        
+        Raises:
+            ValueError: id не существует (при create=True) или ссылка не
+                строка и не id
+        """
+        if isinstance(user, int) and not isinstance(user, bool):
+            # Id создаются только регистрацией, поэтому его существование проверяем
+            cursor.execute("SELECT id FROM users WHERE id = ?", (user,))
+            if cursor.fetchone():
+                return user
+            if create:
+                raise ValueError(f"Пользователь {user} не найден")
+            return None
+        if not isinstance(user, str):
+            raise ValueError(f"Неверная ссылка на пользователя: {user!r}")
+        
+        if user in self._user_ids:
+            self._sync_user_cache(cursor)
+        user_id = self._user_ids.get(user)
+        if user_id is not None:
+            return user_id
+        
+        cursor.execute("SELECT id FROM users WHERE username = ?", (user,))
+        row = cursor.fetchone()
+        if row:
+            # Кэшируем только уже сохранённые записи: новая может откатиться
+            self._user_ids[user] = row['id']
+            return row['id']
+        
+        if not create:
+            return None
+        
+        cursor.execute("INSERT INTO users (username) VALUES (?)", (user,))
+        return cursor.lastrowid
+    
+    def _sync_user_cache(self, cursor):
+        """
+        Сбросить кэш id пользователей, если привязки менялись в любом процессе
+        
+        Бот и веб-приложение работают в разных процессах: слияние или смена
+        владельца username в одном из них увеличивает users_version в БД.
+        Проверка - один запрос на соединение; в транзакции на запись она
+        идёт под блокировкой, поэтому записи не получают удалённый id.
+        """
+        if cursor.connection is self._users_checked_conn:
+            return
+        cursor.execute("SELECT value FROM ledger_meta WHERE key = 'users_version'")
+        version = cursor.fetchone()['value']
+        if version != self._users_version:
+            self._user_ids.clear()
+            self._telegram_users.clear()
+            self._users_version = version
+        self._users_checked_conn = cursor.connection
+    
+    def _user_name(self, cursor, user: UserRef) -> str:
+        """Получить отображаемое имя пользователя"""
+        if isinstance(user, str):
+            return user
+        cursor.execute("""
+            SELECT COALESCE(username, display_name) as name FROM users WHERE id = ?
+        """, (user,))
+        row = cursor.fetchone()
+        return row['name'] if row else str(user)
+    
+    def register_user(self, telegram_id: int, username: Optional[str] = None,
+                      display_name: Optional[str] = None) -> int:
+        """
+        Зарегистрировать пользователя Telegram или обновить его имя
+        
+        Переименование сохраняет id, поэтому долги и история не теряются.
+        Если username уже встречался в упоминаниях (@username), запись
+        привязывается к telegram_id.
+        
+        Args:
+            telegram_id: ID пользователя в Telegram
+            username: Username в Telegram (может отсутствовать)
+            display_name: Отображаемое имя
+        
+        Returns:
+            id пользователя
+        """
+        cached = self._telegram_users.get(telegram_id)
+        if cached and cached[1:] == (username, display_name):
+            return cached[0]
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id, username FROM users WHERE telegram_id = ?", (telegram_id,))
+        row = cursor.fetchone()
+        user_id = row['id'] if row else None
+        
+        if username and (row is None or row['username'] != username):
+            cursor.execute("SELECT id, telegram_id FROM users WHERE username = ?", (username,))
+            holder = cursor.fetchone()
+            if holder and holder['telegram_id'] is None:
+                if user_id is None:
+                    # Пользователя уже упоминали через @ - привязываем telegram_id
+                    user_id = holder['id']
+                    cursor.execute("UPDATE users SET telegram_id = ? WHERE id = ?", (telegram_id, user_id))
+                else:
+                    # Сливаем запись из упоминаний с уже известным пользователем
+                    self._merge_users(cursor, holder['id'], user_id)
+            elif holder:
+                # Username в Telegram уникален: прежний владелец его сменил
+                cursor.execute("UPDATE users SET username = NULL WHERE id = ?", (holder['id'],))
+            cursor.execute("UPDATE ledger_meta SET value = value + 1 WHERE key = 'users_version'")
+            self._user_ids.clear()
+            # Имена в кэшированных деталях расходов устарели
+            self._invalidate_expenses()
+            self._bump_generation(cursor)
+            self._record_changes(cursor, 'ledger', [0])
+        
+        if user_id is None:
+            cursor.execute("""
+                INSERT INTO users (telegram_id, username, display_name) VALUES (?, ?, ?)
+            """, (telegram_id, username, display_name))
+            user_id = cursor.lastrowid
+        else:
+            cursor.execute("""
+                UPDATE users SET username = COALESCE(?, username), display_name = ?
+                WHERE id = ? AND (username IS NOT COALESCE(?, username) OR display_name IS NOT ?)
+            """, (username, display_name, user_id, username, display_name))
+            if cursor.rowcount:
+                # display_name показывается вместо username, если его нет
+                self._invalidate_expenses()
+                self._bump_generation(cursor)
+                self._record_changes(cursor, 'ledger', [0])
         
         conn.commit()
         conn.close()
+        
+        self._telegram_users[telegram_id] = (user_id, username, display_name)
+        return user_id
+    
+    def _merge_users(self, cursor, source_id: int, target_id: int):
+        """Перенести все ссылки с пользователя source_id на target_id и удалить source_id"""
+        cursor.execute("UPDATE expenses SET creator_id = ? WHERE creator_id = ?", (target_id, source_id))
+        cursor.execute("UPDATE debts SET debtor_id = ? WHERE debtor_id = ?", (target_id, source_id))
+        cursor.execute("UPDATE debts SET creditor_id = ? WHERE creditor_id = ?", (target_id, source_id))
+        cursor.execute("UPDATE operation_history SET user_id = ? WHERE user_id = ?", (target_id, source_id))
+        cursor.execute("UPDATE operation_history SET counterparty_id = ? WHERE counterparty_id = ?",
+                       (target_id, source_id))
+        cursor.execute("DELETE FROM users WHERE id = ?", (source_id,))
+    
+    def get_user_id(self, username: str) -> Optional[int]:
+        """Получить id пользователя по username (None если не встречался)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        user_id = self._user_id(cursor, username, create=False)
+        conn.close()
+        return user_id
+    
+    def _emit_event(self, cursor, event_type: str, payload: Dict):
+        """
+        Записать событие в журнал в рамках текущей транзакции
+        
+        Доставка подписчикам асинхронная: запись в журнал - единственная
+        стоимость для пути записи.
+        """
+        cursor.execute("""
+            INSERT INTO events (event_type, payload) VALUES (?, ?)
+        """, (event_type, json.dumps(payload, ensure_ascii=False)))
+        self._bump_generation(cursor)
+    
+    def _bump_generation(self, cursor):
+        """Отметить изменение реестра в рамках текущей транзакции"""
+        cursor.execute("UPDATE ledger_meta SET value = value + 1 WHERE key = 'generation'")
+    
+    def _record_changes(self, cursor, entity: str, row_ids: List[int]):
+        """
+        Отметить строки изменёнными в текущем поколении
+        
+        Вызывается после _bump_generation в той же транзакции. Сущности:
+        'debt', 'expense', 'history' и 'ledger' (строка 0 - изменение, затрагивающее
+        весь реестр, например переименование; клиент перезагружает всё).
+        """
+        cursor.executemany("""
+            INSERT INTO row_changes (entity, row_id, version)
+            SELECT ?, ?, value FROM ledger_meta WHERE key = 'generation'
+            ON CONFLICT (entity, row_id) DO UPDATE SET version = excluded.version
+        """, [(entity, row_id) for row_id in row_ids])
+    
+    def get_ledger_version(self) -> int:
+        """
+        Текущее поколение реестра
+        
+        Меняется при любой записи, влияющей на выдачу API (расходы, выплаты,
+        отмены, изменения, переименования пользователей).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM ledger_meta WHERE key = 'generation'")
+        version = cursor.fetchone()['value']
+        conn.close()
+        return version
+    
+    def get_overdue_boundary(self) -> int:
+        """
+        Id самого старого активного долга, который ещё не просрочен (0 - таких нет)
+        
+        Флаг overdue зависит от текущего времени, а не только от записей.
+        Между записями этот id меняется ровно тогда, когда долг становится
+        просроченным, поэтому вместе с поколением реестра он определяет
+        флаги overdue в ответах API.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id FROM debts
+            WHERE created_at > datetime('now', ?) AND (amount - paid_amount) > 0
+            ORDER BY created_at, id
+            LIMIT 1
+        """, (OVERDUE_MODIFIER,))
+        row = cursor.fetchone()
+        conn.close()
+        return row['id'] if row else 0
     
     def create_expense(self, description: str, total_amount: float, 
-                      creator_username: str, participants: List[str]) -> int:
+                      creator_username: UserRef, participants: List[UserRef],
+                      idempotency_key: Optional[str] = None) -> int:
         """
         Создать расход и распределить долги
         
         Args:
             description: Описание расхода
             total_amount: Общая сумма
-            creator_username: Кто создал (кредитор)
-            participants: Список участников (должников)
+            creator_username: Кто создал (кредитор), username или id
+            participants: Список участников (должников), username или id
+            idempotency_key: Ключ повтора: расход с тем же ключом создаётся один раз
         
         Returns:
             ID созданного расхода
         """
+        with self._transaction() as cursor:
+            return self._run_once(
+                cursor, idempotency_key,
+                ['create_expense', description, total_amount, creator_username, participants],
+                lambda: self._insert_expense(cursor, description, total_amount,
+                                             creator_username, participants))
+    
+    @contextmanager
+    def _transaction(self):
+        """
+        Транзакция на запись: курсор внутри блока, фиксация при выходе
+        
+        Блокировка берётся сразу (BEGIN IMMEDIATE). При исключении всё
+        откатывается, а кэш id пользователей сбрасывается: в нём могли
+        оказаться записи, созданные в откатанной транзакции.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            self._user_ids.clear()
+            raise
+        finally:
+            conn.close()
+    
+    def _run_once(self, cursor, key: Optional[str], request: List, apply: Callable[[], Any]) -> Any:
+        """
+        Выполнить операцию не больше одного раза на ключ идемпотентности
+        
+        Проверка ключа, операция и сохранение результата идут в одной
+        транзакции на запись, поэтому одновременные повторы не проходят
+        дважды. Результат должен сериализоваться в JSON.
+        
+        Args:
+            key: Ключ идемпотентности (None - выполнить без проверки)
+            request: Название операции и аргументы; повтор ключа с другими
+                аргументами - ошибка IdempotencyKeyConflict
+            apply: Операция в рамках текущей транзакции
+        """
+        if key is None:
+            return apply()
+        
+        fingerprint = hashlib.sha256(
+            json.dumps(request, ensure_ascii=False, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        now = time.time()
+        cursor.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+        cursor.execute("SELECT fingerprint, response FROM idempotency_keys WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        if row is not None:
+            if row['fingerprint'] != fingerprint:
+                raise IdempotencyKeyConflict(f"Ключ {key} уже использован для другой операции")
+            return json.loads(row['response'])
+        
+        result = apply()
+        cursor.execute("""
+            INSERT INTO idempotency_keys (key, fingerprint, response, expires_at)
+            VALUES (?, ?, ?, ?)
+        """, (key, fingerprint, json.dumps(result, ensure_ascii=False), now + self.idempotency_ttl))
+        return result
+    
+    def _insert_expense(self, cursor, description: str, total_amount: float,
+                        creator_username: UserRef, participants: List[UserRef]) -> int:
+        """Создать расход в рамках текущей транзакции (см. create_expense)"""
+        creator_id = self._user_id(cursor, creator_username)
+        creator_name = self._user_name(cursor, creator_username)
         
         # Создаём расход
         cursor.execute("""
-            INSERT INTO expenses (description, total_amount, creator_username)
+            INSERT INTO expenses (description, total_amount, creator_id)
             VALUES (?, ?, ?)
-        """, (description, total_amount, creator_username))
+        """, (description, total_amount, creator_id))
         
         expense_id = cursor.lastrowid
         
         # Распределяем долги
         amount_per_person = total_amount / len(participants)
+        event_debts = []
         for participant in participants:
             cursor.execute("""
-                INSERT INTO debts (expense_id, debtor_username, creditor_username, amount)
+                INSERT INTO debts (expense_id, debtor_id, creditor_id, amount)
                 VALUES (?, ?, ?, ?)
-            """, (expense_id, participant, creator_username, amount_per_person))
+            """, (expense_id, self._user_id(cursor, participant), creator_id, amount_per_person))
+            event_debts.append({'id': cursor.lastrowid, 'debtor': self._user_name(cursor, participant),
+                                'amount': amount_per_person})
         
         # Записываем в историю
         cursor.execute("""
-            INSERT INTO operation_history (expense_id, operation_type, username, description, amount)
-            VALUES (?, ?, ?, ?, ?)
-        """, (expense_id, 'expense_created', creator_username, 
-              f"Создан расход '{description}' на {total_amount}р", total_amount))
-        
-        conn.commit()
-        conn.close()
+            INSERT INTO operation_history (expense_id, op, user_id, amount)
+            VALUES (?, ?, ?, ?)
+        """, (expense_id, HISTORY_OPS['expense_created'], creator_id, total_amount))
+        history_id = cursor.lastrowid
+        
+        self._emit_event(cursor, 'expense_created', {
+            'expense_id': expense_id,
+            'description': description,
+            'creditor': creator_name,
+            'total_amount': total_amount,
+            'debts': event_debts
+        })
+        self._record_changes(cursor, 'debt', [debt['id'] for debt in event_debts])
+        self._record_changes(cursor, 'expense', [expense_id])
+        self._record_changes(cursor, 'history', [history_id])
         
         return expense_id
     
-    def pay_debt(self, debtor_username: str, creditor_username: str, 
-                 amount: float) -> bool:
+    def pay_debt(self, debtor_username: UserRef, creditor_username: UserRef, 
+                 amount: float, idempotency_key: Optional[str] = None) -> bool:
         """
         Выплатить долг
         
         Args:
-            debtor_username: Кто платит
-            creditor_username: Кому платит
+            debtor_username: Кто платит (username или id)
+            creditor_username: Кому платит (username или id)
             amount: Сумма выплаты
+            idempotency_key: Ключ повтора: выплата с тем же ключом проводится один
+                раз, повтор возвращает прежний результат
         
         Returns:
             True если успешно, False если долга нет или сумма больше долга
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self._transaction() as cursor:
+            def apply():
+                debtor_id = self._user_id(cursor, debtor_username, create=False)
+                creditor_id = self._user_id(cursor, creditor_username, create=False)
+                return self._apply_payment(cursor, debtor_id, creditor_id, amount) is not None
+            
+            return self._run_once(cursor, idempotency_key,
+                                  ['pay_debt', debtor_username, creditor_username, amount], apply)
+    
+    def _apply_payment(self, cursor, debtor_id: Optional[int], creditor_id: Optional[int],
+                       amount: float) -> Optional[float]:
+        """
+        Погасить долги пары в рамках текущей транзакции (старые первыми)
         
-        # Находим активные долги
+        Returns:
+            Сумма долга до выплаты или None, если долга нет
+        """
+        owed = self._owed(cursor, debtor_id, creditor_id)
+        if not owed > 0:
+            return None
+        
+        debts = self._active_pair_debts(cursor, debtor_id, creditor_id, amount)
+        # Для истории берём расход самого старого долга
+        expense_id = debts[0]['expense_id']
+        event_debts, expense_ids = self._settle_debts(cursor, debts, amount)
+        
+        debtor_name = self._user_name(cursor, debtor_id)
+        creditor_name = self._user_name(cursor, creditor_id)
+        
+        # Записываем в историю
         cursor.execute("""
-            SELECT id, amount, paid_amount
+            INSERT INTO operation_history (expense_id, op, user_id, counterparty_id, amount)
+            VALUES (?, ?, ?, ?, ?)
+        """, (expense_id, HISTORY_OPS['payment'], debtor_id, creditor_id, amount))
+        history_id = cursor.lastrowid
+        
+        self._emit_event(cursor, 'payment', {
+            'expense_id': expense_id,
+            'debtor': debtor_name,
+            'creditor': creditor_name,
+            'amount': amount,
+            'debts': event_debts,
+            'expense_ids': expense_ids
+        })
+        self._record_changes(cursor, 'debt', [debt['id'] for debt in event_debts])
+        self._record_changes(cursor, 'expense', expense_ids)
+        self._record_changes(cursor, 'history', [history_id])
+        self._invalidate_expenses(expense_ids)
+        return owed
+    
+    def _active_pair_debts(self, cursor, debtor_id: Optional[int], creditor_id: Optional[int],
+                           amount: float) -> List[sqlite3.Row]:
+        """
+        Самые старые активные долги пары, которые покрывают amount
+        
+        У пары могут копиться тысячи частично погашенных долгов, а выплата
+        трогает лишь первые из них - остальные не читаются.
+        """
+        cursor.execute("""
+            SELECT id, expense_id, amount, paid_amount
             FROM debts
-            WHERE debtor_username = ? AND creditor_username = ?
+            WHERE debtor_id = ? AND creditor_id = ?
             AND (amount - paid_amount) > 0
             ORDER BY created_at
-        """, (debtor_username, creditor_username))
-        
-        debts = cursor.fetchall()
-        
-        if not debts:
-            conn.close()
-            return False
+        """, (debtor_id, creditor_id))
+        debts = []
+        covered = 0
+        for debt in cursor:
+            debts.append(debt)
+            covered += debt['amount'] - debt['paid_amount']
+            if covered >= amount:
+                break
+        return debts
+    
+    def _settle_debts(self, cursor, debts: List[sqlite3.Row], amount: float) -> tuple:
+        """
+        Распределить выплату по долгам (в порядке списка)
         
+        Returns:
+            (изменённые долги [{'id', 'remaining'}], id затронутых расходов)
+        """
         remaining = amount
-        expense_id = None
+        event_debts = []
+        expense_ids = []
         for debt in debts:
             debt_id = debt['id']
-            debt_amount = debt['amount']
-            paid = debt['paid_amount']
-            remaining_debt = debt_amount - paid
-            
-            # Получаем expense_id для истории
-            if expense_id is None:
-                cursor.execute("SELECT expense_id FROM debts WHERE id = ?", (debt_id,))
-                exp_row = cursor.fetchone()
-                if exp_row:
-                    expense_id = exp_row['expense_id']
+            remaining_debt = debt['amount'] - debt['paid_amount']
+            if debt['expense_id'] not in expense_ids:
+                expense_ids.append(debt['expense_id'])
             
             if remaining >= remaining_debt:
                 # Полностью погашаем долг
@@ -191,6 +1120,7 @@ class Database:
                     WHERE id = ?
                 """, (debt_id,))
                 remaining -= remaining_debt
+                event_debts.append({'id': debt_id, 'remaining': 0})
             else:
                 # Частично погашаем
                 cursor.execute("""
@@ -198,26 +1128,375 @@ class Database:
                     SET paid_amount = paid_amount + ?
                     WHERE id = ?
                 """, (remaining, debt_id))
+                event_debts.append({'id': debt_id, 'remaining': remaining_debt - remaining})
                 remaining = 0
                 break
         
-        # Записываем в историю
+        return event_debts, expense_ids
+    
+    def _owed(self, cursor, debtor_id: Optional[int], creditor_id: Optional[int]) -> float:
+        """Остаток долга пары в рамках текущей транзакции"""
         cursor.execute("""
-            INSERT INTO operation_history (expense_id, operation_type, username, description, amount)
-            VALUES (?, ?, ?, ?, ?)
-        """, (expense_id, 'payment', debtor_username, 
-              f"Выплата {amount}р {creditor_username}", amount))
+            SELECT COALESCE(SUM(amount - paid_amount), 0) as total
+            FROM debts
+            WHERE debtor_id = ? AND creditor_id = ?
+            AND (amount - paid_amount) > 0
+        """, (debtor_id, creditor_id))
+        return cursor.fetchone()['total']
+    
+    def pay_debt_and_summarize(self, debtor_username: UserRef, creditor_username: UserRef,
+                               amount: float) -> Dict:
+        """
+        Выплатить долг и сразу получить итог для ответа пользователю
         
-        conn.commit()
-        conn.close()
-        return True
+        Проверка суммы, выплата, остаток пары и список остальных должников
+        кредитора выполняются в одной транзакции индексными запросами.
+        
+        Args:
+            debtor_username: Кто платит (username или id)
+            creditor_username: Кому платит (username или id)
+            amount: Сумма выплаты
+        
+        Returns:
+            Словарь со статусом ('paid', 'no_debt' или 'too_much'), долгом до
+            выплаты (owed), остатком (remaining) и остальными должниками
+            кредитора (other_debtors: [{'debtor', 'remaining'}])
+        """
+        # Блокировка на запись сразу: сумма не изменится между проверкой и выплатой
+        with self._transaction() as cursor:
+            debtor_id = self._user_id(cursor, debtor_username, create=False)
+            creditor_id = self._user_id(cursor, creditor_username, create=False)
+            
+            owed = self._owed(cursor, debtor_id, creditor_id)
+            
+            result = {'status': 'paid', 'owed': owed, 'remaining': owed, 'other_debtors': []}
+            if owed == 0:
+                result['status'] = 'no_debt'
+            elif amount > owed:
+                result['status'] = 'too_much'
+            else:
+                self._apply_payment(cursor, debtor_id, creditor_id, amount)
+                result['remaining'] = owed - amount
+                if result['remaining'] == 0:
+                    cursor.execute("""
+                        SELECT COALESCE(u.username, u.display_name) as debtor,
+                               SUM(d.amount - d.paid_amount) as remaining
+                        FROM debts d
+                        JOIN users u ON u.id = d.debtor_id
+                        WHERE d.creditor_id = ? AND d.debtor_id != ?
+                        AND (d.amount - d.paid_amount) > 0
+                        GROUP BY d.debtor_id
+                        ORDER BY MIN(d.created_at)
+                    """, (creditor_id, debtor_id))
+                    result['other_debtors'] = [dict(row) for row in cursor.fetchall()]
+        
+        return result
+    
+    def execute_batch(self, operations: List[Dict], idempotency_key: Optional[str] = None) -> Dict:
+        """
+        Выполнить пакет операций в одной транзакции
+        
+        Операции выполняются по порядку; если хоть одна не прошла, откатывается
+        весь пакет. Каждая операция - словарь с полем type:
+            {'type': 'expense', 'description', 'amount', 'creator', 'participants'}
+            {'type': 'payment', 'debtor', 'creditor', 'amount'}
+        Выплата больше долга или без долга считается ошибкой.
+        
+        Args:
+            operations: Список операций
+            idempotency_key: Ключ повтора: успешный пакет с тем же ключом не
+                выполняется повторно, возвращается прежний результат
+        
+        Returns:
+            Словарь {'success': bool, 'results': [...]}; результат операции -
+            {'index', 'status': 'ok', ...} с expense_id или owed/remaining, а
+            при неудаче пакета - 'error' (с полем error) у сломавшейся
+            операции, 'rolled_back' у предыдущих и 'skipped' у следующих
+        """
+        def apply():
+            return {'success': True, 'results': [
+                {'index': index, 'status': 'ok', **self._apply_operation(cursor, index, operation)}
+                for index, operation in enumerate(operations)
+            ]}
+        
+        try:
+            with self._transaction() as cursor:
+                return self._run_once(cursor, idempotency_key, ['execute_batch', operations], apply)
+        except BatchOperationError as e:
+            return {
+                'success': False,
+                'results': [{'index': i, 'status': 'rolled_back'} for i in range(e.index)] +
+                           [{'index': e.index, 'status': 'error', 'error': str(e)}] +
+                           [{'index': i, 'status': 'skipped'}
+                            for i in range(e.index + 1, len(operations))]
+            }
     
-    def get_debts(self, creditor_username: Optional[str] = None) -> List[Dict]:
+    def bulk_import(self, records: Iterable[Dict], chunk_size: int = IMPORT_CHUNK_SIZE,
+                    dry_run: bool = False,
+                    progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Импортировать исторические расходы и выплаты
+        
+        Записи пишутся пачками по chunk_size в отдельных транзакциях: долги и
+        история вставляются executemany, уведомления по каждой записи не
+        рассылаются - на пачку пишется одно событие 'ledger_imported'.
+        Выплата без долга или больше долга пропускается с ошибкой.
+        
+        Долги сохраняют исторический created_at. Уже просроченные при импорте
+        отмечаются reminded=1, и get_newly_overdue_debts их не возвращает;
+        остальные напоминаются, когда пересекут порог, как обычные.
+        
+        Args:
+            records: Проверенные записи (см. src.importer):
+                {'line', 'type': 'expense', 'created_at', 'description',
+                 'amount', 'creditor', 'shares': [(должник, сумма)]} или
+                {'line', 'type': 'payment', 'created_at', 'debtor',
+                 'creditor', 'amount'}; created_at - 'YYYY-MM-DD HH:MM:SS'
+            chunk_size: Записей на транзакцию
+            dry_run: Выполнить всё в одной транзакции и откатить её; записи
+                сначала читаются целиком, чтобы блокировка на запись не
+                держалась, пока источник (например, загрузка по сети) ещё читается
+            progress: Вызывается после каждой пачки с текущим итогом
+        
+        Returns:
+            Итог {'rows', 'expenses', 'payments', 'errors': [{'line', 'error'}],
+            'error_count', 'dry_run'}
+        """
+        summary = {'rows': 0, 'expenses': 0, 'payments': 0,
+                   'errors': [], 'error_count': 0, 'dry_run': dry_run}
+        user_ids: Dict[str, int] = {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        def write(chunk):
+            if not dry_run:
+                cursor.execute("BEGIN IMMEDIATE")
+            touched = self._import_chunk(cursor, chunk, user_ids, summary)
+            if not dry_run:
+                conn.commit()
+                self._invalidate_expenses(touched)
+            summary['rows'] += len(chunk)
+            if progress:
+                progress(summary)
+        
+        try:
+            if dry_run:
+                records = list(records)
+                cursor.execute("BEGIN IMMEDIATE")
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    write(chunk)
+                    chunk = []
+            if chunk:
+                write(chunk)
+            if dry_run:
+                conn.rollback()
+                self._user_ids.clear()
+        except BaseException:
+            conn.rollback()
+            self._user_ids.clear()
+            raise
+        finally:
+            conn.close()
+        return summary
+    
+    def _import_chunk(self, cursor, chunk: List[Dict], user_ids: Dict[str, int],
+                      summary: Dict) -> List[int]:
+        """Записать пачку импорта в текущей транзакции; вернуть id изменённых прежних расходов"""
+        debts_rows: List[tuple] = []
+        history_rows: List[tuple] = []
+        touched = set()
+        imported = summary['expenses'] + summary['payments']
+        # Остаток долга пар в этой пачке: выплата проверяется без SUM по всем
+        # долгам пары, а дописывать отложенные долги нужно только своей пары
+        owed_by_pair: Dict[tuple, float] = {}
+        pending_pairs = set()
+        cursor.execute("SELECT datetime('now', ?) as boundary", (OVERDUE_MODIFIER,))
+        overdue_boundary = cursor.fetchone()['boundary']
+        
+        def user_id(name: str, create: bool = True) -> Optional[int]:
+            if name not in user_ids:
+                found = self._user_id(cursor, name, create=create)
+                if found is None:
+                    return None
+                user_ids[name] = found
+            return user_ids[name]
+        
+        def flush():
+            cursor.executemany("""
+                INSERT INTO debts (expense_id, debtor_id, creditor_id, amount, created_at, reminded)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, debts_rows)
+            cursor.executemany("""
+                INSERT INTO operation_history (expense_id, op, user_id, counterparty_id,
+                                               amount, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, history_rows)
+            debts_rows.clear()
+            history_rows.clear()
+            pending_pairs.clear()
+        
+        for record in chunk:
+            created_at = record['created_at']
+            if record['type'] == 'expense':
+                creditor_id = user_id(record['creditor'])
+                cursor.execute("""
+                    INSERT INTO expenses (description, total_amount, creator_id, created_at)
+                    VALUES (?, ?, ?, ?)
+                """, (record['description'], record['amount'], creditor_id, created_at))
+                expense_id = cursor.lastrowid
+                # Своя доля кредитора остаётся у него и долгом не становится
+                for debtor, share in record['shares']:
+                    debtor_id = user_id(debtor)
+                    if debtor_id != creditor_id:
+                        debts_rows.append((expense_id, debtor_id, creditor_id, share, created_at,
+                                           int(created_at <= overdue_boundary)))
+                        pending_pairs.add((debtor_id, creditor_id))
+                        if (debtor_id, creditor_id) in owed_by_pair:
+                            owed_by_pair[debtor_id, creditor_id] += share
+                history_rows.append((expense_id, HISTORY_OPS['expense_created'], creditor_id, None,
+                                     record['amount'], created_at))
+                summary['expenses'] += 1
+                continue
+            
+            debtor_id = user_id(record['debtor'], create=False)
+            creditor_id = user_id(record['creditor'], create=False)
+            pair = (debtor_id, creditor_id)
+            # Выплата гасит и долги из этой же пачки - сначала дописываем их
+            if pair in pending_pairs:
+                flush()
+            if pair not in owed_by_pair:
+                owed_by_pair[pair] = self._owed(cursor, debtor_id, creditor_id)
+            owed = owed_by_pair[pair]
+            if not owed > 0:
+                error = f"{record['debtor']} ничего не должен {record['creditor']}"
+            elif record['amount'] > owed + 1e-9:
+                error = f"Сумма больше долга ({owed:g}р)"
+            else:
+                error = None
+            if error:
+                summary['error_count'] += 1
+                if len(summary['errors']) < IMPORT_MAX_ERRORS:
+                    summary['errors'].append({'line': record['line'], 'error': error})
+                continue
+            
+            debts = self._active_pair_debts(cursor, debtor_id, creditor_id, record['amount'])
+            _, expense_ids = self._settle_debts(cursor, debts, record['amount'])
+            owed_by_pair[pair] = owed - record['amount']
+            touched.update(expense_ids)
+            history_rows.append((debts[0]['expense_id'], HISTORY_OPS['payment'], debtor_id,
+                                 creditor_id, record['amount'], created_at))
+            summary['payments'] += 1
+        flush()
+        
+        if summary['expenses'] + summary['payments'] > imported:
+            self._emit_event(cursor, 'ledger_imported', {
+                'expense_ids': sorted(touched),
+                'expenses': summary['expenses'],
+                'payments': summary['payments']
+            })
+            # Клиентам проще перезагрузить реестр, чем применять пачку изменений
+            self._record_changes(cursor, 'ledger', [0])
+        return sorted(touched)
+    
+    def _apply_operation(self, cursor, index: int, operation: Dict) -> Dict:
+        """Проверить и выполнить одну операцию пакета в текущей транзакции"""
+        if not isinstance(operation, dict):
+            raise BatchOperationError(index, "Операция должна быть объектом")
+        
+        try:
+            amount = parse_amount(operation.get('amount'))
+        except ValueError as e:
+            raise BatchOperationError(index, str(e))
+        
+        op_type = operation.get('type')
+        if op_type == 'expense':
+            description = operation.get('description')
+            creator = operation.get('creator')
+            participants = operation.get('participants')
+            if not description or not creator or not participants or not isinstance(participants, list):
+                raise BatchOperationError(index, "Не все поля заполнены")
+            if not is_user_name(description):
+                raise BatchOperationError(index, "Неверное описание")
+            if not is_user_name(creator) or not all(map(is_user_name, participants)):
+                raise BatchOperationError(index, "creator и participants должны быть именами")
+            return {'expense_id': self._insert_expense(cursor, description, amount,
+                                                        creator, participants)}
+        
+        if op_type == 'payment':
+            debtor, creditor = operation.get('debtor'), operation.get('creditor')
+            if not debtor or not creditor:
+                raise BatchOperationError(index, "Не все поля заполнены")
+            if not is_user_name(debtor) or not is_user_name(creditor):
+                raise BatchOperationError(index, "debtor и creditor должны быть именами")
+            debtor_id = self._user_id(cursor, debtor, create=False)
+            creditor_id = self._user_id(cursor, creditor, create=False)
+            owed = self._owed(cursor, debtor_id, creditor_id)
+            if owed == 0:
+                raise BatchOperationError(index, f"{debtor} ничего не должен {creditor}")
+            if amount > owed:
+                raise BatchOperationError(index, f"Сумма больше долга ({int(owed)}р)")
+            self._apply_payment(cursor, debtor_id, creditor_id, amount)
+            return {'owed': owed, 'remaining': owed - amount}
+        
+        raise BatchOperationError(index, f"Неизвестный тип операции: {op_type}")
+    
+    def _debt_filters(self, cursor, creditor_username: Optional[UserRef] = None,
+                      debtor_username: Optional[UserRef] = None,
+                      expense_id: Optional[int] = None,
+                      date_from: Optional[Union[datetime, str]] = None,
+                      date_to: Optional[Union[datetime, str]] = None) -> Optional[tuple]:
+        """
+        Собрать условия выборки активных долгов
+        
+        Returns:
+            (условие WHERE, параметры) или None если фильтр заведомо пуст
+            (например, пользователь ни разу не встречался)
+        """
+        conditions = ["(d.amount - d.paid_amount) > 0", "e.is_cancelled = 0"]
+        params = []
+        
+        for column, user in (('d.creditor_id', creditor_username), ('d.debtor_id', debtor_username)):
+            if user:
+                user_id = self._user_id(cursor, user, create=False)
+                if user_id is None:
+                    return None
+                conditions.append(f"{column} = ?")
+                params.append(user_id)
+        
+        if expense_id is not None:
+            conditions.append("d.expense_id = ?")
+            params.append(expense_id)
+        
+        if date_from is not None:
+            conditions.append("d.created_at >= ?")
+            params.append(format_timestamp(date_from))
+        
+        if date_to is not None:
+            conditions.append("d.created_at < ?")
+            params.append(format_timestamp(date_to))
+        
+        return ' AND '.join(conditions), params
+    
+    def get_debts(self, creditor_username: Optional[UserRef] = None,
+                  debtor_username: Optional[UserRef] = None,
+                  expense_id: Optional[int] = None,
+                  date_from: Optional[Union[datetime, str]] = None,
+                  date_to: Optional[Union[datetime, str]] = None) -> List[Dict]:
         """
         Получить список долгов
         
+        Все фильтры выполняются в SQL по индексам, поэтому стоимость
+        зависит от количества подходящих долгов, а не от размера реестра.
+        
         Args:
             creditor_username: Если указан, только долги этому человеку
+            debtor_username: Если указан, только долги этого человека
+            expense_id: Если указан, только долги по этому расходу
+            date_from: Если указан, только долги созданные не раньше
+            date_to: Если указан, только долги созданные раньше
         
         Returns:
             Список словарей с информацией о долгах
@@ -225,67 +1504,218 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        if creditor_username:
-            cursor.execute("""
-                SELECT 
-                    d.id,
-                    d.debtor_username,
-                    d.creditor_username,
-                    d.amount,
-                    d.paid_amount,
-                    (d.amount - d.paid_amount) as remaining,
-                    d.created_at,
-                    e.description
-                FROM debts d
-                JOIN expenses e ON d.expense_id = e.id
-                WHERE d.creditor_username = ? AND (d.amount - d.paid_amount) > 0 
-                AND e.is_cancelled = 0
-                ORDER BY d.created_at
-            """, (creditor_username,))
+        filters = self._debt_filters(cursor, creditor_username, debtor_username,
+                                     expense_id, date_from, date_to)
+        if filters is None:
+            conn.close()
+            return []
+        where, params = filters
+        
+        debts = self._query_debts(cursor, where, params)
+        
+        conn.close()
+        return debts
+    
+    def iter_debts(self, creditor_username: Optional[UserRef] = None,
+                   debtor_username: Optional[UserRef] = None,
+                   by_expense: bool = False, batch_size: int = 200,
+                   expense_id: Optional[int] = None,
+                   date_from: Optional[Union[datetime, str]] = None,
+                   date_to: Optional[Union[datetime, str]] = None) -> Iterator[Dict]:
+        """
+        Лениво перебрать активные долги
+        
+        Долги читаются пачками по курсору, соединение не держится между
+        пачками, поэтому остановка перебора не читает остаток реестра.
+        
+        Args:
+            creditor_username: Если указан, только долги этому человеку
+            debtor_username: Если указан, только долги этого человека
+            by_expense: Порядок по расходам (новые первыми) вместо порядка по дате долга
+            batch_size: Размер пачки
+            expense_id, date_from, date_to: Те же фильтры, что у get_debts
+        
+        Yields:
+            Словари долгов в формате get_debts
+        """
+        conn = self.get_connection()
+        filters = self._debt_filters(conn.cursor(), creditor_username, debtor_username,
+                                     expense_id, date_from, date_to)
+        conn.close()
+        if filters is None:
+            return
+        where, params = filters
+        
+        if by_expense:
+            order_by, keyset = 'd.expense_id DESC, d.id DESC', '(d.expense_id, d.id) < (?, ?)'
         else:
-            cursor.execute("""
-                SELECT 
-                    d.id,
-                    d.debtor_username,
-                    d.creditor_username,
-                    d.amount,
-                    d.paid_amount,
-                    (d.amount - d.paid_amount) as remaining,
-                    d.created_at,
-                    e.description
-                FROM debts d
-                JOIN expenses e ON d.expense_id = e.id
-                WHERE (d.amount - d.paid_amount) > 0 AND e.is_cancelled = 0
-                ORDER BY d.created_at
-            """)
+            order_by, keyset = 'd.created_at, d.id', '(d.created_at, d.id) > (?, ?)'
+        
+        position = None
+        while True:
+            conn = self.get_connection()
+            if position is None:
+                batch = self._query_debts(conn.cursor(), where, params,
+                                          order_by=order_by, limit=batch_size)
+            else:
+                batch = self._query_debts(conn.cursor(), f"{where} AND {keyset}", params + position,
+                                          order_by=order_by, limit=batch_size)
+            conn.close()
+            
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            last = batch[-1]
+            if by_expense:
+                position = [last['expense_id'], last['id']]
+            else:
+                position = [format_timestamp(last['created_at']), last['id']]
+    
+    def _query_debts(self, cursor, where: str, params: list,
+                     order_by: str = 'd.created_at', limit: Optional[int] = None) -> List[Dict]:
+        """Выполнить выборку долгов с именами и описанием расхода"""
+        query = f"""
+            SELECT 
+                d.id,
+                d.expense_id,
+                d.debtor_id,
+                d.creditor_id,
+                COALESCE(ud.username, ud.display_name) as debtor_username,
+                COALESCE(uc.username, uc.display_name) as creditor_username,
+                d.amount,
+                d.paid_amount,
+                (d.amount - d.paid_amount) as remaining,
+                d.created_at,
+                d.created_at <= datetime('now', ?) as overdue,
+                e.description
+            FROM debts d
+            JOIN expenses e ON d.expense_id = e.id
+            JOIN users ud ON ud.id = d.debtor_id
+            JOIN users uc ON uc.id = d.creditor_id
+            WHERE {where}
+            ORDER BY {order_by}
+        """
+        params = [OVERDUE_MODIFIER] + list(params)
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor.execute(query, params)
         
         debts = []
         for row in cursor.fetchall():
             # Парсим дату из SQLite формата
             created_at_str = row['created_at']
-            try:
-                created_at = datetime.strptime(created_at_str, '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                try:
-                    created_at = datetime.fromisoformat(created_at_str.replace('Z', '+00:00'))
-                except:
-                    created_at = datetime.now()
+            created_at = parse_timestamp(created_at_str)
             
             debts.append({
                 'id': row['id'],
+                'expense_id': row['expense_id'],
                 'debtor': row['debtor_username'],
                 'creditor': row['creditor_username'],
+                'debtor_id': row['debtor_id'],
+                'creditor_id': row['creditor_id'],
                 'amount': row['amount'],
                 'paid': row['paid_amount'],
                 'remaining': row['remaining'],
                 'created_at': created_at,
+                'overdue': bool(row['overdue']),
                 'description': row['description']
             })
         
-        conn.close()
         return debts
     
-    def get_statistics(self, username: Optional[str] = None) -> Dict:
+    def get_debts_page(self, debtor_username: UserRef, after: Optional[tuple] = None,
+                       before: Optional[tuple] = None, limit: int = 5) -> Dict:
+        """
+        Получить страницу долгов должника (keyset-пагинация)
+        
+        Страница выбирается по индексу (debtor_id, created_at) от курсора,
+        поэтому стоимость не зависит от номера страницы.
+        
+        Args:
+            debtor_username: Должник (username или id)
+            after: Курсор (created_at, id) - страница после него
+            before: Курсор (created_at, id) - страница перед ним
+            limit: Размер страницы
+        
+        Returns:
+            Словарь {'debts': [...], 'has_prev': bool, 'has_next': bool}
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        filters = self._debt_filters(cursor, debtor_username=debtor_username)
+        if filters is None:
+            conn.close()
+            return {'debts': [], 'has_prev': False, 'has_next': False}
+        where, params = filters
+        
+        def exists(condition: str, position: tuple) -> bool:
+            # Проверка LIMIT 1: есть ли долги по другую сторону курсора
+            return bool(self._query_debts(cursor, where + condition,
+                                          params + [format_timestamp(position[0]), position[1]],
+                                          order_by='d.created_at, d.id', limit=1))
+        
+        if before is not None:
+            debts = self._query_debts(cursor, where + " AND (d.created_at, d.id) < (?, ?)",
+                                      params + [format_timestamp(before[0]), before[1]],
+                                      order_by='d.created_at DESC, d.id DESC', limit=limit + 1)
+            has_prev = len(debts) > limit
+            debts = list(reversed(debts[:limit]))
+            has_next = exists(" AND (d.created_at, d.id) >= (?, ?)", before)
+        else:
+            page_where, page_params = where, params
+            if after is not None:
+                page_where += " AND (d.created_at, d.id) > (?, ?)"
+                page_params = params + [format_timestamp(after[0]), after[1]]
+            debts = self._query_debts(cursor, page_where, page_params,
+                                      order_by='d.created_at, d.id', limit=limit + 1)
+            has_next = len(debts) > limit
+            debts = debts[:limit]
+            has_prev = after is not None and exists(" AND (d.created_at, d.id) <= (?, ?)", after)
+        
+        conn.close()
+        return {'debts': debts, 'has_prev': has_prev, 'has_next': has_next}
+    
+    def get_debts_summary(self, creditor_username: Optional[UserRef] = None,
+                          debtor_username: Optional[UserRef] = None,
+                          expense_id: Optional[int] = None,
+                          date_from: Optional[Union[datetime, str]] = None,
+                          date_to: Optional[Union[datetime, str]] = None) -> Dict:
+        """
+        Получить итог по активным долгам (те же фильтры, что у get_debts)
+        
+        Returns:
+            Словарь {'total': сумма остатков, 'count': количество долгов}
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        filters = self._debt_filters(cursor, creditor_username, debtor_username,
+                                     expense_id, date_from, date_to)
+        if filters is None:
+            conn.close()
+            return {'total': 0.0, 'count': 0}
+        where, params = filters
+        
+        cursor.execute(f"""
+            SELECT 
+                COUNT(*) as count,
+                SUM(d.amount - d.paid_amount) as total
+            FROM debts d
+            JOIN expenses e ON d.expense_id = e.id
+            WHERE {where}
+        """, params)
+        
+        result = cursor.fetchone()
+        conn.close()
+        
+        return {
+            'total': result['total'] or 0.0,
+            'count': result['count'] or 0
+        }
+    
+    def get_statistics(self, username: Optional[UserRef] = None) -> Dict:
         """
         Получить статистику по долгам
         
@@ -305,16 +1735,16 @@ class Database:
                     COUNT(*) as debt_count,
                     SUM(amount - paid_amount) as total_debt
                 FROM debts
-                WHERE debtor_username = ? AND (amount - paid_amount) > 0
-            """, (username,))
+                WHERE debtor_id = ? AND (amount - paid_amount) > 0
+            """, (self._user_id(cursor, username, create=False),))
         else:
             # Общая статистика
             cursor.execute("""
                 SELECT 
                     COUNT(*) as debt_count,
                     SUM(amount - paid_amount) as total_debt,
-                    COUNT(DISTINCT debtor_username) as debtors_count,
-                    COUNT(DISTINCT creditor_username) as creditors_count
+                    COUNT(DISTINCT debtor_id) as debtors_count,
+                    COUNT(DISTINCT creditor_id) as creditors_count
                 FROM debts
                 WHERE (amount - paid_amount) > 0
             """)
@@ -333,37 +1763,163 @@ class Database:
         
         return stats
     
-    def add_operation_history(self, operation_type: str, username: str, 
-                              description: str, amount: Optional[float] = None,
-                              expense_id: Optional[int] = None):
+    def get_dashboard(self, history_limit: int = 20,
+                      expenses_limit: int = DASHBOARD_EXPENSES_LIMIT) -> Dict:
+        """
+        Все данные главной страницы веб-приложения одним снимком
+        
+        Долги, расходы и история читаются в одной транзакции чтения, поэтому
+        все части ответа согласованы между собой. Расходы - последние
+        неотменённые в формате list_expenses (по id, с остатком и статусом);
+        статистика считается из активных долгов.
+        
+        Args:
+            history_limit: Сколько последних операций вернуть
+            expenses_limit: Сколько последних расходов вернуть
+        
+        Returns:
+            Словарь {'version', 'debts', 'expenses', 'statistics', 'history'}
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        # Все чтения ниже видят один и тот же снимок БД
+        cursor.execute("BEGIN")
+        
+        cursor.execute("SELECT value FROM ledger_meta WHERE key = 'generation'")
+        version = cursor.fetchone()['value']
+        
+        where, params = self._debt_filters(cursor)
+        debts = self._query_debts(cursor, where, params, order_by='d.created_at, d.id')
+        expenses = self._list_expenses(cursor, limit=expenses_limit)['expenses']
+        history = self._query_history(cursor, "1 = 1", [], history_limit)
+        
+        conn.commit()
+        conn.close()
+        
+        statistics = {
+            'debt_count': len(debts),
+            'total_debt': sum(d['remaining'] for d in debts),
+            'debtors_count': len({d['debtor_id'] for d in debts}),
+            'creditors_count': len({d['creditor_id'] for d in debts})
+        }
+        
+        return {
+            'version': version,
+            'debts': debts,
+            'expenses': expenses,
+            'statistics': statistics,
+            'history': history
+        }
+    
+    def get_changes(self, since: int) -> Dict:
+        """
+        Изменения реестра после версии клиента
+        
+        Возвращаются только строки, изменённые после since, поэтому размер
+        ответа зависит от частоты изменений, а не от размера реестра. Долг,
+        который больше не активен (погашен, отменён или удалён), попадает в
+        deleted_debts; изменённые расходы приходят в формате list_expenses,
+        отменённые - в deleted_expenses.
+        
+        Args:
+            since: Версия (поколение реестра), известная клиенту
+        
+        Returns:
+            Словарь {'version', 'reset', 'debts', 'deleted_debts', 'expenses',
+            'deleted_expenses', 'history'};
+            reset=True означает, что клиенту нужно загрузить всё заново
+            (версия слишком старая, из будущего или менялись имена)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        
+        cursor.execute("SELECT key, value FROM ledger_meta")
+        meta = {row['key']: row['value'] for row in cursor.fetchall()}
+        version = meta['generation']
+        changes = {'version': version, 'reset': False,
+                   'debts': [], 'deleted_debts': [],
+                   'expenses': [], 'deleted_expenses': [], 'history': []}
+        
+        cursor.execute("""
+            SELECT 1 FROM row_changes WHERE entity = 'ledger' AND version > ?
+        """, (since,))
+        if since < meta['changes_since'] or since > version or cursor.fetchone():
+            conn.commit()
+            conn.close()
+            changes['reset'] = True
+            return changes
+        
+        if since < version:
+            changed = "(SELECT row_id FROM row_changes WHERE entity = ? AND version > ?)"
+            cursor.execute("SELECT row_id FROM row_changes WHERE entity = 'debt' AND version > ?",
+                           (since,))
+            debt_ids = [row['row_id'] for row in cursor.fetchall()]
+            
+            where, params = self._debt_filters(cursor)
+            changes['debts'] = self._query_debts(cursor, f"{where} AND d.id IN {changed}",
+                                                 params + ['debt', since],
+                                                 order_by='d.created_at, d.id')
+            active = {debt['id'] for debt in changes['debts']}
+            changes['deleted_debts'] = [debt_id for debt_id in debt_ids if debt_id not in active]
+            
+            cursor.execute("SELECT row_id FROM row_changes WHERE entity = 'expense' AND version > ?",
+                           (since,))
+            expense_ids = [row['row_id'] for row in cursor.fetchall()]
+            if expense_ids:
+                changes['expenses'] = self._list_expenses(cursor, limit=len(expense_ids),
+                                                          expense_ids=expense_ids)['expenses']
+                present = {expense['id'] for expense in changes['expenses']}
+                changes['deleted_expenses'] = [expense_id for expense_id in expense_ids
+                                               if expense_id not in present]
+            changes['history'] = self._query_history(cursor, f"h.id IN {changed}",
+                                                     ['history', since], -1)
+        
+        conn.commit()
+        conn.close()
+        return changes
+    
+    def add_operation_history(self, operation_type: str, username: UserRef, 
+                              description: Optional[str] = None, amount: Optional[float] = None,
+                              expense_id: Optional[int] = None,
+                              counterparty: Optional[UserRef] = None):
         """
         Добавить запись в историю операций
         
         Args:
-            operation_type: Тип операции (expense_created, payment, expense_cancelled)
-            username: Кто выполнил операцию
-            description: Описание операции
+            operation_type: Тип операции из HISTORY_OPS (другие типы
+                сохраняются как 'note')
+            username: Кто выполнил операцию (username или id)
+            description: Готовый текст вместо шаблона (для expense_amended -
+                сводка изменений)
             amount: Сумма (опционально)
             expense_id: ID расхода (опционально)
+            counterparty: Вторая сторона операции (опционально)
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
-            INSERT INTO operation_history (expense_id, operation_type, username, description, amount)
-            VALUES (?, ?, ?, ?, ?)
-        """, (expense_id, operation_type, username, description, amount))
+            INSERT INTO operation_history (expense_id, op, user_id, counterparty_id, amount, details)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (expense_id, HISTORY_OPS.get(operation_type, HISTORY_OPS['note']),
+              self._user_id(cursor, username),
+              self._user_id(cursor, counterparty) if counterparty is not None else None,
+              amount, description))
         
         conn.commit()
         conn.close()
     
-    def get_operation_history(self, expense_id: Optional[int] = None, limit: int = 50) -> List[Dict]:
+    def get_operation_history(self, expense_id: Optional[int] = None, limit: int = 50,
+                              counterparty: Optional[UserRef] = None) -> List[Dict]:
         """
         Получить историю операций
         
         Args:
             expense_id: Если указан, только операции по этому расходу
             limit: Максимальное количество записей
+            counterparty: Если указан, только операции со второй стороной -
+                этим пользователем (выплаты ему)
         
         Returns:
             Список операций
@@ -371,109 +1927,333 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        filters = self._history_filters(cursor, expense_id, counterparty)
+        operations = self._query_history(cursor, *filters, limit) if filters else []
+        
+        conn.close()
+        return operations
+    
+    def _history_filters(self, cursor, expense_id: Optional[int],
+                         counterparty: Optional[UserRef]) -> Optional[tuple]:
+        """Условие выборки истории по индексам или None, если пользователь не встречался"""
+        conditions, params = [], []
         if expense_id:
-            cursor.execute("""
-                SELECT * FROM operation_history
-                WHERE expense_id = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-            """, (expense_id, limit))
-        else:
-            cursor.execute("""
-                SELECT * FROM operation_history
-                ORDER BY created_at DESC
-                LIMIT ?
-            """, (limit,))
+            conditions.append("h.expense_id = ?")
+            params.append(expense_id)
+        if counterparty is not None:
+            counterparty_id = self._user_id(cursor, counterparty, create=False)
+            if counterparty_id is None:
+                return None
+            conditions.append("h.counterparty_id = ?")
+            params.append(counterparty_id)
+        return ' AND '.join(conditions) or "1 = 1", params
+    
+    def iter_export(self, kind: str, date_from: Optional[Union[datetime, str]] = None,
+                    date_to: Optional[Union[datetime, str]] = None,
+                    username: Optional[UserRef] = None, after: int = 0,
+                    batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Перебрать все строки таблицы для выгрузки в порядке id
+        
+        Строки читаются пачками по курсору id с новым соединением на пачку,
+        поэтому память постоянна при любом размере выгрузки, а прерванную
+        выгрузку можно продолжить с id последней полученной строки.
+        В выгрузку попадают и погашенные долги, и отменённые расходы.
+        
+        Args:
+            kind: 'expenses', 'debts' или 'history' (см. EXPORT_QUERIES)
+            date_from: Если указан, только строки созданные не раньше
+            date_to: Если указан, только строки созданные раньше
+            username: Если указан, только строки с участием пользователя
+            after: Курсор - id последней выгруженной строки
+            batch_size: Размер пачки
+        
+        Yields:
+            Словари с полями из EXPORT_QUERIES[kind][0]; created_at - строка
+            в формате SQLite
+        """
+        if kind not in EXPORT_QUERIES:
+            raise ValueError(f"Неизвестная выгрузка: {kind}")
+        columns, query, alias, user_condition = EXPORT_QUERIES[kind]
+        
+        conditions = [f"{alias}.id > ?"]
+        params: list = []
+        if date_from is not None:
+            conditions.append(f"{alias}.created_at >= ?")
+            params.append(format_timestamp(date_from))
+        if date_to is not None:
+            conditions.append(f"{alias}.created_at < ?")
+            params.append(format_timestamp(date_to))
+        if username:
+            conn = self.get_connection()
+            user_id = self._user_id(conn.cursor(), username, create=False)
+            conn.close()
+            if user_id is None:
+                return
+            conditions.append(user_condition)
+            params.extend([user_id] * user_condition.count('?'))
+        
+        sql = query.format(where=' AND '.join(conditions)) + f" ORDER BY {alias}.id LIMIT ?"
+        while True:
+            conn = self.get_connection()
+            rows = conn.execute(sql, [after] + params + [batch_size]).fetchall()
+            conn.close()
+            
+            for row in rows:
+                if kind == 'history':
+                    row = {**dict(row), **self._history_text(row)}
+                yield {column: row[column] for column in columns}
+            if len(rows) < batch_size:
+                return
+            after = rows[-1]['id']
+    
+    def iter_operation_history(self, expense_id: Optional[int] = None,
+                               batch_size: int = 200,
+                               counterparty: Optional[UserRef] = None) -> Iterator[Dict]:
+        """
+        Лениво перебрать историю операций от новых к старым
+        
+        Args:
+            expense_id: Если указан, только операции по этому расходу
+            batch_size: Размер пачки
+            counterparty: Если указан, только операции с этим пользователем
+                второй стороной
+        
+        Yields:
+            Операции в формате get_operation_history
+        """
+        conn = self.get_connection()
+        filters = self._history_filters(conn.cursor(), expense_id, counterparty)
+        conn.close()
+        if filters is None:
+            return
+        where, params = filters
+        position = []
+        while True:
+            conn = self.get_connection()
+            condition = f"{where} AND (h.created_at, h.id) < (?, ?)" if position else where
+            batch = self._query_history(conn.cursor(), condition, params + position, batch_size)
+            conn.close()
+            
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            position = [format_timestamp(batch[-1]['created_at']), batch[-1]['id']]
+    
+    def _query_history(self, cursor, where: str, params: list, limit: int) -> List[Dict]:
+        """Выполнить выборку истории с именами пользователей (новые первыми)"""
+        cursor.execute(f"""
+            SELECT h.id, h.expense_id, h.op, h.amount, h.details, h.created_at,
+                   COALESCE(u.username, u.display_name) as username,
+                   COALESCE(c.username, c.display_name) as counterparty,
+                   e.description as expense_description
+            FROM operation_history h
+            JOIN users u ON u.id = h.user_id
+            LEFT JOIN users c ON c.id = h.counterparty_id
+            LEFT JOIN expenses e ON e.id = h.expense_id
+            WHERE {where}
+            ORDER BY h.created_at DESC, h.id DESC
+            LIMIT ?
+        """, params + [limit])
         
         operations = []
         for row in cursor.fetchall():
             created_at_str = row['created_at']
-            try:
-                created_at = datetime.strptime(created_at_str, '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                try:
-                    created_at = datetime.fromisoformat(created_at_str.replace('Z', '+00:00'))
-                except:
-                    created_at = datetime.now()
+            created_at = parse_timestamp(created_at_str)
             
             operations.append({
                 'id': row['id'],
                 'expense_id': row['expense_id'],
-                'operation_type': row['operation_type'],
                 'username': row['username'],
-                'description': row['description'],
+                'counterparty': row['counterparty'],
+                **self._history_text(row),
                 'amount': row['amount'],
                 'created_at': created_at
             })
         
-        conn.close()
         return operations
     
-    def get_expense_details(self, expense_id: int) -> Optional[Dict]:
+    @staticmethod
+    def _history_text(row) -> Dict:
+        """operation_type и текст записи истории из кода операции и шаблона"""
+        return {
+            'operation_type': HISTORY_OP_NAMES.get(row['op'], 'note'),
+            'description': render_history(row['op'], row['amount'], row['details'],
+                                          row['counterparty'], row['expense_description'])
+        }
+    
+    def list_expenses(self, creator_username: Optional[UserRef] = None,
+                      participant_username: Optional[UserRef] = None,
+                      status: Optional[str] = None,
+                      date_from: Optional[Union[datetime, str]] = None,
+                      date_to: Optional[Union[datetime, str]] = None,
+                      sort: str = 'created_at', descending: bool = True,
+                      after: Optional[tuple] = None, limit: int = 20) -> Dict:
         """
-        Получить детали расхода
+        Получить страницу расходов с итогами по каждому расходу
+        
+        Итоги считаются в SQL группировкой по id расхода, поэтому расходы с
+        одинаковым описанием не сливаются, а погашенные тоже попадают в список.
         
         Args:
-            expense_id: ID расхода
+            creator_username: Если указан, только расходы этого человека
+            participant_username: Если указан, только расходы с его участием
+            status: 'open' (есть остаток), 'settled' (погашен), 'cancelled'
+                (отменён) или None - все неотменённые
+            date_from: Если указан, только расходы созданные не раньше
+            date_to: Если указан, только расходы созданные раньше
+            sort: Поле сортировки из EXPENSE_SORT_KEYS
+            descending: Сортировать по убыванию
+            after: Курсор (значение поля сортировки, id) - страница после него
+            limit: Размер страницы
         
         Returns:
-            Словарь с деталями расхода или None если не найден
+            Словарь {'expenses': [...], 'has_next': bool, 'next_cursor': tuple или None}
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM expenses WHERE id = ? AND is_cancelled = 0
-        """, (expense_id,))
+        if sort not in EXPENSE_SORT_KEYS:
+            raise ValueError(f"Неизвестная сортировка: {sort}")
+        if status not in (None, 'open', 'settled', 'cancelled'):
+            raise ValueError(f"Неизвестный статус: {status}")
         
-        row = cursor.fetchone()
-        if not row:
+        conn = self.get_connection()
+        try:
+            return self._list_expenses(conn.cursor(), creator_username, participant_username,
+                                       status, date_from, date_to, sort, descending,
+                                       after, limit)
+        finally:
             conn.close()
-            return None
+    
+    def _list_expenses(self, cursor: sqlite3.Cursor, creator_username: Optional[UserRef] = None,
+                       participant_username: Optional[UserRef] = None,
+                       status: Optional[str] = None,
+                       date_from: Optional[Union[datetime, str]] = None,
+                       date_to: Optional[Union[datetime, str]] = None,
+                       sort: str = 'created_at', descending: bool = True,
+                       after: Optional[tuple] = None, limit: int = 20,
+                       expense_ids: Optional[List[int]] = None) -> Dict:
+        """Страница расходов list_expenses на открытом курсоре (expense_ids - только эти расходы)"""
+        empty = {'expenses': [], 'has_next': False, 'next_cursor': None}
+        conditions = ["e.is_cancelled = ?"]
+        params: list = [1 if status == 'cancelled' else 0]
+        having = []
+        having_params: list = []
         
-        # Получаем долги по этому расходу
-        cursor.execute("""
-            SELECT 
-                debtor_username,
-                creditor_username,
-                amount,
-                paid_amount,
-                (amount - paid_amount) as remaining
-            FROM debts
-            WHERE expense_id = ?
-        """, (expense_id,))
+        if creator_username:
+            creator_id = self._user_id(cursor, creator_username, create=False)
+            if creator_id is None:
+                return empty
+            conditions.append("e.creator_id = ?")
+            params.append(creator_id)
+        
+        if participant_username:
+            participant_id = self._user_id(cursor, participant_username, create=False)
+            if participant_id is None:
+                return empty
+            conditions.append("EXISTS (SELECT 1 FROM debts p WHERE p.expense_id = e.id AND p.debtor_id = ?)")
+            params.append(participant_id)
+        
+        if expense_ids is not None:
+            conditions.append(f"e.id IN ({', '.join('?' * len(expense_ids))})")
+            params.extend(expense_ids)
+        
+        if date_from is not None:
+            conditions.append("e.created_at >= ?")
+            params.append(format_timestamp(date_from))
+        
+        if date_to is not None:
+            conditions.append("e.created_at < ?")
+            params.append(format_timestamp(date_to))
+        
+        if status == 'open':
+            having.append("outstanding > 0")
+        elif status == 'settled':
+            having.append("outstanding <= 0")
+        
+        sort_column = EXPENSE_SORT_KEYS[sort]
+        direction = 'DESC' if descending else 'ASC'
+        if after is not None:
+            # Остаток - агрегат, поэтому курсор по нему проверяется в HAVING
+            keyset = f"({sort_column}, e.id) {'<' if descending else '>'} (?, ?)"
+            value = format_timestamp(after[0]) if sort == 'created_at' else after[0]
+            if sort == 'outstanding':
+                having.append(keyset)
+                having_params.extend([value, after[1]])
+            else:
+                conditions.append(keyset)
+                params.extend([value, after[1]])
         
-        debts = []
-        for debt_row in cursor.fetchall():
-            debts.append({
-                'debtor': debt_row['debtor_username'],
-                'creditor': debt_row['creditor_username'],
-                'amount': debt_row['amount'],
-                'paid': debt_row['paid_amount'],
-                'remaining': debt_row['remaining']
+        cursor.execute(f"""
+            SELECT
+                e.id,
+                e.description,
+                e.total_amount,
+                e.creator_id,
+                COALESCE(uc.username, uc.display_name) as creator,
+                e.created_at,
+                e.is_cancelled,
+                COUNT(d.id) as debts_count,
+                json_group_array(COALESCE(ud.username, ud.display_name))
+                    FILTER (WHERE d.id IS NOT NULL) as participants,
+                COALESCE(SUM(d.amount), 0) as owed_total,
+                COALESCE(SUM(d.paid_amount), 0) as paid_total,
+                COALESCE(SUM(d.amount - d.paid_amount), 0) as outstanding
+            FROM expenses e
+            JOIN users uc ON uc.id = e.creator_id
+            LEFT JOIN debts d ON d.expense_id = e.id
+            LEFT JOIN users ud ON ud.id = d.debtor_id
+            WHERE {' AND '.join(conditions)}
+            GROUP BY e.id
+            {'HAVING ' + ' AND '.join(having) if having else ''}
+            ORDER BY {sort_column} {direction}, e.id {direction}
+            LIMIT ?
+        """, params + having_params + [limit + 1])
+        rows = cursor.fetchall()
+        
+        expenses = []
+        for row in rows[:limit]:
+            if row['is_cancelled']:
+                expense_status = 'cancelled'
+            elif row['outstanding'] > 0:
+                expense_status = 'open'
+            else:
+                expense_status = 'settled'
+            expenses.append({
+                'id': row['id'],
+                'description': row['description'],
+                'total_amount': row['total_amount'],
+                'creator': row['creator'],
+                'creator_id': row['creator_id'],
+                'created_at': parse_timestamp(row['created_at']),
+                'participants': json.loads(row['participants']),
+                'debts_count': row['debts_count'],
+                'paid_total': row['paid_total'],
+                'outstanding': row['outstanding'],
+                'status': expense_status
             })
         
-        created_at_str = row['created_at']
-        try:
-            created_at = datetime.strptime(created_at_str, '%Y-%m-%d %H:%M:%S')
-        except ValueError:
-            try:
-                created_at = datetime.fromisoformat(created_at_str.replace('Z', '+00:00'))
-            except:
-                created_at = datetime.now()
+        has_next = len(rows) > limit
+        next_cursor = None
+        if has_next:
+            last = expenses[-1]
+            next_cursor = (last[sort], last['id'])
+        return {'expenses': expenses, 'has_next': has_next, 'next_cursor': next_cursor}
+    
+    def get_expense_details(self, expense_id: int) -> Optional[Dict]:
+        """
+        Получить детали расхода
         
-        conn.close()
+        Args:
+            expense_id: ID расхода
         
-        return {
-            'id': row['id'],
-            'description': row['description'],
-            'total_amount': row['total_amount'],
-            'creator_username': row['creator_username'],
-            'created_at': created_at,
-            'debts': debts
-        }
+        Returns:
+            Словарь с деталями расхода или None если не найден
+        """
+        conn = self.get_connection()
+        details = self._expense_details(conn.cursor(), expense_id)
+        conn.close()
+        return details
     
-    def get_expense_by_description(self, description: str, creator_username: Optional[str] = None) -> Optional[Dict]:
+    def get_expense_by_description(self, description: str, creator_username: Optional[UserRef] = None) -> Optional[Dict]:
         """
         Найти расход по описанию
         
@@ -490,10 +2270,10 @@ class Database:
         if creator_username:
             cursor.execute("""
                 SELECT id FROM expenses 
-                WHERE description = ? AND creator_username = ? AND is_cancelled = 0
+                WHERE description = ? AND creator_id = ? AND is_cancelled = 0
                 ORDER BY created_at DESC
                 LIMIT 1
-            """, (description, creator_username))
+            """, (description, self._user_id(cursor, creator_username, create=False)))
         else:
             cursor.execute("""
                 SELECT id FROM expenses 
@@ -503,67 +2283,343 @@ class Database:
             """, (description,))
         
         row = cursor.fetchone()
+        details = self._expense_details(cursor, row['id']) if row else None
         conn.close()
+        return details
+    
+    def _expense_details(self, cursor, expense_id: int) -> Optional[Dict]:
+        """Детали расхода из кэша или одним запросом (возвращается копия)"""
+        self._sync_expense_cache(cursor)
+        with self._expense_cache_lock:
+            details = self._expense_cache.get(expense_id)
+            if details is not None:
+                self._expense_cache.move_to_end(expense_id)
+        
+        if details is None:
+            details = self._query_expense_details(cursor, expense_id)
+            if details is None:
+                return None
+            with self._expense_cache_lock:
+                self._expense_cache[expense_id] = details
+                while len(self._expense_cache) > EXPENSE_CACHE_SIZE:
+                    self._expense_cache.popitem(last=False)
+        
+        return {**details, 'debts': [dict(debt) for debt in details['debts']]}
+    
+    def _query_expense_details(self, cursor, expense_id: int) -> Optional[Dict]:
+        """Расход, создатель и все долги по нему одним JOIN-запросом"""
+        cursor.execute("""
+            SELECT 
+                e.id, e.description, e.total_amount, e.creator_id, e.created_at,
+                COALESCE(u.username, u.display_name) as creator_username,
+                d.id as debt_id,
+                COALESCE(ud.username, ud.display_name) as debtor_username,
+                COALESCE(uc.username, uc.display_name) as creditor_username,
+                d.amount,
+                d.paid_amount
+            FROM expenses e
+            JOIN users u ON u.id = e.creator_id
+            LEFT JOIN debts d ON d.expense_id = e.id
+            LEFT JOIN users ud ON ud.id = d.debtor_id
+            LEFT JOIN users uc ON uc.id = d.creditor_id
+            WHERE e.id = ? AND e.is_cancelled = 0
+            ORDER BY d.id
+        """, (expense_id,))
         
-        if row:
-            return self.get_expense_details(row['id'])
-        return None
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        
+        row = rows[0]
+        debts = []
+        for debt_row in rows:
+            if debt_row['debt_id'] is None:
+                continue
+            debts.append({
+                'debtor': debt_row['debtor_username'],
+                'creditor': debt_row['creditor_username'],
+                'amount': debt_row['amount'],
+                'paid': debt_row['paid_amount'],
+                'remaining': debt_row['amount'] - debt_row['paid_amount']
+            })
+        
+        return {
+            'id': row['id'],
+            'description': row['description'],
+            'total_amount': row['total_amount'],
+            'creator_username': row['creator_username'],
+            'creator_id': row['creator_id'],
+            'created_at': parse_timestamp(row['created_at']),
+            'debts': debts
+        }
+    
+    def _invalidate_expenses(self, expense_ids: Optional[List[int]] = None):
+        """Сбросить кэш деталей для указанных расходов (или весь кэш)"""
+        with self._expense_cache_lock:
+            if expense_ids is None:
+                self._expense_cache.clear()
+            else:
+                for expense_id in expense_ids:
+                    self._expense_cache.pop(expense_id, None)
+    
+    def _sync_expense_cache(self, cursor):
+        """
+        Сбросить кэшированные расходы, изменённые после последней проверки
+        
+        Журнал событий общий для бота и веб-приложения, поэтому так
+        учитываются и записи других процессов. Без новых событий это один
+        запрос по первичному ключу.
+        """
+        last_id = self._expense_cache_event_id
+        if last_id is None:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) as last_id FROM events")
+            self._expense_cache_event_id = cursor.fetchone()['last_id']
+            return
+        
+        cursor.execute("""
+            SELECT id, payload FROM events WHERE id > ? ORDER BY id LIMIT ?
+        """, (last_id, EXPENSE_CACHE_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        
+        # Пропуск в номерах: часть событий удалена prune_change_logs раньше,
+        # чем мы их прочитали, - какие расходы менялись, неизвестно
+        if len(rows) == EXPENSE_CACHE_SIZE or rows[0]['id'] > last_id + 1:
+            # Изменений больше, чем помещается в кэш, или они неизвестны - сбрасываем всё
+            cursor.execute("SELECT MAX(id) as last_id FROM events")
+            self._invalidate_expenses()
+            self._expense_cache_event_id = cursor.fetchone()['last_id']
+            return
+        
+        changed = []
+        for row in rows:
+            payload = json.loads(row['payload'])
+            changed.extend(payload.get('expense_ids') or [payload.get('expense_id')])
+        self._invalidate_expenses(changed)
+        self._expense_cache_event_id = rows[-1]['id']
     
-    def cancel_expense(self, expense_id: int, username: str) -> bool:
+    def cancel_expense(self, expense_id: int, username: UserRef) -> bool:
         """
         Отменить расход
         
         Args:
             expense_id: ID расхода
-            username: Кто отменяет (должен быть создателем)
+            username: Кто отменяет (должен быть создателем), username или id
         
         Returns:
             True если успешно, False если нет прав или расход не найден
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем что расход существует и пользователь - создатель
-        cursor.execute("""
-            SELECT creator_username FROM expenses 
-            WHERE id = ? AND is_cancelled = 0
-        """, (expense_id,))
-        
-        row = cursor.fetchone()
-        if not row:
-            conn.close()
-            return False
-        
-        if row['creator_username'] != username:
-            conn.close()
-            return False
+        with self._transaction() as cursor:
+            # Проверяем что расход существует и пользователь - создатель
+            cursor.execute("""
+                SELECT creator_id FROM expenses 
+                WHERE id = ? AND is_cancelled = 0
+            """, (expense_id,))
+            
+            row = cursor.fetchone()
+            if not row:
+                return False
+            
+            user_id = self._user_id(cursor, username, create=False)
+            if row['creator_id'] != user_id:
+                return False
+            
+            # Помечаем расход как отменённый
+            cursor.execute("""
+                UPDATE expenses SET is_cancelled = 1 WHERE id = ?
+            """, (expense_id,))
+            
+            # Запоминаем долги для уведомлений до удаления
+            cursor.execute("""
+                SELECT d.id, COALESCE(u.username, u.display_name) as debtor_username
+                FROM debts d JOIN users u ON u.id = d.debtor_id
+                WHERE d.expense_id = ?
+            """, (expense_id,))
+            cancelled_debts = cursor.fetchall()
+            
+            # Удаляем все долги по этому расходу
+            cursor.execute("""
+                DELETE FROM debts WHERE expense_id = ?
+            """, (expense_id,))
+            
+            # Получаем описание для уведомления
+            cursor.execute("""
+                SELECT description FROM expenses WHERE id = ?
+            """, (expense_id,))
+            expense_row = cursor.fetchone()
+            description = expense_row['description'] if expense_row else 'расход'
+            
+            # Записываем в историю
+            cursor.execute("""
+                INSERT INTO operation_history (expense_id, op, user_id)
+                VALUES (?, ?, ?)
+            """, (expense_id, HISTORY_OPS['expense_cancelled'], user_id))
+            history_id = cursor.lastrowid
+            
+            self._emit_event(cursor, 'expense_cancelled', {
+                'expense_id': expense_id,
+                'description': description,
+                'username': self._user_name(cursor, username),
+                'debt_ids': [row['id'] for row in cancelled_debts],
+                'debtors': [row['debtor_username'] for row in cancelled_debts]
+            })
+            self._record_changes(cursor, 'debt', [row['id'] for row in cancelled_debts])
+            self._record_changes(cursor, 'expense', [expense_id])
+            self._record_changes(cursor, 'history', [history_id])
         
-        # Помечаем расход как отменённый
-        cursor.execute("""
-            UPDATE expenses SET is_cancelled = 1 WHERE id = ?
-        """, (expense_id,))
+        self._invalidate_expenses([expense_id])
+        return True
+    
+    def amend_expense(self, expense_id: int, username: UserRef,
+                      total_amount: Optional[float] = None,
+                      participants: Optional[List[UserRef]] = None,
+                      description: Optional[str] = None) -> Optional[Dict]:
+        """
+        Изменить сумму, участников или описание расхода
         
-        # Удаляем все долги по этому расходу
-        cursor.execute("""
-            DELETE FROM debts WHERE expense_id = ?
-        """, (expense_id,))
+        Новая раскладка сравнивается со старой, и меняются только строки
+        долгов с другой суммой: уже выплаченные части сохраняются. Участник,
+        успевший что-то выплатить, при удалении остаётся с погашенным долгом
+        на выплаченную сумму и отметкой removed: без нового списка
+        участников он в раскладку не возвращается.
         
-        # Получаем описание для истории
-        cursor.execute("""
-            SELECT description FROM expenses WHERE id = ?
-        """, (expense_id,))
-        expense_row = cursor.fetchone()
-        description = expense_row['description'] if expense_row else 'расход'
+        Args:
+            expense_id: ID расхода
+            username: Кто изменяет (должен быть создателем), username или id
+            total_amount: Новая сумма (None - прежняя)
+            participants: Новые участники (None - прежние)
+            description: Новое описание (None - прежнее)
         
-        # Записываем в историю
-        cursor.execute("""
-            INSERT INTO operation_history (expense_id, operation_type, username, description)
-            VALUES (?, ?, ?, ?)
-        """, (expense_id, 'expense_cancelled', username, f"Отменён расход '{description}'"))
+        Returns:
+            Изменения {'description', 'total_amount': (было, стало) или None,
+            'added', 'removed', 'changed': [(имя, было, стало)], 'refunds':
+            {имя: переплата}} или None если нет прав или расход не найден
+        """
+        if participants is not None and not participants:
+            raise ValueError("Список участников не может быть пустым")
         
-        conn.commit()
-        conn.close()
-        return True
+        with self._transaction() as cursor:
+            cursor.execute("""
+                SELECT description, total_amount, creator_id FROM expenses
+                WHERE id = ? AND is_cancelled = 0
+            """, (expense_id,))
+            expense = cursor.fetchone()
+            if not expense or expense['creator_id'] != self._user_id(cursor, username, create=False):
+                return None
+            
+            cursor.execute("""
+                SELECT id, debtor_id, amount, paid_amount, removed FROM debts
+                WHERE expense_id = ? ORDER BY id
+            """, (expense_id,))
+            old_rows: Dict[int, List] = OrderedDict()
+            for row in cursor.fetchall():
+                old_rows.setdefault(row['debtor_id'], []).append(row)
+            
+            old_total = expense['total_amount']
+            new_total = old_total if total_amount is None else total_amount
+            if participants is None:
+                # Прежние участники (с учётом повторов) без удалённых ранее
+                debtor_ids = [debtor_id for debtor_id, rows in old_rows.items()
+                              for row in rows if not row['removed']]
+            else:
+                debtor_ids = [self._user_id(cursor, participant) for participant in participants]
+            
+            share = new_total / len(debtor_ids)
+            new_amounts: Dict[int, float] = OrderedDict()
+            for debtor_id in debtor_ids:
+                new_amounts[debtor_id] = new_amounts.get(debtor_id, 0) + share
+            
+            diff = {'description': None, 'total_amount': None,
+                    'added': [], 'removed': [], 'changed': [], 'refunds': {}}
+            event_debts = []
+            
+            for debtor_id in list(old_rows) + [d for d in new_amounts if d not in old_rows]:
+                rows = old_rows.get(debtor_id, [])
+                old_amount = sum(row['amount'] for row in rows)
+                paid = sum(row['paid_amount'] for row in rows)
+                new_amount = new_amounts.get(debtor_id, 0)
+                was_removed = bool(rows) and all(row['removed'] for row in rows)
+                if was_removed and new_amount == 0:
+                    continue
+                if rows and len(rows) == 1 and abs(old_amount - new_amount) < 1e-9:
+                    continue
+            
+                name = self._user_name(cursor, debtor_id)
+                if not rows:
+                    cursor.execute("""
+                        INSERT INTO debts (expense_id, debtor_id, creditor_id, amount)
+                        VALUES (?, ?, ?, ?)
+                    """, (expense_id, debtor_id, expense['creator_id'], new_amount))
+                    diff['added'].append((name, new_amount))
+                    event_debts.append({'id': cursor.lastrowid, 'debtor': name, 'amount': new_amount})
+                    continue
+            
+                # Строки одного должника сводятся в одну, выплаты сохраняются
+                keep = rows[0]
+                extra_ids = [row['id'] for row in rows[1:]]
+                if extra_ids:
+                    cursor.execute(f"""
+                        DELETE FROM debts WHERE id IN ({','.join('?' * len(extra_ids))})
+                    """, extra_ids)
+            
+                if new_amount == 0 and paid == 0:
+                    cursor.execute("DELETE FROM debts WHERE id = ?", (keep['id'],))
+                else:
+                    # Удалённый участник остаётся с погашенным долгом на выплаченную
+                    # сумму; выплачено больше новой доли - остаток к возврату
+                    kept_amount = new_amount or paid
+                    cursor.execute("""
+                        UPDATE debts SET amount = ?, paid_amount = ?, removed = ? WHERE id = ?
+                    """, (kept_amount, min(paid, kept_amount), int(new_amount == 0), keep['id']))
+                    if paid > kept_amount:
+                        diff['refunds'][name] = paid - kept_amount
+            
+                if new_amount == 0:
+                    diff['removed'].append(name)
+                elif was_removed:
+                    diff['added'].append((name, new_amount))
+                else:
+                    diff['changed'].append((name, old_amount, new_amount))
+                event_debts.append({'id': keep['id'], 'debtor': name, 'amount': new_amount,
+                                    'remaining': max(new_amount - paid, 0)})
+            
+            if total_amount is not None and abs(new_total - old_total) >= 1e-9:
+                diff['total_amount'] = (old_total, new_total)
+            if description is not None and description != expense['description']:
+                diff['description'] = (expense['description'], description)
+            
+            if not any(diff.values()):
+                return diff
+            
+            cursor.execute("""
+                UPDATE expenses SET total_amount = ?, description = ? WHERE id = ?
+            """, (new_total, description or expense['description'], expense_id))
+            
+            cursor.execute("""
+                INSERT INTO operation_history (expense_id, op, user_id, amount, details)
+                VALUES (?, ?, ?, ?, ?)
+            """, (expense_id, HISTORY_OPS['expense_amended'], expense['creator_id'], new_total,
+                  format_amendment(diff)))
+            history_id = cursor.lastrowid
+            
+            self._emit_event(cursor, 'expense_amended', {
+                'expense_id': expense_id,
+                'description': description or expense['description'],
+                'creditor': self._user_name(cursor, expense['creator_id']),
+                'debts': event_debts,
+                'removed': diff['removed']
+            })
+            # Описание показывается в каждом долге расхода, поэтому отмечаем все
+            # прежние строки (в том числе удалённые) и добавленные
+            changed_ids = [row['id'] for rows in old_rows.values() for row in rows]
+            changed_ids += [debt['id'] for debt in event_debts if debt['id'] not in changed_ids]
+            self._record_changes(cursor, 'debt', changed_ids)
+            self._record_changes(cursor, 'expense', [expense_id])
+            self._record_changes(cursor, 'history', [history_id])
+        
+        self._invalidate_expenses([expense_id])
+        return diff
     
     def get_debts_grouped_by_expense(self) -> Dict[str, List[Dict]]:
         """
@@ -578,13 +2634,15 @@ class Database:
         cursor.execute("""
             SELECT 
                 e.description,
-                d.debtor_username,
-                d.creditor_username,
+                COALESCE(ud.username, ud.display_name) as debtor_username,
+                COALESCE(uc.username, uc.display_name) as creditor_username,
                 d.amount,
                 d.paid_amount,
                 (d.amount - d.paid_amount) as remaining
             FROM debts d
             JOIN expenses e ON d.expense_id = e.id
+            JOIN users ud ON ud.id = d.debtor_id
+            JOIN users uc ON uc.id = d.creditor_id
             WHERE (d.amount - d.paid_amount) > 0 AND e.is_cancelled = 0
             ORDER BY e.created_at DESC, e.description
         """)
@@ -606,7 +2664,7 @@ class Database:
         conn.close()
         return grouped
     
-    def get_debt_amount(self, debtor_username: str, creditor_username: str) -> float:
+    def get_debt_amount(self, debtor_username: UserRef, creditor_username: UserRef) -> float:
         """Получить сумму долга между двумя пользователями"""
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -614,12 +2672,257 @@ class Database:
         cursor.execute("""
             SELECT SUM(amount - paid_amount) as total
             FROM debts
-            WHERE debtor_username = ? AND creditor_username = ?
+            WHERE debtor_id = ? AND creditor_id = ?
             AND (amount - paid_amount) > 0
-        """, (debtor_username, creditor_username))
+        """, (self._user_id(cursor, debtor_username, create=False),
+              self._user_id(cursor, creditor_username, create=False)))
         
         result = cursor.fetchone()
         conn.close()
         
         return result['total'] or 0.0
-
+    
+    def get_events(self, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        """
+        Получить события из журнала
+        
+        Args:
+            after_id: Вернуть события с id больше этого
+            limit: Максимальное количество событий
+        
+        Returns:
+            Список событий в порядке записи
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT id, event_type, payload, created_at FROM events
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (after_id, limit))
+        
+        events = [{
+            'id': row['id'],
+            'event_type': row['event_type'],
+            'payload': json.loads(row['payload']),
+            'created_at': row['created_at']
+        } for row in cursor.fetchall()]
+        
+        conn.close()
+        return events
+    
+    def get_last_event_id(self) -> int:
+        """Получить id последнего события в журнале"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(id) as last_id FROM events")
+        result = cursor.fetchone()
+        conn.close()
+        return result['last_id'] or 0
+    
+    def get_event_cursor(self, consumer: str) -> Optional[int]:
+        """Получить позицию подписчика в журнале событий"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT last_event_id FROM event_cursors WHERE consumer = ?
+        """, (consumer,))
+        row = cursor.fetchone()
+        conn.close()
+        return row['last_event_id'] if row else None
+    
+    def set_event_cursor(self, consumer: str, last_event_id: int):
+        """Сохранить позицию подписчика в журнале событий"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO event_cursors (consumer, last_event_id) VALUES (?, ?)
+            ON CONFLICT(consumer) DO UPDATE SET last_event_id = excluded.last_event_id
+        """, (consumer, last_event_id))
+        conn.commit()
+        conn.close()
+    
+    def prune_change_logs(self, keep_generations: int = CHANGES_RETENTION,
+                          keep_events: int = EVENTS_RETENTION) -> Dict[str, int]:
+        """
+        Удалить старые записи журналов
+        
+        Удаляются события ниже позиции самого отстающего подписчика из
+        event_cursors, но не из последних keep_events (событие на позиции
+        тоже остаётся, чтобы номер последнего события не откатился).
+        Читатели без позиции - кэш расходов и поток SSE - замечают пропуск
+        в номерах событий и сбрасывают своё состояние целиком.
+        
+        Из row_changes удаляются поколения старше последних keep_generations,
+        а changes_since сдвигается на границу окна, поэтому get_changes с
+        более старой версией отвечает reset.
+        
+        Args:
+            keep_generations: Сколько последних поколений хранить в row_changes
+            keep_events: Сколько последних событий хранить в любом случае
+        
+        Returns:
+            Словарь {'events', 'row_changes'} с количеством удалённых строк
+        """
+        pruned = {'events': 0, 'row_changes': 0}
+        with self._transaction() as cursor:
+            cursor.execute("""
+                SELECT (SELECT MIN(last_event_id) FROM event_cursors) as position,
+                       (SELECT COALESCE(MAX(id), 0) FROM events) as last_id
+            """)
+            row = cursor.fetchone()
+            if row['position'] is not None:
+                cursor.execute("DELETE FROM events WHERE id < ?",
+                               (min(row['position'], row['last_id'] - keep_events + 1),))
+                pruned['events'] = cursor.rowcount
+            
+            cursor.execute("SELECT key, value FROM ledger_meta")
+            meta = {row['key']: row['value'] for row in cursor.fetchall()}
+            boundary = meta['generation'] - keep_generations
+            if boundary > meta['changes_since']:
+                cursor.execute("DELETE FROM row_changes WHERE version <= ?", (boundary,))
+                pruned['row_changes'] = cursor.rowcount
+                cursor.execute("UPDATE ledger_meta SET value = ? WHERE key = 'changes_since'",
+                               (boundary,))
+        return pruned
+    
+    def get_chat_ids(self, users: List[Union[str, int]]) -> Dict[Union[str, int], int]:
+        """
+        Получить чаты пользователей
+        
+        Args:
+            users: Имена или id пользователей
+        
+        Returns:
+            Словарь имя или id -> chat_id (личный чат совпадает с telegram_id)
+        """
+        if not users:
+            return {}
+        
+        user_ids = [user for user in users if isinstance(user, int) and not isinstance(user, bool)]
+        usernames = [user for user in users if isinstance(user, str)]
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        chats = {}
+        if user_ids:
+            placeholders = ', '.join('?' for _ in user_ids)
+            cursor.execute(f"""
+                SELECT id, telegram_id as chat_id FROM users
+                WHERE id IN ({placeholders}) AND telegram_id IS NOT NULL
+            """, user_ids)
+            chats.update((row['id'], row['chat_id']) for row in cursor.fetchall())
+        if usernames:
+            placeholders = ', '.join('?' for _ in usernames)
+            cursor.execute(f"""
+                SELECT username, telegram_id as chat_id FROM users
+                WHERE username IN ({placeholders}) AND telegram_id IS NOT NULL
+            """, usernames)
+            chats.update((row['username'], row['chat_id']) for row in cursor.fetchall())
+        conn.close()
+        return chats
+    
+    def get_newly_overdue_debts(self, name: str = 'overdue', limit: int = 500) -> Dict:
+        """
+        Получить долги, ставшие просроченными после последнего напоминания
+        
+        Выборка идёт по индексу (created_at, id) от позиции напоминаний
+        до порога просрочки, поэтому читаются только долги, пересёкшие порог.
+        Если позиции ещё нет, она ставится на текущий порог и ничего не
+        возвращается: долги, просроченные до первого запуска, не рассылаются.
+        Погашенные, отменённые и импортированные уже просроченными
+        (reminded=1) долги просматриваются, но не возвращаются; last_scanned
+        позволяет сдвинуть позицию и за них, чтобы не читать их снова.
+        
+        Args:
+            name: Имя позиции напоминаний
+            limit: Максимальное количество просматриваемых долгов
+        
+        Returns:
+            Словарь с ключами:
+            - debts: долги для напоминания в порядке (created_at, id)
+            - last_scanned: (created_at, id) последнего просмотренного долга или None
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT last_created_at, last_debt_id FROM reminder_watermarks WHERE name = ?
+        """, (name,))
+        row = cursor.fetchone()
+        if row is None:
+            # Первый запуск: начинаем с последнего уже просроченного долга
+            cursor.execute("""
+                SELECT created_at, id FROM debts
+                WHERE created_at <= datetime('now', ?)
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            """, (OVERDUE_MODIFIER,))
+            last = cursor.fetchone()
+            cursor.execute("""
+                INSERT OR IGNORE INTO reminder_watermarks (name, last_created_at, last_debt_id)
+                VALUES (?, ?, ?)
+            """, (name, last['created_at'] if last else '', last['id'] if last else 0))
+            conn.commit()
+            conn.close()
+            return {'debts': [], 'last_scanned': None}
+        last_created_at, last_debt_id = row['last_created_at'], row['last_debt_id']
+        
+        cursor.execute("""
+            SELECT 
+                d.id,
+                d.debtor_id,
+                COALESCE(ud.username, ud.display_name) as debtor_username,
+                COALESCE(uc.username, uc.display_name) as creditor_username,
+                (d.amount - d.paid_amount) as remaining,
+                d.created_at,
+                d.reminded,
+                e.description,
+                e.is_cancelled
+            FROM debts d
+            JOIN expenses e ON d.expense_id = e.id
+            JOIN users ud ON ud.id = d.debtor_id
+            JOIN users uc ON uc.id = d.creditor_id
+            WHERE d.created_at <= datetime('now', ?)
+            AND (d.created_at, d.id) > (?, ?)
+            ORDER BY d.created_at, d.id
+            LIMIT ?
+        """, (OVERDUE_MODIFIER, last_created_at, last_debt_id, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        
+        debts = [{
+            'id': row['id'],
+            'debtor': row['debtor_username'],
+            'debtor_id': row['debtor_id'],
+            'creditor': row['creditor_username'],
+            'remaining': row['remaining'],
+            'created_at': row['created_at'],
+            'description': row['description']
+        } for row in rows if row['remaining'] > 0 and not row['is_cancelled'] and not row['reminded']]
+        
+        return {
+            'debts': debts,
+            'last_scanned': (rows[-1]['created_at'], rows[-1]['id']) if rows else None
+        }
+    
+    def advance_reminder_watermark(self, created_at: str, debt_id: int, name: str = 'overdue'):
+        """
+        Сдвинуть позицию напоминаний
+        
+        Args:
+            created_at: created_at последнего обработанного долга
+            debt_id: id последнего обработанного долга
+            name: Имя позиции напоминаний
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO reminder_watermarks (name, last_created_at, last_debt_id) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                last_created_at = excluded.last_created_at,
+                last_debt_id = excluded.last_debt_id
+        """, (name, created_at, debt_id))
+        conn.commit()
+        conn.close()
@@ -0,0 +1,135 @@
+"""
+Выгрузка расходов, долгов и истории в CSV и NDJSON
+Роль: Разработчик - полные выгрузки для бухгалтерии без буферизации
+
+Запуск: python -m src.export {expenses,debts,history} [--format csv|ndjson]
+        [--from ДАТА] [--to ДАТА] [--user ИМЯ] [--after ID] [-o ФАЙЛ [--resume]]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from src.database import Database, EXPORT_QUERIES
+
+# Форматы выгрузки: имя -> MIME-тип
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+# Сколько строк CSV собирать в один кусок потока
+CSV_CHUNK_ROWS = 500
+
+
+def export_columns(kind: str) -> List[str]:
+    """Колонки выгрузки kind"""
+    return EXPORT_QUERIES[kind][0]
+
+
+def iter_csv(rows: Iterable[Dict], columns: List[str], header: bool = True) -> Iterator[str]:
+    """Строки в CSV по кускам из CSV_CHUNK_ROWS строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+        count += 1
+        if count % CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(rows: Iterable[Dict]) -> Iterator[str]:
+    """По одной строке JSON на запись"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def iter_export_chunks(rows: Iterable[Dict], kind: str, export_format: str,
+                       header: bool = True) -> Iterator[str]:
+    """Выгрузка в нужном формате по кускам текста"""
+    if export_format == 'csv':
+        return iter_csv(rows, export_columns(kind), header)
+    if export_format == 'ndjson':
+        return iter_ndjson(rows)
+    raise ValueError(f"Неизвестный формат: {export_format}")
+
+
+def last_exported_id(path: str, export_format: str) -> Optional[int]:
+    """
+    id последней полностью записанной строки файла выгрузки
+
+    Читается только хвост файла. Оборванная последняя строка отрезается,
+    чтобы продолжение дописало её заново.
+    """
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        tail_size = min(size, 64 * 1024)
+        f.seek(size - tail_size)
+        tail = f.read()
+        complete = tail.rfind(b'\n') + 1
+        if complete < len(tail):
+            f.truncate(size - tail_size + complete)
+        lines = tail[:complete].splitlines()
+
+    if not lines:
+        return None
+    last = lines[-1].decode('utf-8')
+    try:
+        if export_format == 'ndjson':
+            return json.loads(last)['id']
+        return int(next(csv.reader([last]))[0])
+    except (ValueError, KeyError, IndexError):
+        # Только заголовок CSV
+        return None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Выгрузка расходов, долгов и истории")
+    parser.add_argument('kind', choices=sorted(EXPORT_QUERIES))
+    parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--from', dest='date_from', help="Не раньше (YYYY-MM-DD [HH:MM:SS])")
+    parser.add_argument('--to', dest='date_to', help="Раньше (YYYY-MM-DD [HH:MM:SS])")
+    parser.add_argument('--user', help="Только строки с участием пользователя")
+    parser.add_argument('--after', type=int, default=0, help="Продолжить после строки с этим id")
+    parser.add_argument('-o', '--output', help="Файл (по умолчанию stdout)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Дописать в существующий файл с места обрыва")
+    parser.add_argument('--db', default=os.getenv('DATABASE_PATH', 'debts.db'))
+    args = parser.parse_args(argv)
+
+    after = args.after
+    header = True
+    mode = 'w'
+    if args.resume:
+        if not args.output:
+            parser.error("--resume работает только с --output")
+        if os.path.exists(args.output) and os.path.getsize(args.output):
+            after = last_exported_id(args.output, args.export_format) or after
+            header = False
+            mode = 'a'
+
+    rows = Database(db_path=args.db).iter_export(
+        args.kind, date_from=args.date_from, date_to=args.date_to,
+        username=args.user, after=after
+    )
+    chunks = iter_export_chunks(rows, args.kind, args.export_format, header)
+
+    if args.output:
+        with open(args.output, mode, encoding='utf-8', newline='') as f:
+            f.writelines(chunks)
+    else:
+        sys.stdout.writelines(chunks)
+
+
+if __name__ == '__main__':
+    main()
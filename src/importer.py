@@ -0,0 +1,222 @@
+"""
+Импорт расходов и выплат из CSV
+Роль: Разработчик - перенос групп из таблиц без ручного ввода
+
+Формат CSV (первая строка - заголовок):
+    type,date,description,amount,creditor,debtor,participants
+    expense,2024-05-01,пицца,4200,Вася,,Петя;Маша;Вася
+    expense,2024-05-02 19:30:00,такси,900,Маша,,
+    split,,,600,,Петя,
+    split,,,300,,Вася,
+    payment,2024-05-03,,1400,Вася,Петя,
+
+expense делится поровну между participants (через ';'); без participants
+за ним должны идти строки split с долей каждого должника, в сумме равные
+amount; доля самого creditor долгом не становится. payment - выплата
+debtor кредитору creditor.
+
+Запуск: python -m src.importer файл.csv [--dry-run] [--chunk-size N]
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from src.database import Database, IMPORT_CHUNK_SIZE, IMPORT_MAX_ERRORS
+
+# Допустимое расхождение суммы долей и суммы расхода
+SPLIT_TOLERANCE = 0.01
+
+
+class ImportRowError(ValueError):
+    """Строка CSV не прошла проверку"""
+
+
+@lru_cache(maxsize=4096)
+def _parse_iso_date(value: str) -> str:
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ImportRowError(f"Неверная дата: {value}")
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_date(value: str) -> str:
+    """
+    Дата из CSV (YYYY-MM-DD [HH:MM[:SS]]) в формате SQLite; пустая - текущее время UTC
+
+    Даты в выгрузках повторяются, поэтому разобранные значения кешируются.
+    """
+    value = value.strip()
+    if not value:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return _parse_iso_date(value)
+
+
+def parse_amount(value: str):
+    """Положительная сумма; целые суммы остаются int, как при вводе в боте"""
+    try:
+        amount = float(value.replace(',', '.'))
+    except ValueError:
+        raise ImportRowError(f"Неверная сумма: {value}")
+    if not amount > 0:
+        raise ImportRowError("Сумма должна быть положительной")
+    return int(amount) if amount.is_integer() else amount
+
+
+def _require(row: Dict[str, str], *columns: str):
+    for column in columns:
+        if not row.get(column):
+            raise ImportRowError(f"Не заполнено поле {column}")
+
+
+def _finish_expense(expense: Dict, errors: List[Dict]) -> Optional[Dict]:
+    """Проверить раскладку расхода из строк expense и split (None - расход отброшен)"""
+    total = sum(share for _, share in expense['shares'])
+    if not expense['shares']:
+        error = "Нет participants и строк split"
+    elif abs(total - expense['amount']) > SPLIT_TOLERANCE:
+        error = f"Сумма долей {total:g} не равна сумме расхода {expense['amount']:g}"
+    else:
+        return expense
+    errors.append({'line': expense['line'], 'error': error})
+    return None
+
+
+def _parse_record(row: Dict[str, str], line: int) -> Dict:
+    """Запись expense (пока без строк split) или payment из строки CSV"""
+    row_type = row.get('type', '').lower()
+    if row_type == 'expense':
+        _require(row, 'description', 'amount', 'creditor')
+        amount = parse_amount(row['amount'])
+        participants = [p.strip().lstrip('@') for p in row.get('participants', '').split(';')
+                        if p.strip()]
+        return {'line': line, 'type': 'expense', 'created_at': parse_date(row.get('date', '')),
+                'description': row['description'], 'amount': amount,
+                'creditor': row['creditor'].lstrip('@'),
+                'shares': [(participant, amount / len(participants)) for participant in participants]}
+    if row_type == 'payment':
+        _require(row, 'debtor', 'creditor', 'amount')
+        return {'line': line, 'type': 'payment', 'created_at': parse_date(row.get('date', '')),
+                'debtor': row['debtor'].lstrip('@'), 'creditor': row['creditor'].lstrip('@'),
+                'amount': parse_amount(row['amount'])}
+    raise ImportRowError(f"Неизвестный тип строки: {row.get('type', '')}")
+
+
+def parse_rows(lines: Iterable[str], errors: List[Dict]) -> Iterator[Dict]:
+    """
+    Разобрать CSV в записи для Database.bulk_import
+
+    Строки читаются потоком. Неверные строки пропускаются, а ошибка
+    дописывается в errors ({'line', 'error'}); расход с неверной строкой
+    split пропускается целиком вместе с остальными его строками split.
+    """
+    reader = csv.DictReader(lines)
+    missing = [column for column in ('type', 'amount') if column not in (reader.fieldnames or [])]
+    if missing:
+        errors.append({'line': 1, 'error': f"Нет колонок: {', '.join(missing)}"})
+        return
+
+    expense: Optional[Dict] = None
+    # Строки split отброшенного расхода пропускаются молча
+    skipping = False
+    for row in reader:
+        line = reader.line_num
+        row = {key: (value or '').strip() for key, value in row.items() if key}
+
+        if row.get('type', '').lower() == 'split':
+            if skipping:
+                continue
+            try:
+                if expense is None:
+                    raise ImportRowError("Строка split без расхода")
+                _require(row, 'debtor', 'amount')
+                if expense['equal']:
+                    raise ImportRowError("У расхода уже есть participants")
+                expense['shares'].append((row['debtor'].lstrip('@'), parse_amount(row['amount'])))
+            except ImportRowError as e:
+                if expense is None:
+                    errors.append({'line': line, 'error': str(e)})
+                else:
+                    # Расход без одной из долей записывать нельзя
+                    errors.append({'line': expense['line'],
+                                   'error': f"{e} (строка {line}), расход пропущен"})
+                    expense = None
+                skipping = True
+            continue
+
+        skipping = False
+        if expense is not None:
+            finished, expense = _finish_expense(expense, errors), None
+            if finished:
+                yield finished
+
+        try:
+            record = _parse_record(row, line)
+        except ImportRowError as e:
+            errors.append({'line': line, 'error': str(e)})
+            skipping = row.get('type', '').lower() == 'expense'
+            continue
+        if record['type'] == 'expense':
+            record['equal'] = bool(record['shares'])
+            expense = record
+        else:
+            yield record
+
+    if expense is not None:
+        finished = _finish_expense(expense, errors)
+        if finished:
+            yield finished
+
+
+def import_csv(db: Database, source: TextIO, dry_run: bool = False,
+               chunk_size: int = IMPORT_CHUNK_SIZE, progress=None) -> Dict:
+    """
+    Импортировать CSV из текстового потока
+
+    Returns:
+        Итог Database.bulk_import с ошибками разбора и записи (по номеру строки)
+    """
+    parse_errors: List[Dict] = []
+    summary = db.bulk_import(parse_rows(source, parse_errors), chunk_size=chunk_size,
+                             dry_run=dry_run, progress=progress)
+    summary['error_count'] += len(parse_errors)
+    errors = sorted(summary['errors'] + parse_errors, key=lambda error: error['line'])
+    summary['errors'] = errors[:IMPORT_MAX_ERRORS]
+    return summary
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Импорт расходов и выплат из CSV")
+    parser.add_argument('path', help="Файл CSV ('-' - stdin)")
+    parser.add_argument('--dry-run', action='store_true', help="Проверить без записи")
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument('--db', default=os.getenv('DATABASE_PATH', 'debts.db'))
+    args = parser.parse_args(argv)
+
+    def progress(summary):
+        print(f"\rОбработано строк: {summary['rows']}", end='', file=sys.stderr, flush=True)
+
+    if args.path == '-':
+        source = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    else:
+        source = open(args.path, encoding='utf-8-sig', newline='')
+    with source:
+        summary = import_csv(Database(db_path=args.db), source, dry_run=args.dry_run,
+                             chunk_size=args.chunk_size, progress=progress)
+    print(file=sys.stderr)
+
+    mode = "Проверка (без записи)" if summary['dry_run'] else "Импорт"
+    print(f"{mode}: расходов {summary['expenses']}, выплат {summary['payments']}, "
+          f"ошибок {summary['error_count']}")
+    for error in summary['errors']:
+        print(f"  строка {error['line']}: {error['error']}")
+    return 1 if summary['error_count'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
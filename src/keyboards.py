@@ -2,8 +2,46 @@
 Модуль для создания клавиатур Telegram бота
 Роль: Архитектор - проектирование структуры меню и кнопок
 """
+import calendar
+from datetime import datetime, timezone
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+from src.callbacks import callback_registry
+
+# Ограничение Telegram на размер callback_data
+MAX_CALLBACK_DATA_BYTES = 64
+
+
+def _to_base36(value: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        value, remainder = divmod(value, 36)
+        result = digits[remainder] + result
+        if value == 0:
+            return result
+
+
+def encode_debt_cursor(debt: Dict) -> str:
+    """
+    Закодировать позицию долга или расхода (created_at, id) для callback_data
+    
+    Args:
+        debt: Долг или расход с полями created_at (datetime) и id
+    
+    Returns:
+        Компактная строка вида "<секунды base36>.<id base36>"
+    """
+    seconds = calendar.timegm(debt['created_at'].timetuple())
+    return f"{_to_base36(seconds)}.{_to_base36(debt['id'])}"
+
+
+def decode_debt_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Раскодировать позицию долга или расхода из callback_data"""
+    seconds, debt_id = cursor.split(".")
+    created_at = datetime.fromtimestamp(int(seconds, 36), timezone.utc).replace(tzinfo=None)
+    return created_at, int(debt_id, 36)
 
 
 def get_main_menu_keyboard() -> InlineKeyboardMarkup:
@@ -24,19 +62,25 @@ def get_main_menu_keyboard() -> InlineKeyboardMarkup:
         ],
         [
             InlineKeyboardButton(text="📦 Долги по расходам", callback_data="debts_by_expense"),
+            InlineKeyboardButton(text="📋 Расходы", callback_data="expenses")
+        ],
+        [
             InlineKeyboardButton(text="ℹ️ Помощь", callback_data="help")
         ]
     ])
     return keyboard
 
 
-def get_debts_keyboard(debtor_username: str, debts: List[Dict]) -> InlineKeyboardMarkup:
+def get_debts_keyboard(debtor_username: str, debts: List[Dict],
+                       has_prev: bool = False, has_next: bool = False) -> InlineKeyboardMarkup:
     """
     Клавиатура со списком долгов и кнопками для выплаты
     
     Args:
         debtor_username: Имя должника
-        debts: Список долгов
+        debts: Список долгов (страница)
+        has_prev: Есть предыдущая страница
+        has_next: Есть следующая страница
     
     Returns:
         InlineKeyboardMarkup с кнопками долгов
@@ -47,39 +91,64 @@ def get_debts_keyboard(debtor_username: str, debts: List[Dict]) -> InlineKeyboar
         remaining = int(debt['remaining'])
         description = debt.get('description', 'расход')
         button_text = f"💸 {creditor}: {remaining}р ({description[:15]})"
-        callback_data = f"pay_debt:{debtor_username}:{creditor}:{remaining}"
+        # Участники и сумма остаются на сервере, в кнопке только токен
+        callback_data = callback_registry.issue("pay_debt", {
+            'debtor': debtor_username,
+            'creditor': creditor,
+            'debtor_id': debt.get('debtor_id'),
+            'creditor_id': debt.get('creditor_id'),
+            'amount': remaining
+        })
         buttons.append([InlineKeyboardButton(text=button_text, callback_data=callback_data)])
     
+    # Навигация по страницам: курсор первого/последнего долга страницы
+    navigation = []
+    if has_prev and debts:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Пред.", callback_data=f"my_debts:p:{encode_debt_cursor(debts[0])}"))
+    if has_next and debts:
+        navigation.append(InlineKeyboardButton(
+            text="След. ➡️", callback_data=f"my_debts:n:{encode_debt_cursor(debts[-1])}"))
+    if navigation:
+        buttons.append(navigation)
+    
     # Кнопка "Назад"
     buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")])
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_expense_list_keyboard(expenses: List[Dict]) -> InlineKeyboardMarkup:
+def get_expense_list_keyboard(expenses: List[Dict], has_next: bool = False) -> InlineKeyboardMarkup:
     """
-    Клавиатура со списком расходов
+    Клавиатура со страницей списка расходов
     
     Args:
-        expenses: Список расходов
+        expenses: Страница расходов из Database.list_expenses (новые первыми)
+        has_next: Есть ли более старые расходы
     
     Returns:
-        InlineKeyboardMarkup с кнопками расходов
+        InlineKeyboardMarkup с кнопками расходов и кнопкой следующей страницы
     """
     buttons = []
-    for expense in expenses[:10]:
+    for expense in expenses:
         description = expense['description']
         amount = int(expense['total_amount'])
-        button_text = f"📋 {description} ({amount}р)"
+        mark = "✅" if expense.get('status') == 'settled' else "📋"
+        button_text = f"{mark} {description} ({amount}р)"
         callback_data = f"expense_details:{expense['id']}"
         buttons.append([InlineKeyboardButton(text=button_text, callback_data=callback_data)])
     
+    if has_next and expenses:
+        buttons.append([InlineKeyboardButton(
+            text="Ещё ➡️", callback_data=f"expenses:n:{encode_debt_cursor(expenses[-1])}")])
     buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")])
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_payment_confirmation_keyboard(debtor: str, creditor: str, amount: float) -> InlineKeyboardMarkup:
+def get_payment_confirmation_keyboard(debtor: str, creditor: str, amount: float,
+                                      debtor_id: Optional[int] = None,
+                                      creditor_id: Optional[int] = None) -> InlineKeyboardMarkup:
     """
     Клавиатура подтверждения выплаты
     
@@ -87,6 +156,8 @@ def get_payment_confirmation_keyboard(debtor: str, creditor: str, amount: float)
         debtor: Должник
         creditor: Кредитор
         amount: Сумма
+        debtor_id: id должника (если известен)
+        creditor_id: id кредитора (если известен)
     
     Returns:
         InlineKeyboardMarkup с кнопками подтверждения
@@ -95,7 +166,13 @@ def get_payment_confirmation_keyboard(debtor: str, creditor: str, amount: float)
         [
             InlineKeyboardButton(
                 text=f"✅ Подтвердить выплату {int(amount)}р",
-                callback_data=f"confirm_payment:{debtor}:{creditor}:{amount}"
+                callback_data=callback_registry.issue("confirm_payment", {
+                    'debtor': debtor,
+                    'creditor': creditor,
+                    'debtor_id': debtor_id,
+                    'creditor_id': creditor_id,
+                    'amount': amount
+                })
             )
         ],
         [
@@ -106,6 +183,14 @@ def get_payment_confirmation_keyboard(debtor: str, creditor: str, amount: float)
     return keyboard
 
 
+def get_report_more_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура продолжения длинного отчёта"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="➡️ Ещё", callback_data="report_more")],
+        [InlineKeyboardButton(text="◀️ Главное меню", callback_data="main_menu")]
+    ])
+
+
 def get_back_to_menu_keyboard() -> InlineKeyboardMarkup:
     """Простая клавиатура с кнопкой "Назад в меню" """
     return InlineKeyboardMarkup(inline_keyboard=[
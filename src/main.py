@@ -9,14 +9,23 @@ from aiogram.filters import Command
 from aiogram.types import CallbackQuery
 from dotenv import load_dotenv
 from src.database import Database
-from src.bot import DebtBot
+from src.bot import DebtBot, format_expense_details
+from src.rendering import MessageRenderer
+from src.outbox import SendScheduler
+from src.notifications import NotificationWorker
+from src.reminders import ReminderScheduler
+from src.backup import BackupScheduler
+from src.callbacks import callback_registry
+from src.reports import ReportPage
 from src.keyboards import (
     get_main_menu_keyboard,
     get_debts_keyboard,
     get_expense_list_keyboard,
     get_payment_confirmation_keyboard,
     get_back_to_menu_keyboard,
-    get_reply_keyboard
+    get_reply_keyboard,
+    get_report_more_keyboard,
+    decode_debt_cursor
 )
 
 # Загружаем переменные окружения
@@ -34,10 +43,53 @@ dp = Dispatcher()
 db = Database()
 debt_bot = DebtBot(db)
 
+# Отрисовка сообщений без лишних edit_text
+renderer = MessageRenderer()
+
+# Очередь исходящих сообщений с учётом лимитов Telegram
+outbox = SendScheduler(bot)
+
+# Фоновая рассылка уведомлений участникам
+notifications = NotificationWorker(db, outbox)
+
+# Напоминания о просроченных долгах
+reminders = ReminderScheduler(db, outbox)
+
+# Резервные копии БД по расписанию (BACKUP_INTERVAL, BACKUP_DIR, BACKUP_KEEP)
+backups = BackupScheduler(db)
+
 # Состояния для создания расхода (FSM)
 user_states = {}
 
 
+async def reply(message: types.Message, text: str, reply_markup=None):
+    """Ответить в чат через очередь исходящих сообщений (интерактивная полоса)"""
+    return await outbox.send(message.chat.id, text, reply_markup=reply_markup)
+
+
+def current_user(user: types.User) -> int:
+    """
+    Получить id пользователя в БД по данным Telegram
+
+    Регистрирует пользователя при первом обращении и обновляет имя
+    при переименовании (повторные вызовы обслуживаются из кэша).
+    """
+    return db.register_user(user.id, user.username, user.full_name)
+
+
+async def register_user_middleware(handler, event, data):
+    """Регистрирует пользователя (и его личный чат для уведомлений)"""
+    if event.from_user:
+        # Первое обращение пишет в БД - не блокируем цикл событий; вызовы
+        # current_user в обработчиках после этого обслуживаются из кэша
+        await asyncio.to_thread(current_user, event.from_user)
+    return await handler(event, data)
+
+
+dp.message.outer_middleware(register_user_middleware)
+dp.callback_query.outer_middleware(register_user_middleware)
+
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     """Обработчик команды /start"""
@@ -45,7 +97,8 @@ async def cmd_start(message: types.Message):
         "💰 Бот для отслеживания долгов\n\n"
         "Используйте кнопки ниже для работы с ботом!"
     )
-    await message.answer(
+    await reply(
+        message,
         welcome_text,
         reply_markup=get_main_menu_keyboard()
     )
@@ -60,63 +113,76 @@ async def callback_main_menu(callback: CallbackQuery):
     if user_id in user_states:
         del user_states[user_id]
     
-    try:
-        await callback.message.edit_text(
-            "📱 Главное меню:",
-            reply_markup=get_main_menu_keyboard()
-        )
-    except Exception:
-        # Если не удалось отредактировать (например, это новое сообщение), отправляем новое
-        await callback.message.answer(
-            "📱 Главное меню:",
-            reply_markup=get_main_menu_keyboard()
-        )
+    await renderer.edit(
+        callback.message,
+        "📱 Главное меню:",
+        reply_markup=get_main_menu_keyboard()
+    )
     await callback.answer()
 
 
-@dp.callback_query(F.data == "my_debts")
-async def callback_my_debts(callback: CallbackQuery):
-    """Обработчик кнопки 'Мои долги'"""
-    username = callback.from_user.username or callback.from_user.first_name or "Unknown"
-    debts = db.get_debts()
+# Количество долгов на странице "Мои долги"
+DEBTS_PAGE_SIZE = 5
+
+
+async def show_my_debts(callback: CallbackQuery, after=None, before=None):
+    """Показать страницу долгов текущего пользователя"""
+    user_id = current_user(callback.from_user)
     
-    # Фильтруем долги текущего пользователя
-    user_debts = [d for d in debts if d['debtor'] == username]
+    # Страница выбирается LIMIT-запросом по индексу от курсора
+    page = db.get_debts_page(user_id, after=after, before=before, limit=DEBTS_PAGE_SIZE)
+    if not page['debts'] and (after is not None or before is not None):
+        # Долги за курсором погашены или отменены - показываем первую страницу
+        page = db.get_debts_page(user_id, limit=DEBTS_PAGE_SIZE)
+    user_debts = page['debts']
     
     if not user_debts:
-        try:
-            await callback.message.edit_text(
-                "🎉 У вас нет активных долгов!",
-                reply_markup=get_back_to_menu_keyboard()
-            )
-        except Exception:
-            await callback.message.answer(
-                "🎉 У вас нет активных долгов!",
-                reply_markup=get_back_to_menu_keyboard()
-            )
+        await renderer.edit(
+            callback.message,
+            "🎉 У вас нет активных долгов!",
+            reply_markup=get_back_to_menu_keyboard()
+        )
     else:
-        total = sum(d['remaining'] for d in user_debts)
-        text = f"💳 Ваши долги (всего: {int(total)}р):\n\n"
+        summary = db.get_debts_summary(debtor_username=user_id)
+        text = f"💳 Ваши долги (всего: {int(summary['total'])}р, долгов: {summary['count']}):\n\n"
         text += "\n".join([
             f"• {d['creditor']}: {int(d['remaining'])}р ({d['description']})"
-            for d in user_debts[:5]
+            for d in user_debts
         ])
-        if len(user_debts) > 5:
-            text += f"\n\n... и ещё {len(user_debts) - 5} долгов"
         
-        try:
-            await callback.message.edit_text(
-                text,
-                reply_markup=get_debts_keyboard(username, user_debts)
-            )
-        except Exception:
-            await callback.message.answer(
-                text,
-                reply_markup=get_debts_keyboard(username, user_debts)
+        await renderer.edit(
+            callback.message,
+            text,
+            reply_markup=get_debts_keyboard(
+                user_debts[0]['debtor'], user_debts,
+                has_prev=page['has_prev'], has_next=page['has_next']
             )
+        )
     await callback.answer()
 
 
+@dp.callback_query(F.data == "my_debts")
+async def callback_my_debts(callback: CallbackQuery):
+    """Обработчик кнопки 'Мои долги'"""
+    await show_my_debts(callback)
+
+
+@dp.callback_query(F.data.startswith("my_debts:"))
+async def callback_my_debts_page(callback: CallbackQuery):
+    """Обработчик перехода по страницам 'Мои долги'"""
+    try:
+        _, direction, cursor = callback.data.split(":")
+        position = decode_debt_cursor(cursor)
+    except (ValueError, OverflowError, OSError):
+        # Повреждённый или устаревший курсор - первая страница
+        await show_my_debts(callback)
+        return
+    if direction == "n":
+        await show_my_debts(callback, after=position)
+    else:
+        await show_my_debts(callback, before=position)
+
+
 @dp.callback_query(F.data == "statistics")
 async def callback_statistics(callback: CallbackQuery):
     """Обработчик кнопки 'Статистика'"""
@@ -127,16 +193,11 @@ async def callback_statistics(callback: CallbackQuery):
 • Должников: {stats['debtors_count']}
 • Кредиторов: {stats['creditors_count']}"""
     
-    try:
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_back_to_menu_keyboard()
-        )
-    except Exception:
-        await callback.message.answer(
-            text,
-            reply_markup=get_back_to_menu_keyboard()
-        )
+    await renderer.edit(
+        callback.message,
+        text,
+        reply_markup=get_back_to_menu_keyboard()
+    )
     await callback.answer()
 
 
@@ -153,16 +214,11 @@ async def callback_history(callback: CallbackQuery):
             date_str = op['created_at'].strftime('%d.%m %H:%M')
             text += f"{date_str} | {op['username']}: {op['description']}\n"
     
-    try:
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_back_to_menu_keyboard()
-        )
-    except Exception:
-        await callback.message.answer(
-            text,
-            reply_markup=get_back_to_menu_keyboard()
-        )
+    await renderer.edit(
+        callback.message,
+        text,
+        reply_markup=get_back_to_menu_keyboard()
+    )
     await callback.answer()
 
 
@@ -181,16 +237,57 @@ async def callback_debts_by_expense(callback: CallbackQuery):
                 text += f"  • {debt['debtor']} должен {debt['creditor']} {int(debt['remaining'])}р\n"
             text += "\n"
     
-    try:
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_back_to_menu_keyboard()
-        )
-    except Exception:
-        await callback.message.answer(
-            text,
-            reply_markup=get_back_to_menu_keyboard()
-        )
+    await renderer.edit(
+        callback.message,
+        text,
+        reply_markup=get_back_to_menu_keyboard()
+    )
+    await callback.answer()
+
+
+# Количество расходов на странице "Расходы"
+EXPENSES_PAGE_SIZE = 8
+
+
+@dp.callback_query(F.data == "expenses")
+@dp.callback_query(F.data.startswith("expenses:"))
+async def callback_expenses(callback: CallbackQuery):
+    """Обработчик кнопки 'Расходы' и перехода к следующей странице"""
+    after = None
+    if callback.data.startswith("expenses:"):
+        after = decode_debt_cursor(callback.data.split(":")[2])
+    
+    page = db.list_expenses(after=after, limit=EXPENSES_PAGE_SIZE)
+    
+    if not page['expenses']:
+        text = "Расходов пока нет"
+    else:
+        text = "📋 Расходы (✅ - погашен), нажмите для подробностей:"
+    
+    await renderer.edit(
+        callback.message,
+        text,
+        reply_markup=get_expense_list_keyboard(page['expenses'], has_next=page['has_next'])
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("expense_details:"))
+async def callback_expense_details(callback: CallbackQuery):
+    """Обработчик кнопки расхода из списка расходов"""
+    expense_id = int(callback.data.split(":")[1])
+    expense = db.get_expense_details(expense_id)
+    
+    if expense is None:
+        text = "Расход не найден или отменён"
+    else:
+        text = format_expense_details(expense)
+    
+    await renderer.edit(
+        callback.message,
+        text,
+        reply_markup=get_back_to_menu_keyboard()
+    )
     await callback.answer()
 
 
@@ -210,25 +307,29 @@ async def callback_help(callback: CallbackQuery):
         "📊 Статистика:\n"
         "Показывает общую информацию о долгах"
     )
-    try:
-        await callback.message.edit_text(
-            help_text,
-            reply_markup=get_back_to_menu_keyboard()
-        )
-    except Exception:
-        # Если не удалось отредактировать, отправляем новое сообщение
-        await callback.message.answer(
-            help_text,
-            reply_markup=get_back_to_menu_keyboard()
-        )
+    await renderer.edit(
+        callback.message,
+        help_text,
+        reply_markup=get_back_to_menu_keyboard()
+    )
     await callback.answer()
 
 
+async def resolve_callback(callback: CallbackQuery):
+    """Данные действия кнопки или None, если кнопка устарела"""
+    payload = callback_registry.resolve(callback.data)
+    if payload is None:
+        await callback.answer("Кнопка устарела, откройте список заново", show_alert=True)
+    return payload
+
+
 @dp.callback_query(F.data.startswith("pay_debt:"))
 async def callback_pay_debt(callback: CallbackQuery):
     """Обработчик кнопки выплаты долга"""
-    _, debtor, creditor, amount = callback.data.split(":")
-    amount = float(amount)
+    payload = await resolve_callback(callback)
+    if payload is None:
+        return
+    debtor, creditor, amount = payload['debtor'], payload['creditor'], payload['amount']
     
     text = f"💸 Выплата долга\n\n"
     text += f"Должник: {debtor}\n"
@@ -236,9 +337,13 @@ async def callback_pay_debt(callback: CallbackQuery):
     text += f"Сумма: {int(amount)}р\n\n"
     text += "Подтвердите выплату:"
     
-    await callback.message.edit_text(
+    await renderer.edit(
+        callback.message,
         text,
-        reply_markup=get_payment_confirmation_keyboard(debtor, creditor, amount)
+        reply_markup=get_payment_confirmation_keyboard(
+            debtor, creditor, amount,
+            debtor_id=payload['debtor_id'], creditor_id=payload['creditor_id']
+        )
     )
     await callback.answer()
 
@@ -246,21 +351,28 @@ async def callback_pay_debt(callback: CallbackQuery):
 @dp.callback_query(F.data.startswith("confirm_payment:"))
 async def callback_confirm_payment(callback: CallbackQuery):
     """Обработчик подтверждения выплаты"""
-    _, debtor, creditor, amount = callback.data.split(":")
-    amount = float(amount)
-    
-    username = callback.from_user.username or callback.from_user.first_name or "Unknown"
+    payload = await resolve_callback(callback)
+    if payload is None:
+        return
+    debtor, creditor, amount = payload['debtor'], payload['creditor'], payload['amount']
+    debtor_ref = payload['debtor_id'] or debtor
+    creditor_ref = payload['creditor_id'] or creditor
     
     # Проверяем что пользователь - должник
-    if username != debtor:
+    if db.get_user_id(debtor_ref) != current_user(callback.from_user):
         await callback.answer("Вы можете выплачивать только свои долги!", show_alert=True)
         return
     
-    # Выплачиваем долг
-    success = db.pay_debt(debtor, creditor, amount)
+    # Кнопка одноразовая: повторное нажатие не спишет долг дважды
+    callback_registry.discard(callback.data)
+    
+    # Выплачиваем долг; токен кнопки - ключ идемпотентности, поэтому
+    # одновременные нажатия и повторная доставка апдейта проводят выплату один раз
+    success = db.pay_debt(debtor_ref, creditor_ref, amount,
+                          idempotency_key=f"bot:{callback.data}")
     
     if success:
-        remaining = db.get_debt_amount(debtor, creditor)
+        remaining = db.get_debt_amount(debtor_ref, creditor_ref)
         if remaining == 0:
             text = f"✅ Долг полностью погашен!\n\n{debtor} больше не должен {creditor}"
         else:
@@ -268,7 +380,8 @@ async def callback_confirm_payment(callback: CallbackQuery):
     else:
         text = "❌ Ошибка при выплате долга"
     
-    await callback.message.edit_text(
+    await renderer.edit(
+        callback.message,
         text,
         reply_markup=get_back_to_menu_keyboard()
     )
@@ -278,7 +391,8 @@ async def callback_confirm_payment(callback: CallbackQuery):
 @dp.callback_query(F.data == "cancel_payment")
 async def callback_cancel_payment(callback: CallbackQuery):
     """Обработчик отмены выплаты"""
-    await callback.message.edit_text(
+    await renderer.edit(
+        callback.message,
         "❌ Выплата отменена",
         reply_markup=get_back_to_menu_keyboard()
     )
@@ -291,28 +405,43 @@ async def callback_create_expense(callback: CallbackQuery):
     user_id = callback.from_user.id
     user_states[user_id] = {"step": "waiting_description", "data": {}}
     
-    try:
-        await callback.message.edit_text(
-            "📝 Создание расхода\n\n"
-            "Введите описание расхода (например: пицца):\n\n"
-            "💡 Напишите 'отмена' чтобы отменить",
-            reply_markup=get_back_to_menu_keyboard()
-        )
-    except Exception:
-        # Если не удалось отредактировать, отправляем новое сообщение
-        await callback.message.answer(
-            "📝 Создание расхода\n\n"
-            "Введите описание расхода (например: пицца):\n\n"
-            "💡 Напишите 'отмена' чтобы отменить",
-            reply_markup=get_back_to_menu_keyboard()
-        )
+    await renderer.edit(
+        callback.message,
+        "📝 Создание расхода\n\n"
+        "Введите описание расхода (например: пицца):\n\n"
+        "💡 Напишите 'отмена' чтобы отменить",
+        reply_markup=get_back_to_menu_keyboard()
+    )
+    await callback.answer()
+
+
+async def send_response(message: types.Message, response):
+    """Отправить ответ команды; длинный отчёт уходит несколькими сообщениями"""
+    if not isinstance(response, ReportPage):
+        await reply(message, response)
+        return
+    for chunk in response.chunks[:-1]:
+        await reply(message, chunk)
+    await reply(
+        message,
+        response.chunks[-1],
+        reply_markup=get_report_more_keyboard() if response.has_more else None
+    )
+
+
+@dp.callback_query(F.data == "report_more")
+async def callback_report_more(callback: CallbackQuery):
+    """Обработчик кнопки 'Ещё' под длинным отчётом"""
+    user = callback.from_user
+    response = debt_bot.handle_command("ещё", user.username or current_user(user))
+    await send_response(callback.message, response)
     await callback.answer()
 
 
 @dp.message()
 async def handle_message(message: types.Message):
     """Обработчик всех сообщений"""
-    username = message.from_user.username or message.from_user.first_name or "Unknown"
+    creator_id = current_user(message.from_user)
     user_id = message.from_user.id
     text = message.text or ""
     
@@ -325,11 +454,12 @@ async def handle_message(message: types.Message):
         
         if state["step"] == "waiting_description":
             if not text.strip():
-                await message.answer("Введите описание расхода (например: пицца):")
+                await reply(message, "Введите описание расхода (например: пицца):")
                 return
             state["data"]["description"] = text.strip()
             state["step"] = "waiting_amount"
-            await message.answer(
+            await reply(
+                message,
                 "Введите сумму (например: 4200):\n\n"
                 "💡 Нажмите 'Главное меню' чтобы отменить",
                 reply_markup=get_back_to_menu_keyboard()
@@ -337,34 +467,37 @@ async def handle_message(message: types.Message):
             return
         elif state["step"] == "waiting_amount":
             if not text.strip():
-                await message.answer("Введите сумму (например: 4200):")
+                await reply(message, "Введите сумму (например: 4200):")
                 return
             try:
                 amount = float(text.strip())
                 if amount <= 0:
-                    await message.answer("Сумма должна быть больше нуля. Введите сумму:")
+                    await reply(message, "Сумма должна быть больше нуля. Введите сумму:")
                     return
                 state["data"]["amount"] = amount
                 state["step"] = "waiting_participants"
-                await message.answer(
+                await reply(
+                    message,
                     "Введите участников через @ (например: @Петя @Маша):\n\n"
                     "💡 Нажмите 'Главное меню' чтобы отменить",
                     reply_markup=get_back_to_menu_keyboard()
                 )
                 return
             except ValueError:
-                await message.answer("Неверный формат суммы. Введите число (например: 4200):")
+                await reply(message, "Неверный формат суммы. Введите число (например: 4200):")
                 return
         elif state["step"] == "waiting_participants":
             if not text.strip():
-                await message.answer(
+                await reply(
+                    message,
                     "Введите участников через @ (например: @Петя @Маша):",
                     reply_markup=get_back_to_menu_keyboard()
                 )
                 return
             participants = [p.replace('@', '') for p in text.split() if p.startswith('@')]
             if not participants:
-                await message.answer(
+                await reply(
+                    message,
                     "Укажите участников через @ (например: @Петя @Маша):\n\n"
                     "💡 Нажмите 'Главное меню' чтобы отменить",
                     reply_markup=get_back_to_menu_keyboard()
@@ -375,7 +508,7 @@ async def handle_message(message: types.Message):
             expense_id = db.create_expense(
                 description=state["data"]["description"],
                 total_amount=state["data"]["amount"],
-                creator_username=username,
+                creator_username=creator_id,
                 participants=participants
             )
             
@@ -387,16 +520,22 @@ async def handle_message(message: types.Message):
             response += f"💸 По {int(amount_per_person)}р с каждого"
             
             del user_states[user_id]
-            await message.answer(response, reply_markup=get_main_menu_keyboard())
+            await reply(message, response, reply_markup=get_main_menu_keyboard())
             return
         
         # Если мы здесь, значит состояние есть но шаг не распознан - сбрасываем
         del user_states[user_id]
     
-    # Если пользователь НЕ в FSM, показываем только главное меню
-    # Текстовые команды отключены - только кнопки!
+    # Текстовые команды классифицируются маршрутизатором за один проход
     if text.strip() and not text.startswith("/"):
-        await message.answer(
+        response = debt_bot.handle_command(text, message.from_user.username or creator_id)
+        if response is not None:
+            await send_response(message, response)
+            return
+        
+        # Не команда - показываем главное меню
+        await reply(
+            message,
             "💡 Используйте кнопки для работы с ботом!\n\n"
             "Нажмите на кнопки ниже чтобы начать:",
             reply_markup=get_main_menu_keyboard()
@@ -406,7 +545,17 @@ async def handle_message(message: types.Message):
 async def main():
     """Главная функция"""
     print("Бот запущен...")
-    await dp.start_polling(bot)
+    outbox.start()
+    notifications.start()
+    reminders.start()
+    backups.start()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await backups.stop()
+        await reminders.stop()
+        await notifications.stop()
+        await outbox.stop()
 
 
 if __name__ == "__main__":
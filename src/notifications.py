@@ -0,0 +1,154 @@
+"""
+Уведомления участников о расходах и выплатах
+Роль: Разработчик - фоновая рассылка событий из журнала
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from src.database import Database
+from src.outbox import SendScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def render_event(event: Dict) -> Dict[str, str]:
+    """
+    Текст уведомления для каждого получателя события
+
+    Args:
+        event: Событие из журнала
+
+    Returns:
+        Словарь получатель -> строка уведомления
+    """
+    payload = event['payload']
+    event_type = event['event_type']
+    lines = {}
+
+    if event_type == 'expense_created':
+        creditor = payload['creditor']
+        for debt in payload['debts']:
+            if debt['debtor'] != creditor:
+                lines[debt['debtor']] = (
+                    f"💸 {creditor} записал расход '{payload['description']}': "
+                    f"вы должны {int(debt['amount'])}р"
+                )
+    elif event_type == 'payment':
+        lines[payload['creditor']] = f"✅ {payload['debtor']} вернул вам {int(payload['amount'])}р"
+    elif event_type == 'expense_amended':
+        creditor = payload['creditor']
+        for debt in payload['debts']:
+            if debt['debtor'] != creditor and debt['debtor'] not in payload['removed']:
+                lines[debt['debtor']] = (
+                    f"✏️ {creditor} изменил расход '{payload['description']}': "
+                    f"ваша доля {int(debt['amount'])}р"
+                )
+        for debtor in payload['removed']:
+            if debtor != creditor:
+                lines[debtor] = f"✏️ {creditor} убрал вас из расхода '{payload['description']}'"
+    elif event_type == 'expense_cancelled':
+        for debtor in payload['debtors']:
+            if debtor != payload['username']:
+                lines[debtor] = f"❌ {payload['username']} отменил расход '{payload['description']}'"
+
+    return lines
+
+
+def build_digests(events: List[Dict]) -> Dict[str, List[str]]:
+    """
+    Сгруппировать уведомления по получателям
+
+    Args:
+        events: События из журнала в порядке записи
+
+    Returns:
+        Словарь получатель -> строки уведомлений в порядке событий
+    """
+    digests: Dict[str, List[str]] = OrderedDict()
+    for event in events:
+        for recipient, line in render_event(event).items():
+            digests.setdefault(recipient, []).append(line)
+    return digests
+
+
+def format_digest(lines: List[str]) -> str:
+    """Текст сводки для одного получателя"""
+    if len(lines) == 1:
+        return lines[0]
+    return "🔔 Новые события:\n\n" + '\n'.join(lines)
+
+
+class NotificationWorker:
+    """
+    Фоновый подписчик журнала событий
+
+    Читает новые события, находит чаты получателей и ставит в очередь
+    по одной сводке на получателя.
+    """
+
+    CONSUMER = 'notifications'
+
+    def __init__(self, db: Database, outbox: SendScheduler,
+                 poll_interval: float = 1.0, batch_size: int = 500):
+        self.db = db
+        self.outbox = outbox
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> int:
+        """
+        Обработать одну пачку событий
+
+        Returns:
+            Количество обработанных событий
+        """
+        last_id = await asyncio.to_thread(self.db.get_event_cursor, self.CONSUMER)
+        if last_id is None:
+            # Первый запуск: не рассылаем события, накопленные до него
+            last_id = await asyncio.to_thread(self.db.get_last_event_id)
+            await asyncio.to_thread(self.db.set_event_cursor, self.CONSUMER, last_id)
+            return 0
+
+        events = await asyncio.to_thread(self.db.get_events, last_id, self.batch_size)
+        if not events:
+            return 0
+
+        digests = build_digests(events)
+        chats = await asyncio.to_thread(self.db.get_chat_ids, list(digests))
+        for recipient, lines in digests.items():
+            chat_id = chats.get(recipient)
+            if chat_id is not None:
+                self.outbox.notify(chat_id, format_digest(lines))
+
+        await asyncio.to_thread(self.db.set_event_cursor, self.CONSUMER, events[-1]['id'])
+        return len(events)
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка при рассылке уведомлений")
+                processed = 0
+            if processed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Запустить фоновую рассылку"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую рассылку"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
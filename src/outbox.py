@@ -0,0 +1,279 @@
+"""
+Очередь исходящих сообщений Telegram с учётом лимитов API
+Роль: Разработчик - планировщик отправки сообщений
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (полосы) очереди: меньше - важнее
+INTERACTIVE = 0
+NOTIFICATION = 1
+
+# Максимальная длина текста сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+# Разделитель при склейке сообщений в один чат
+COALESCE_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до появления токена (0 - можно сейчас)"""
+        now = self.clock()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        """Забрать токен (вызывать после delay() == 0)"""
+        self._refill(self.clock())
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Приостановить ведро (ответ Telegram retry_after)"""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+        self.tokens = 0
+
+    @property
+    def is_idle(self) -> bool:
+        """Ведро полное и не на паузе - его можно забыть"""
+        now = self.clock()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+@dataclass
+class OutgoingMessage:
+    """Сообщение в очереди на отправку"""
+    chat_id: int
+    text: str
+    priority: int = INTERACTIVE
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    future: Optional[asyncio.Future] = None
+    attempts: int = 0
+
+    @property
+    def can_coalesce(self) -> bool:
+        """Склеивать можно только простой текст без клавиатур и параметров"""
+        return not self.kwargs
+
+
+@dataclass
+class OutboxStats:
+    """Счётчики очереди"""
+    sent: int = 0
+    coalesced: int = 0
+    retried: int = 0
+    failed: int = 0
+
+
+class SendScheduler:
+    """
+    Планировщик исходящих сообщений
+
+    Держит глобальное ведро токенов и ведро на каждый чат, отправляет
+    интерактивные ответы раньше уведомлений, склеивает ожидающие сообщения
+    в один чат и повторяет отправку после ответа retry_after.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = 30.0,
+                 per_chat_rate: float = 1.0, per_chat_burst: float = 3.0,
+                 max_attempts: int = 5,
+                 clock: Callable[[], float] = time.monotonic):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.stats = OutboxStats()
+        self._global = TokenBucket(global_rate, global_rate, clock)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._lanes: List[Deque[OutgoingMessage]] = [deque(), deque()]
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # ----- Постановка в очередь -----
+
+    def _enqueue(self, item: OutgoingMessage):
+        lane = self._lanes[item.priority]
+        if item.can_coalesce:
+            for queued in lane:
+                if (queued.chat_id == item.chat_id and queued.can_coalesce
+                        and queued.future is None and item.future is None
+                        and len(queued.text) + len(COALESCE_SEPARATOR) + len(item.text) <= MAX_MESSAGE_LENGTH):
+                    queued.text += COALESCE_SEPARATOR + item.text
+                    self.stats.coalesced += 1
+                    return
+        lane.append(item)
+        self._wakeup.set()
+
+    def send(self, chat_id: int, text: str, priority: int = INTERACTIVE,
+             **kwargs) -> asyncio.Future:
+        """
+        Поставить сообщение в очередь
+
+        Args:
+            chat_id: Чат получателя
+            text: Текст сообщения
+            priority: INTERACTIVE или NOTIFICATION
+            **kwargs: Параметры bot.send_message (reply_markup и т.п.)
+
+        Returns:
+            Future с отправленным Message
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(OutgoingMessage(chat_id, text, priority, kwargs, future))
+        return future
+
+    def notify(self, chat_id: int, text: str):
+        """Поставить уведомление в очередь (без ожидания результата, со склейкой)"""
+        self._enqueue(OutgoingMessage(chat_id, text, NOTIFICATION))
+
+    @property
+    def pending(self) -> int:
+        """Количество сообщений в очереди"""
+        return sum(len(lane) for lane in self._lanes)
+
+    # ----- Отправка -----
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst, self.clock)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self) -> tuple:
+        """
+        Найти первое сообщение, которое можно отправить сейчас
+
+        Returns:
+            (сообщение или None, сколько ждать если отправлять нечего)
+        """
+        wait = None
+        for lane in self._lanes:
+            for index, item in enumerate(lane):
+                delay = self._chat_bucket(item.chat_id).delay()
+                if delay == 0:
+                    del lane[index]
+                    return item, 0.0
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _deliver(self, item: OutgoingMessage):
+        item.attempts += 1
+        try:
+            result = await self.bot.send_message(item.chat_id, item.text, **item.kwargs)
+        except TelegramRetryAfter as e:
+            # Флуд-контроль: ставим чат на паузу и возвращаем сообщение в начало полосы
+            self.stats.retried += 1
+            self._chat_bucket(item.chat_id).pause(e.retry_after)
+            if item.attempts < self.max_attempts:
+                self._lanes[item.priority].appendleft(item)
+                return
+            self._fail(item, e)
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            self.stats.sent += 1
+            if item.future is not None and not item.future.done():
+                item.future.set_result(result)
+
+    def _fail(self, item: OutgoingMessage, error: Exception):
+        self.stats.failed += 1
+        if item.future is not None:
+            if not item.future.done():
+                item.future.set_exception(error)
+        else:
+            logger.warning("Не удалось отправить сообщение в чат %s: %s", item.chat_id, error)
+
+    def _prune_buckets(self):
+        """Забыть вёдра неактивных чатов"""
+        if len(self._chats) > 1000:
+            for chat_id in [c for c, b in self._chats.items() if b.is_idle]:
+                del self._chats[chat_id]
+
+    async def run_once(self) -> bool:
+        """
+        Отправить одно сообщение, если лимиты позволяют
+
+        Returns:
+            True если сообщение было отправлено (или обработано)
+        """
+        global_delay = self._global.delay()
+        if global_delay > 0:
+            await asyncio.sleep(global_delay)
+            return False
+
+        item, wait = self._next_ready()
+        if item is None:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            return False
+
+        self._global.consume()
+        self._chat_bucket(item.chat_id).consume()
+        await self._deliver(item)
+        self._prune_buckets()
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка в очереди исходящих сообщений")
+
+    async def drain(self):
+        """Отправить всё, что стоит в очереди (для тестов и остановки)"""
+        while self.pending:
+            await self.run_once()
+
+    def start(self):
+        """Запустить фоновую отправку"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую отправку"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
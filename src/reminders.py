@@ -0,0 +1,108 @@
+"""
+Напоминания о просроченных долгах
+Роль: Разработчик - планировщик напоминаний внутри процесса бота
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from src.database import Database, OVERDUE_DAYS
+from src.outbox import SendScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def format_reminder(debts: List[Dict]) -> str:
+    """Текст напоминания для одного должника"""
+    lines = [f"⏰ Напоминание: долги старше {OVERDUE_DAYS} дней"]
+    for debt in debts:
+        lines.append(f"• {debt['creditor']}: {int(debt['remaining'])}р ({debt['description']})")
+    return '\n'.join(lines)
+
+
+class ReminderScheduler:
+    """
+    Периодически напоминает должникам о просроченных долгах
+
+    Каждый запуск читает только долги, пересёкшие порог просрочки после
+    предыдущего запуска, группирует их по должникам и отправляет не больше
+    max_reminders напоминаний за раз (остальные уйдут в следующий запуск).
+    Перед этим из журналов событий и изменений удаляются старые записи
+    (Database.prune_change_logs).
+    """
+
+    def __init__(self, db: Database, outbox: SendScheduler,
+                 interval: float = 3600.0, batch_size: int = 500,
+                 max_reminders: int = 50):
+        self.db = db
+        self.outbox = outbox
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_reminders = max_reminders
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> int:
+        """
+        Обработать долги, ставшие просроченными
+
+        Returns:
+            Количество отправленных напоминаний
+        """
+        pruned = await asyncio.to_thread(self.db.prune_change_logs)
+        if pruned['events'] or pruned['row_changes']:
+            logger.info("Очищены журналы: событий %d, изменений %d",
+                        pruned['events'], pruned['row_changes'])
+
+        scan = await asyncio.to_thread(self.db.get_newly_overdue_debts, 'overdue', self.batch_size)
+        if scan['last_scanned'] is None:
+            return 0
+
+        # Берём долги по порядку, пока не наберётся max_reminders должников
+        by_debtor: Dict[int, List[Dict]] = OrderedDict()
+        last_processed = scan['last_scanned']
+        for debt in scan['debts']:
+            if debt['debtor_id'] not in by_debtor and len(by_debtor) >= self.max_reminders:
+                # Остаток пачки уйдёт в следующий запуск
+                last_processed = (previous['created_at'], previous['id'])
+                break
+            by_debtor.setdefault(debt['debtor_id'], []).append(debt)
+            previous = debt
+
+        chats = await asyncio.to_thread(self.db.get_chat_ids, list(by_debtor))
+        sent = 0
+        for debtor_id, debtor_debts in by_debtor.items():
+            chat_id = chats.get(debtor_id)
+            if chat_id is not None:
+                self.outbox.notify(chat_id, format_reminder(debtor_debts))
+                sent += 1
+
+        # Позиция идёт за последний просмотренный долг, включая погашенные
+        # и отменённые, чтобы они не читались в каждом запуске
+        await asyncio.to_thread(self.db.advance_reminder_watermark, *last_processed)
+        return sent
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка при отправке напоминаний")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запустить периодические напоминания"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить периодические напоминания"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,130 @@
+"""
+Слой отрисовки сообщений бота
+Роль: Разработчик - устранение лишних запросов edit_text к Telegram API
+"""
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message
+
+
+# Ответы Telegram, означающие что редактировать нечего (содержимое совпадает)
+NOT_MODIFIED_ERRORS = (
+    "message is not modified",
+)
+
+# Ответы Telegram, при которых сообщение нельзя отредактировать,
+# и нужно отправить новое
+NOT_EDITABLE_ERRORS = (
+    "message can't be edited",
+    "message to edit not found",
+    "there is no text in the message to edit",
+)
+
+
+@dataclass
+class RenderStats:
+    """Счётчики слоя отрисовки"""
+    edits: int = 0          # Успешные edit_text
+    skipped: int = 0        # Правки, пропущенные по отпечатку без запроса к API
+    not_modified: int = 0   # Ответы "message is not modified"
+    fallbacks: int = 0      # Отправки нового сообщения вместо правки
+    saved_calls: int = 0    # Сэкономленные запросы к API
+
+
+def fingerprint(text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> str:
+    """
+    Отпечаток содержимого сообщения (текст + клавиатура)
+
+    Args:
+        text: Текст сообщения
+        reply_markup: Клавиатура сообщения
+
+    Returns:
+        Короткий хэш содержимого
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(text.encode('utf-8'))
+    digest.update(b'\x00')
+    if reply_markup is not None:
+        digest.update(reply_markup.model_dump_json(exclude_none=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class MessageRenderer:
+    """
+    Редактирует сообщения бота, запоминая отпечаток последнего содержимого
+    для каждой пары (chat_id, message_id)
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.stats = RenderStats()
+        self._fingerprints: "OrderedDict[Tuple[int, int], str]" = OrderedDict()
+
+    def _remember(self, message: Message, value: str):
+        """Запомнить отпечаток сообщения (LRU с ограничением размера)"""
+        key = (message.chat.id, message.message_id)
+        self._fingerprints[key] = value
+        self._fingerprints.move_to_end(key)
+        while len(self._fingerprints) > self.max_entries:
+            self._fingerprints.popitem(last=False)
+
+    def forget(self, message: Message):
+        """Забыть отпечаток сообщения (например, после удаления)"""
+        self._fingerprints.pop((message.chat.id, message.message_id), None)
+
+    async def edit(self, message: Message, text: str,
+                   reply_markup: Optional[InlineKeyboardMarkup] = None) -> Message:
+        """
+        Показать содержимое в сообщении: отредактировать его, пропустить
+        правку если содержимое не изменилось, или отправить новое сообщение
+        если редактирование невозможно
+
+        Args:
+            message: Сообщение, которое нужно отредактировать
+            text: Новый текст
+            reply_markup: Новая клавиатура
+
+        Returns:
+            Сообщение, в котором теперь отображается содержимое
+
+        Raises:
+            TelegramAPIError: при ошибках, не связанных с редактированием
+        """
+        value = fingerprint(text, reply_markup)
+        key = (message.chat.id, message.message_id)
+
+        if self._fingerprints.get(key) == value:
+            # Без отпечатка это были бы edit_text с ошибкой и answer
+            self._fingerprints.move_to_end(key)
+            self.stats.skipped += 1
+            self.stats.saved_calls += 2
+            return message
+
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            error = e.message.lower()
+            if any(marker in error for marker in NOT_MODIFIED_ERRORS):
+                self._remember(message, value)
+                self.stats.not_modified += 1
+                self.stats.saved_calls += 1
+                return message
+            if not any(marker in error for marker in NOT_EDITABLE_ERRORS):
+                raise
+            # Сообщение нельзя отредактировать - отправляем новое
+            self.forget(message)
+            sent = await message.answer(text, reply_markup=reply_markup)
+            self.stats.fallbacks += 1
+            if sent is not None:
+                self._remember(sent, value)
+                return sent
+            return message
+
+        self._remember(message, value)
+        self.stats.edits += 1
+        return message
@@ -0,0 +1,115 @@
+"""
+Постраничный вывод длинных текстовых отчётов
+Роль: Разработчик - отчёты любой длины в пределах лимитов Telegram
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Hashable, Iterable, Iterator, List, Optional
+
+from src.outbox import MAX_MESSAGE_LENGTH
+
+# Строк отчёта на одну страницу (страница может занять несколько сообщений)
+DEFAULT_PAGE_ROWS = 50
+
+
+@dataclass
+class ReportPage:
+    """Страница отчёта, уже разбитая на сообщения"""
+    chunks: List[str] = field(default_factory=list)
+    has_more: bool = False
+
+    def __str__(self) -> str:
+        return '\n'.join(self.chunks)
+
+
+def split_lines(lines: Iterable[str], max_length: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """
+    Разбить строки на сообщения не длиннее max_length
+
+    Строки не разрываются между сообщениями; слишком длинная строка
+    обрезается с многоточием.
+    """
+    chunks = []
+    current: List[str] = []
+    size = 0
+    for line in lines:
+        if len(line) > max_length:
+            line = line[:max_length - 1] + "…"
+        # +1 на перевод строки перед новой строкой
+        added = len(line) + (1 if current else 0)
+        if current and size + added > max_length:
+            chunks.append('\n'.join(current))
+            current, size = [], 0
+            added = len(line)
+        current.append(line)
+        size += added
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+class ReportSession:
+    """Отчёт, читаемый страницами из ленивого источника строк"""
+
+    def __init__(self, title: str, rows: Iterator[str], page_rows: int = DEFAULT_PAGE_ROWS,
+                 max_length: int = MAX_MESSAGE_LENGTH):
+        self.title = title
+        self.rows = iter(rows)
+        self.page_rows = page_rows
+        self.max_length = max_length
+        self._peeked: Optional[str] = None
+        self.pages_shown = 0
+
+    def next_page(self) -> ReportPage:
+        """
+        Прочитать следующую страницу
+
+        Из источника берётся не больше page_rows + 1 строк (лишняя строка
+        нужна, чтобы узнать, есть ли продолжение), поэтому стоимость
+        страницы не зависит от размера отчёта.
+        """
+        lines = []
+        if self._peeked is not None:
+            lines.append(self._peeked)
+            self._peeked = None
+        lines.extend(islice(self.rows, self.page_rows - len(lines)))
+        self._peeked = next(self.rows, None)
+
+        header = self.title if self.pages_shown == 0 else f"{self.title} (продолжение)"
+        self.pages_shown += 1
+        return ReportPage(chunks=split_lines([header] + lines, self.max_length),
+                          has_more=self._peeked is not None)
+
+
+class ReportSessions:
+    """
+    Незавершённые отчёты пользователей для команды "ещё"
+
+    Хранится не больше max_entries отчётов; самые давние вытесняются.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._sessions: "OrderedDict[Hashable, ReportSession]" = OrderedDict()
+
+    def start(self, key: Hashable, title: str, rows: Iterator[str],
+              page_rows: int = DEFAULT_PAGE_ROWS) -> ReportPage:
+        """Начать отчёт и вернуть первую страницу"""
+        self._sessions.pop(key, None)
+        return self._show(key, ReportSession(title, rows, page_rows))
+
+    def more(self, key: Hashable) -> Optional[ReportPage]:
+        """Следующая страница отчёта или None, если продолжать нечего"""
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return None
+        return self._show(key, session)
+
+    def _show(self, key: Hashable, session: ReportSession) -> ReportPage:
+        page = session.next_page()
+        if page.has_more:
+            self._sessions[key] = session
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+        return page
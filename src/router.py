@@ -0,0 +1,93 @@
+"""
+Маршрутизатор текстовых команд бота
+Роль: Архитектор - классификация сообщения за один проход
+"""
+import re
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+Handler = Callable[..., Optional[str]]
+
+
+class CommandRouter:
+    """
+    Маршрутизатор текстовых команд
+
+    Сообщение классифицируется за один проход: сначала точное совпадение
+    целой фразы (поиск в словаре), затем по первому слову выбираются
+    только команды с этим ключевым словом, и лишь сообщения без ключевого
+    слова проверяются шаблонами без префикса (например, создание расхода).
+    Все шаблоны компилируются один раз при регистрации.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Handler] = {}
+        self._by_keyword: Dict[str, List[Tuple[Pattern, Handler]]] = {}
+        self._fallback: List[Tuple[Pattern, Handler]] = []
+
+    def exact(self, phrase: str, handler: Handler):
+        """Команда из фиксированной фразы, например "долги" """
+        self._exact[phrase] = handler
+
+    def keyword(self, keyword: str, pattern: str, handler: Handler):
+        """
+        Команда вида "<ключевое слово> <аргументы>"
+
+        Args:
+            keyword: Первое слово сообщения
+            pattern: Шаблон для остатка сообщения; группы передаются в обработчик
+            handler: Обработчик команды
+        """
+        self._by_keyword.setdefault(keyword, []).append((re.compile(pattern), handler))
+
+    def fallback(self, pattern: str, handler: Handler):
+        """Команда без ключевого слова; проверяется, если первое слово не ключевое"""
+        self._fallback.append((re.compile(pattern), handler))
+
+    def resolve(self, text: str) -> Optional[Tuple[Handler, Tuple[str, ...]]]:
+        """
+        Найти обработчик для сообщения
+
+        Returns:
+            Кортеж (обработчик, группы шаблона) или None
+        """
+        text = text.strip()
+        handler = self._exact.get(text)
+        if handler is not None:
+            return handler, ()
+
+        parts = text.split(None, 1)
+        if not parts:
+            return None
+
+        routes = self._by_keyword.get(parts[0])
+        if routes is not None:
+            # Ключевое слово занято командой: не пробуем шаблоны без префикса
+            rest = parts[1] if len(parts) > 1 else ""
+            for pattern, handler in routes:
+                match = pattern.match(rest)
+                if match:
+                    return handler, match.groups()
+            return None
+
+        for pattern, handler in self._fallback:
+            match = pattern.match(text)
+            if match:
+                return handler, match.groups()
+        return None
+
+    def dispatch(self, text: str, *args) -> Optional[str]:
+        """
+        Выполнить команду из сообщения
+
+        Args:
+            text: Текст сообщения
+            *args: Аргументы, передаваемые обработчику перед группами шаблона
+
+        Returns:
+            Ответ обработчика или None, если команда не распознана
+        """
+        route = self.resolve(text)
+        if route is None:
+            return None
+        handler, groups = route
+        return handler(*args, *groups)
@@ -2,8 +2,30 @@
 REST API для веб-приложения
 Роль: Разработчик - создание API endpoints
 """
-from flask import Blueprint, jsonify, request
-from src.database import Database
+from datetime import datetime, timezone
+from functools import wraps
+import io
+from itertools import islice
+from flask import Blueprint, Response, jsonify, make_response, request, stream_with_context
+from src.database import (
+    Database,
+    EXPORT_QUERIES,
+    IdempotencyKeyConflict,
+    format_timestamp,
+    is_user_name,
+    parse_amount
+)
+from src.export import EXPORT_FORMATS, iter_export_chunks
+from src.importer import import_csv
+from src.web.encoding import (
+    NDJSON_MIMETYPE,
+    compress_response,
+    iter_json_list,
+    iter_ndjson,
+    streamed_response,
+    wants_ndjson
+)
+from src.web.stream import stream_events
 import os
 
 api_bp = Blueprint('api', __name__)
@@ -12,45 +34,292 @@ api_bp = Blueprint('api', __name__)
 db_path = os.getenv('DATABASE_PATH', 'debts.db')
 db = Database(db_path=db_path)
 
+# Наибольший размер страницы списка расходов
+MAX_EXPENSES_PAGE = 100
+# Ограничения пакетного запроса /api/batch
+BATCH_MAX_OPERATIONS = int(os.getenv('BATCH_MAX_OPERATIONS', 500))
+BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', 1024 * 1024))
+# Наибольший размер файла для /api/import
+IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', 50 * 1024 * 1024))
+# Наибольшая длина заголовка Idempotency-Key
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
+class InvalidIdempotencyKey(ValueError):
+    """Заголовок Idempotency-Key пустой или слишком длинный"""
+
+
+class InvalidPeriod(ValueError):
+    """Границы периода from/to не разбираются как дата"""
+
+
+def get_idempotency_key():
+    """
+    Ключ идемпотентности из заголовка Idempotency-Key (None если не передан)
+    
+    Повтор POST с тем же ключом возвращает исходный результат без новой
+    записи; с тем же ключом, но другим телом - 422.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise InvalidIdempotencyKey(
+            f'Idempotency-Key должен быть от 1 до {MAX_IDEMPOTENCY_KEY_LENGTH} символов')
+    return f"api:{key}"
+
+
+def get_period():
+    """
+    Период из query параметров from и to (None - граница не задана)
+    
+    Даты разбираются datetime.fromisoformat, а не сравниваются строками
+    с created_at; дата с часовым поясом переводится в UTC.
+    """
+    period = []
+    for name in ('from', 'to'):
+        value = request.args.get(name)
+        if value is None:
+            period.append(None)
+            continue
+        try:
+            moment = datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise InvalidPeriod(f"Неверная дата в параметре {name}: {value}")
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+        period.append(moment)
+    return tuple(period)
+
+
+@api_bp.errorhandler(InvalidPeriod)
+def invalid_period(error):
+    """Неверная граница периода"""
+    return jsonify({'success': False, 'error': str(error)}), 400
+
+
+@api_bp.errorhandler(InvalidIdempotencyKey)
+def invalid_idempotency_key(error):
+    """Неверный заголовок Idempotency-Key"""
+    return jsonify({'success': False, 'error': str(error)}), 400
+
+
+@api_bp.errorhandler(IdempotencyKeyConflict)
+def idempotency_key_conflict(error):
+    """Ключ повторно использован с другим телом запроса"""
+    return jsonify({'success': False, 'error': str(error)}), 422
+
+
+def versioned(view):
+    """
+    Условные GET-запросы по поколению реестра
+    
+    ETag - номер поколения из ledger_meta и граница просрочки (флаг overdue
+    меняется со временем без записи в БД). Если клиент прислал актуальный
+    If-None-Match, отвечаем 304, не читая таблицы и не сериализуя ответ.
+    Поколение читается до выполнения запроса: запись во время него даст
+    более старый ETag, и следующий запрос просто перечитает данные.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = f"{db.get_ledger_version()}.{db.get_overdue_boundary()}"
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        return response
+    return wrapper
+
+
+@api_bp.after_request
+def no_cache(response):
+    """Ответы API можно хранить, но перед использованием нужно проверить ETag"""
+    response.headers.setdefault('Cache-Control', 'no-cache')
+    return response
+
+
+@api_bp.after_request
+def compress(response):
+    """Сжатие больших готовых ответов (потоковые сжимаются в streamed_response)"""
+    return compress_response(response)
+
 
 @api_bp.route('/debts', methods=['GET'])
+@versioned
 def get_debts():
-    """Получить список всех долгов"""
-    creditor = request.args.get('creditor')
-    debtor = request.args.get('debtor')
+    """
+    Получить список долгов (фильтры creditor, debtor, expense_id, from, to)
+    
+    Долги отдаются потоком (format=ndjson - по одному на строку); count и
+    total считаются по ходу потока и идут после списка.
+    """
+    date_from, date_to = get_period()
+    debts = db.iter_debts(
+        creditor_username=request.args.get('creditor'),
+        debtor_username=request.args.get('debtor'),
+        expense_id=request.args.get('expense_id', type=int),
+        date_from=date_from,
+        date_to=date_to
+    )
+    
+    if wants_ndjson():
+        return streamed_response(iter_ndjson(debts), NDJSON_MIMETYPE)
+    
+    totals = {'total': 0.0}
+    
+    def counted(debts):
+        for debt in debts:
+            totals['total'] += debt['remaining']
+            yield debt
     
-    debts = db.get_debts(creditor_username=creditor) if creditor else db.get_debts()
+    return streamed_response(iter_json_list('debts', counted(debts), head={'success': True},
+                                            tail=lambda: totals))
+
+
+@api_bp.route('/expenses', methods=['GET'])
+@versioned
+def get_expenses():
+    """
+    Получить страницу расходов с итогами
+    
+    Query параметры:
+        creator, participant: Фильтр по создателю или участнику
+        status: open, settled или cancelled (по умолчанию все неотменённые)
+        date_from, date_to: Период создания (YYYY-MM-DD HH:MM:SS)
+        sort: created_at, total_amount или outstanding
+        order: desc (по умолчанию) или asc
+        after: next_cursor из предыдущей страницы
+        limit: Размер страницы (не больше MAX_EXPENSES_PAGE)
+    """
+    sort = request.args.get('sort', 'created_at')
+    limit = min(request.args.get('limit', 20, type=int), MAX_EXPENSES_PAGE)
+    
+    after = None
+    if request.args.get('after'):
+        try:
+            value, expense_id = request.args['after'].rsplit('|', 1)
+            after = (value if sort == 'created_at' else float(value), int(expense_id))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Неверный курсор'}), 400
+    
+    try:
+        page = db.list_expenses(
+            creator_username=request.args.get('creator'),
+            participant_username=request.args.get('participant'),
+            status=request.args.get('status'),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            sort=sort,
+            descending=request.args.get('order', 'desc') != 'asc',
+            after=after,
+            limit=max(limit, 1)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
-    if debtor:
-        debts = [d for d in debts if d['debtor'] == debtor]
+    next_cursor = None
+    if page['next_cursor'] is not None:
+        value, expense_id = page['next_cursor']
+        next_cursor = f"{format_timestamp(value)}|{expense_id}"
     
     return jsonify({
         'success': True,
-        'debts': debts,
-        'count': len(debts)
+        'expenses': page['expenses'],
+        'count': len(page['expenses']),
+        'has_next': page['has_next'],
+        'next_cursor': next_cursor
     })
 
 
-@api_bp.route('/expenses', methods=['GET'])
-def get_expenses():
-    """Получить список расходов"""
-    # Получаем долги сгруппированные по расходам
-    grouped = db.get_debts_grouped_by_expense()
+@api_bp.route('/expenses/<int:expense_id>', methods=['GET'])
+@versioned
+def get_expense(expense_id):
+    """Получить детали расхода"""
+    expense = db.get_expense_details(expense_id)
     
-    expenses = []
-    for description, debts in grouped.items():
-        total_amount = sum(d['amount'] for d in debts)
-        expenses.append({
-            'description': description,
-            'total_amount': total_amount,
-            'debts_count': len(debts),
-            'debts': debts
-        })
+    if expense is None:
+        return jsonify({
+            'success': False,
+            'error': 'Расход не найден'
+        }), 404
     
     return jsonify({
         'success': True,
-        'expenses': expenses,
-        'count': len(expenses)
+        'expense': expense
+    })
+
+
+@api_bp.route('/expenses/<int:expense_id>', methods=['PATCH'])
+def amend_expense(expense_id):
+    """Изменить сумму, участников или описание расхода (только создатель)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({
+            'success': False,
+            'error': 'Тело запроса должно быть JSON-объектом'
+        }), 400
+    
+    user = data.get('user')
+    amount = data.get('amount')
+    participants = data.get('participants')
+    description = data.get('description')
+    
+    if not is_user_name(user):
+        return jsonify({
+            'success': False,
+            'error': 'Не указан пользователь'
+        }), 400
+    
+    if participants is not None:
+        if not isinstance(participants, list) or not all(map(is_user_name, participants)):
+            return jsonify({
+                'success': False,
+                'error': 'participants должен быть списком имён'
+            }), 400
+        if not participants:
+            return jsonify({
+                'success': False,
+                'error': 'Список участников не может быть пустым'
+            }), 400
+    
+    if description is not None and (not isinstance(description, str) or not description.strip()):
+        return jsonify({
+            'success': False,
+            'error': 'Неверное описание'
+        }), 400
+    
+    if amount is not None:
+        try:
+            amount = parse_amount(amount)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'Неверная сумма'
+            }), 400
+    
+    expense = db.get_expense_details(expense_id)
+    if expense is None:
+        return jsonify({
+            'success': False,
+            'error': 'Расход не найден'
+        }), 404
+    
+    diff = db.amend_expense(expense_id, user, total_amount=amount,
+                            participants=participants, description=description)
+    if diff is None:
+        return jsonify({
+            'success': False,
+            'error': 'Изменить расход может только создатель'
+        }), 403
+    
+    return jsonify({
+        'success': True,
+        'changes': diff,
+        'message': 'Расход изменён'
     })
 
 
@@ -70,13 +339,30 @@ def create_expense():
             'error': 'Не все поля заполнены'
         }), 400
     
+    # Пользователи из JSON - только имена: внутренние id API не принимает
+    if not is_user_name(creator) or not isinstance(participants, list) or not all(
+            map(is_user_name, participants)):
+        return jsonify({
+            'success': False,
+            'error': 'creator и participants должны быть именами'
+        }), 400
+    
+    try:
+        amount = parse_amount(amount)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    key = get_idempotency_key()
     try:
-        amount = float(amount)
         expense_id = db.create_expense(
             description=description,
             total_amount=amount,
             creator_username=creator,
-            participants=participants
+            participants=participants,
+            idempotency_key=key
         )
         
         return jsonify({
@@ -84,6 +370,8 @@ def create_expense():
             'expense_id': expense_id,
             'message': 'Расход создан'
         })
+    except IdempotencyKeyConflict:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -106,9 +394,23 @@ def create_payment():
             'error': 'Не все поля заполнены'
         }), 400
     
+    if not is_user_name(debtor) or not is_user_name(creditor):
+        return jsonify({
+            'success': False,
+            'error': 'debtor и creditor должны быть именами'
+        }), 400
+    
+    try:
+        amount = parse_amount(amount)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    key = get_idempotency_key()
     try:
-        amount = float(amount)
-        success = db.pay_debt(debtor, creditor, amount)
+        success = db.pay_debt(debtor, creditor, amount, idempotency_key=key)
         
         if success:
             return jsonify({
@@ -120,6 +422,8 @@ def create_payment():
                 'success': False,
                 'error': 'Ошибка при выплате долга'
             }), 400
+    except IdempotencyKeyConflict:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -127,7 +431,47 @@ def create_payment():
         }), 500
 
 
+@api_bp.route('/batch', methods=['POST'])
+def batch():
+    """
+    Выполнить пакет расходов и выплат одной транзакцией
+    
+    Тело: {"operations": [{"type": "expense", "description", "amount",
+    "creator", "participants"} | {"type": "payment", "debtor", "creditor",
+    "amount"}, ...]}. Либо выполняются все операции, либо ни одной; в
+    results - итог по каждой операции (см. Database.execute_batch).
+    """
+    if request.content_length is None:
+        return jsonify({
+            'success': False,
+            'error': 'Не указан Content-Length'
+        }), 411
+    if request.content_length > BATCH_MAX_BYTES:
+        return jsonify({
+            'success': False,
+            'error': f'Размер пакета не больше {BATCH_MAX_BYTES} байт'
+        }), 413
+    
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({
+            'success': False,
+            'error': 'Не указан список operations'
+        }), 400
+    
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({
+            'success': False,
+            'error': f'В пакете не больше {BATCH_MAX_OPERATIONS} операций'
+        }), 413
+    
+    result = db.execute_batch(operations, idempotency_key=get_idempotency_key())
+    return jsonify(result), 200 if result['success'] else 400
+
+
 @api_bp.route('/statistics', methods=['GET'])
+@versioned
 def get_statistics():
     """Получить статистику"""
     username = request.args.get('username')
@@ -141,25 +485,164 @@ def get_statistics():
 
 
 @api_bp.route('/history', methods=['GET'])
+@versioned
 def get_history():
-    """Получить историю операций"""
+    """
+    Получить историю операций (новые первыми)
+    
+    Query параметры:
+        limit: Сколько операций вернуть
+        expense_id: Только операции по расходу
+        counterparty: Только операции с этим пользователем второй стороной
+        format: ndjson - по одной операции на строку вместо JSON-объекта
+    
+    Операции читаются пачками и отдаются потоком, не собираясь в памяти.
+    """
     limit = request.args.get('limit', 50, type=int)
     expense_id = request.args.get('expense_id', type=int)
     
-    history = db.get_operation_history(expense_id=expense_id, limit=limit)
+    history = islice(db.iter_operation_history(expense_id=expense_id,
+                                               batch_size=min(max(limit, 1), 500),
+                                               counterparty=request.args.get('counterparty')),
+                     max(limit, 0))
+    
+    if wants_ndjson():
+        return streamed_response(iter_ndjson(history), NDJSON_MIMETYPE)
+    return streamed_response(iter_json_list('history', history, head={'success': True}))
+
+
+@api_bp.route('/dashboard', methods=['GET'])
+@versioned
+def get_dashboard():
+    """Долги, расходы, статистика и история одним запросом и одним снимком БД"""
+    limit = request.args.get('history_limit', 20, type=int)
     
-    # Конвертируем datetime в строки для JSON
-    for op in history:
-        op['created_at'] = op['created_at'].isoformat()
+    dashboard = db.get_dashboard(history_limit=limit)
     
     return jsonify({
         'success': True,
-        'history': history,
-        'count': len(history)
+        'total': dashboard['statistics']['total_debt'],
+        **dashboard
     })
 
 
+@api_bp.route('/changes', methods=['GET'])
+def get_changes():
+    """
+    Изменения с версии клиента
+    
+    Query параметры:
+        since: Версия из предыдущего ответа /dashboard или /changes
+    
+    Клиент применяет debts и expenses (добавить или заменить по id),
+    deleted_debts и deleted_expenses (убрать) и history (добавить) к своему
+    кэшу. При reset=true нужно заново загрузить /dashboard.
+    """
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'success': False, 'error': 'Не указан параметр since'}), 400
+    
+    changes = db.get_changes(since)
+    
+    return jsonify({'success': True, **changes})
+
+
+@api_bp.route('/export/<kind>', methods=['GET'])
+def export(kind):
+    """
+    Полная выгрузка expenses, debts или history потоком
+    
+    Query параметры:
+        format: csv (по умолчанию) или ndjson
+        from, to: Период создания строк (YYYY-MM-DD [HH:MM:SS])
+        user: Только строки с участием пользователя
+        after: id последней полученной строки - продолжение оборванной выгрузки
+    
+    Строки идут в порядке id пачками из БД, память сервера не зависит от
+    размера выгрузки.
+    """
+    if kind not in EXPORT_QUERIES:
+        return jsonify({'success': False, 'error': f'Неизвестная выгрузка: {kind}'}), 404
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': f'Неизвестный формат: {export_format}'}), 400
+    after = request.args.get('after', 0, type=int)
+    date_from, date_to = get_period()
+    
+    rows = db.iter_export(
+        kind,
+        date_from=date_from,
+        date_to=date_to,
+        username=request.args.get('user'),
+        after=after
+    )
+    # Продолжение дописывается к уже полученному файлу - без заголовка CSV
+    chunks = iter_export_chunks(rows, kind, export_format, header=after == 0)
+    
+    response = streamed_response((chunk.encode() for chunk in chunks), EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{export_format}'
+    return response
+
+
+@api_bp.route('/import', methods=['POST'])
+def import_ledger():
+    """
+    Импорт расходов и выплат из CSV (формат - см. src.importer)
+    
+    Файл передаётся полем file формы multipart/form-data или телом
+    запроса text/csv. Query параметры:
+        dry_run: 1 - только проверить, ничего не записывая
+    
+    Файл читается потоком и пишется пачками по одной транзакции; в ответе
+    число записанных расходов и выплат и ошибки по номерам строк.
+    """
+    if request.content_length is None:
+        return jsonify({
+            'success': False,
+            'error': 'Не указан Content-Length'
+        }), 411
+    if request.content_length > IMPORT_MAX_BYTES:
+        return jsonify({
+            'success': False,
+            'error': f'Размер файла не больше {IMPORT_MAX_BYTES} байт'
+        }), 413
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'success': False, 'error': 'Не передан файл file'}), 400
+        stream = upload.stream
+    else:
+        stream = request.stream
+    source = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    
+    try:
+        summary = import_csv(db, source, dry_run=request.args.get('dry_run') == '1')
+    except UnicodeDecodeError:
+        return jsonify({'success': False, 'error': 'Файл не в кодировке UTF-8'}), 400
+    return jsonify({'success': summary['error_count'] == 0, **summary})
+
+
+@api_bp.route('/stream', methods=['GET'])
+def stream():
+    """
+    Поток изменений реестра (Server-Sent Events)
+    
+    События: expense_created, payment, expense_cancelled, expense_amended.
+    После обрыва браузер сам присылает Last-Event-ID и получает пропущенное.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    
+    return Response(
+        stream_with_context(stream_events(db, after_id)),
+        mimetype='text/event-stream',
+        headers={'X-Accel-Buffering': 'no'}
+    )
+
+
 @api_bp.route('/debts/grouped', methods=['GET'])
+@versioned
 def get_grouped_debts():
     """Получить долги сгруппированные по расходам"""
     grouped = db.get_debts_grouped_by_expense()
@@ -2,12 +2,29 @@
 Flask веб-приложение для управления долгами
 Роль: Разработчик - создание веб-приложения
 """
+import os
+from datetime import timedelta
 from flask import Flask, render_template
 from src.web.api import api_bp
+from src.web.encoding import FastJSONProvider
 
 app = Flask(__name__)
+# jsonify через быстрый кодировщик (orjson, если установлен)
+app.json = FastJSONProvider(app)
 app.register_blueprint(api_bp, url_prefix='/api')
 
+# Статика кэшируется браузером надолго: ссылки на неё содержат версию файла
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = timedelta(days=365)
+
+
+@app.url_defaults
+def static_version(endpoint, values):
+    """Добавить к ссылкам на статику ?v=<время изменения файла>"""
+    if endpoint == 'static' and 'v' not in values:
+        path = os.path.join(app.static_folder, values.get('filename', ''))
+        if os.path.isfile(path):
+            values['v'] = int(os.path.getmtime(path))
+
 
 @app.route('/')
 def index():
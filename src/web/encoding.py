@@ -0,0 +1,170 @@
+"""
+Сериализация JSON и потоковые ответы API
+Роль: Разработчик - большие выдачи без сборки всего ответа в памяти
+"""
+import dataclasses
+import gzip
+import json
+import zlib
+from datetime import date, datetime
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from flask import Response, request
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него работает стандартный json
+    orjson = None
+
+# Ответы меньше этого размера не сжимаются: gzip их почти не уменьшит
+GZIP_MIN_SIZE = 1024
+# Мелкие куски потока копятся до этого размера перед отправкой
+STREAM_BUFFER_SIZE = 16 * 1024
+# MIME-тип построчного JSON
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def default(value: Any) -> Any:
+    """Типы, которых нет в JSON: даты и модели из src.database"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def dumps_std(value: Any) -> bytes:
+    """Кодировщик на стандартном json"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=default).encode()
+
+
+def dumps_orjson(value: Any) -> bytes:
+    """Кодировщик на orjson (даты и dataclass он понимает сам)"""
+    return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+_dumps: Callable[[Any], bytes] = dumps_orjson if orjson is not None else dumps_std
+
+
+def set_encoder(encoder: Callable[[Any], bytes]):
+    """Заменить кодировщик (объект -> bytes) для всех ответов API"""
+    global _dumps
+    _dumps = encoder
+
+
+def dumps(value: Any) -> bytes:
+    """Закодировать значение текущим кодировщиком"""
+    return _dumps(value)
+
+
+class FastJSONProvider(JSONProvider):
+    """JSON-провайдер Flask: jsonify идёт через подключаемый кодировщик"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return json.loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype='application/json')
+
+
+def wants_ndjson() -> bool:
+    """Клиент просит построчный JSON (?format=ndjson или Accept)"""
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def accepts_gzip() -> bool:
+    return request.accept_encodings['gzip'] > 0
+
+
+def iter_json_list(key: str, items: Iterable[Any], head: Optional[Dict] = None,
+                   tail: Optional[Callable[[], Dict]] = None) -> Iterator[bytes]:
+    """
+    Объект {...head, key: [items], count, ...tail()} по частям
+
+    tail вызывается после перебора items, поэтому итоги (например, сумма)
+    можно считать по ходу потока.
+    """
+    yield dumps(head or {})[:-1] + (b',' if head else b'') + dumps(key) + b':['
+    count = 0
+    for item in items:
+        yield (b',' if count else b'') + dumps(item)
+        count += 1
+    yield b'],' + dumps({'count': count, **(tail() if tail else {})})[1:]
+
+
+def iter_ndjson(items: Iterable[Any]) -> Iterator[bytes]:
+    """По одному JSON-объекту на строку"""
+    for item in items:
+        yield dumps(item) + b'\n'
+
+
+def _buffered(chunks: Iterable[bytes], size: int = STREAM_BUFFER_SIZE) -> Iterator[bytes]:
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 - формат gzip
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def streamed_response(chunks: Iterable[bytes], mimetype: str = 'application/json') -> Response:
+    """
+    Потоковый ответ с gzip по Accept-Encoding
+
+    Заголовки отправляются до тела, поэтому начало потока читается заранее:
+    если весь ответ меньше GZIP_MIN_SIZE, он уходит обычным несжатым
+    ответом, иначе - по частям (chunked), сжатый, если клиент принимает gzip.
+    """
+    chunks = _buffered(chunks)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= GZIP_MIN_SIZE:
+            break
+    else:
+        return Response(b''.join(head), mimetype=mimetype)
+
+    body = chain(head, chunks)
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if accepts_gzip():
+        response.response = _gzip_stream(body)
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def compress_response(response: Response) -> Response:
+    """Сжать готовый (не потоковый) ответ, если он большой и клиент принимает gzip"""
+    if (response.is_streamed or response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE or not accepts_gzip():
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
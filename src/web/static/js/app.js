@@ -3,10 +3,24 @@
 
 const API_BASE = '/api';
 
+// Сколько последних операций показывать в истории
+const HISTORY_LIMIT = 20;
+// Сколько последних расходов показывать (как DASHBOARD_EXPENSES_LIMIT на сервере)
+const EXPENSES_LIMIT = 50;
+
+// Локальный кэш реестра: после первой загрузки сервер присылает только
+// изменения с версии state.version (/api/changes)
+const state = {
+    version: null,
+    debts: new Map(),
+    expenses: new Map(),
+    history: []
+};
+
 // Инициализация при загрузке страницы
 document.addEventListener('DOMContentLoaded', () => {
     initTabs();
-    loadDebts();
+    loadDashboard().then(subscribeToChanges);
 });
 
 // Управление вкладками
@@ -29,168 +43,288 @@ function switchTab(tabName) {
     document.querySelector(`[data-tab="${tabName}"]`).classList.add('active');
     document.getElementById(`${tabName}-tab`).classList.add('active');
     
-    // Загружаем данные для вкладки
-    switch(tabName) {
-        case 'debts':
-            loadDebts();
-            break;
-        case 'expenses':
-            loadExpenses();
-            break;
-        case 'statistics':
-            loadStatistics();
-            break;
-        case 'history':
-            loadHistory();
-            break;
-    }
+    // Догружаем изменения с последней известной версии
+    syncChanges();
 }
 
-// Загрузка долгов
-async function loadDebts() {
-    const container = document.getElementById('debts-list');
-    container.innerHTML = '<div class="loading">Загрузка...</div>';
+// Загрузка всех вкладок одним запросом (один снимок БД на сервере)
+async function loadDashboard() {
+    const containers = ['debts-list', 'expenses-list', 'statistics-content', 'history-list']
+        .map(id => document.getElementById(id));
+    containers.forEach(container => {
+        if (!container.innerHTML.trim()) {
+            container.innerHTML = '<div class="loading">Загрузка...</div>';
+        }
+    });
     
     try {
-        const response = await fetch(`${API_BASE}/debts`);
+        const response = await fetch(`${API_BASE}/dashboard`);
         const data = await response.json();
         
-        if (data.success && data.debts.length > 0) {
-            container.innerHTML = data.debts.map(debt => `
-                <div class="debt-card">
-                    <div class="debt-card-header">
-                        <h3>${debt.debtor} → ${debt.creditor}</h3>
-                        <span class="debt-amount">${Math.round(debt.remaining)}₽</span>
-                    </div>
-                    <div class="debt-info">
-                        <p>📦 ${debt.description}</p>
-                        <p>💸 Долг: ${Math.round(debt.amount)}₽ | Выплачено: ${Math.round(debt.paid)}₽</p>
-                    </div>
-                    <button class="btn btn-success" onclick="showPaymentForm('${debt.debtor}', '${debt.creditor}', ${debt.remaining})">
-                        💸 Выплатить
-                    </button>
-                </div>
-            `).join('');
-        } else {
-            container.innerHTML = `
-                <div class="empty-state">
-                    <h3>🎉 Нет активных долгов!</h3>
-                    <p>Все долги погашены</p>
-                </div>
-            `;
+        if (data.success) {
+            state.version = data.version;
+            state.debts = new Map(data.debts.map(debt => [debt.id, debt]));
+            state.expenses = new Map(data.expenses.map(expense => [expense.id, expense]));
+            state.history = data.history;
+            renderDebts(data.debts);
+            renderExpenses(data.expenses);
+            renderStatistics(data.statistics);
+            renderHistory(data.history);
         }
     } catch (error) {
-        container.innerHTML = `<div class="empty-state"><h3>❌ Ошибка загрузки</h3><p>${error.message}</p></div>`;
+        containers.forEach(container => {
+            container.innerHTML = `<div class="empty-state"><h3>❌ Ошибка загрузки</h3><p>${error.message}</p></div>`;
+        });
     }
 }
 
-// Загрузка расходов
-async function loadExpenses() {
+// Карточка одного долга
+function debtCard(debt) {
+    return `
+        <div class="debt-card" data-debt-id="${debt.id}">
+            <div class="debt-card-header">
+                <h3>${debt.debtor} → ${debt.creditor}</h3>
+                <span class="debt-amount">${Math.round(debt.remaining)}₽</span>
+            </div>
+            <div class="debt-info">
+                <p>📦 ${debt.description}</p>
+                <p>💸 Долг: ${Math.round(debt.amount)}₽ | Выплачено: ${Math.round(debt.paid)}₽</p>
+            </div>
+            <button class="btn btn-success" onclick="showPaymentForm('${debt.debtor}', '${debt.creditor}', ${debt.remaining})">
+                💸 Выплатить
+            </button>
+        </div>
+    `;
+}
+
+const EMPTY_DEBTS = `
+    <div class="empty-state">
+        <h3>🎉 Нет активных долгов!</h3>
+        <p>Все долги погашены</p>
+    </div>
+`;
+
+// Отрисовка долгов
+function renderDebts(debts) {
+    const container = document.getElementById('debts-list');
+    container.innerHTML = debts.length > 0 ? debts.map(debtCard).join('') : EMPTY_DEBTS;
+}
+
+const EXPENSE_STATUSES = {
+    open: '⏳ Не погашен',
+    settled: '✅ Погашен'
+};
+
+// Отрисовка расходов (сводки /api/expenses: по одной на id расхода)
+function renderExpenses(expenses) {
     const container = document.getElementById('expenses-list');
-    container.innerHTML = '<div class="loading">Загрузка...</div>';
     
-    try {
-        const response = await fetch(`${API_BASE}/expenses`);
-        const data = await response.json();
-        
-        if (data.success && data.expenses.length > 0) {
-            container.innerHTML = data.expenses.map(expense => `
-                <div class="expense-card">
-                    <h3>📦 ${expense.description}</h3>
-                    <p>💰 Сумма: ${Math.round(expense.total_amount)}₽</p>
-                    <p>👥 Долгов: ${expense.debts.length}</p>
-                </div>
-            `).join('');
-        } else {
-            container.innerHTML = `
-                <div class="empty-state">
-                    <h3>📦 Нет расходов</h3>
-                    <p>Создайте первый расход</p>
-                </div>
-            `;
-        }
-    } catch (error) {
-        container.innerHTML = `<div class="empty-state"><h3>❌ Ошибка загрузки</h3><p>${error.message}</p></div>`;
+    if (expenses.length > 0) {
+        container.innerHTML = expenses.map(expense => `
+            <div class="expense-card" data-expense-id="${expense.id}">
+                <h3>📦 ${expense.description}</h3>
+                <p>💰 Сумма: ${Math.round(expense.total_amount)}₽ | Остаток: ${Math.round(expense.outstanding)}₽</p>
+                <p>👥 Долгов: ${expense.debts_count} | ${EXPENSE_STATUSES[expense.status] || expense.status}</p>
+            </div>
+        `).join('');
+    } else {
+        container.innerHTML = `
+            <div class="empty-state">
+                <h3>📦 Нет расходов</h3>
+                <p>Создайте первый расход</p>
+            </div>
+        `;
     }
 }
 
-// Загрузка статистики
-async function loadStatistics() {
+// Отрисовка статистики
+function renderStatistics(stats) {
     const container = document.getElementById('statistics-content');
-    container.innerHTML = '<div class="loading">Загрузка...</div>';
+    container.innerHTML = `
+        <div class="statistics-grid">
+            <div class="stat-card">
+                <h3>${stats.debt_count || 0}</h3>
+                <p>Активных долгов</p>
+            </div>
+            <div class="stat-card">
+                <h3>${Math.round(stats.total_debt || 0)}₽</h3>
+                <p>Общая сумма</p>
+            </div>
+            ${stats.debtors_count ? `
+            <div class="stat-card">
+                <h3>${stats.debtors_count}</h3>
+                <p>Должников</p>
+            </div>
+            ` : ''}
+            ${stats.creditors_count ? `
+            <div class="stat-card">
+                <h3>${stats.creditors_count}</h3>
+                <p>Кредиторов</p>
+            </div>
+            ` : ''}
+        </div>
+    `;
+}
+
+// Отрисовка истории
+function renderHistory(history) {
+    const container = document.getElementById('history-list');
     
-    try {
-        const response = await fetch(`${API_BASE}/statistics`);
-        const data = await response.json();
-        
-        if (data.success) {
-            const stats = data.statistics;
-            container.innerHTML = `
-                <div class="statistics-grid">
-                    <div class="stat-card">
-                        <h3>${stats.debt_count || 0}</h3>
-                        <p>Активных долгов</p>
-                    </div>
-                    <div class="stat-card">
-                        <h3>${Math.round(stats.total_debt || 0)}₽</h3>
-                        <p>Общая сумма</p>
-                    </div>
-                    ${stats.debtors_count ? `
-                    <div class="stat-card">
-                        <h3>${stats.debtors_count}</h3>
-                        <p>Должников</p>
+    if (history.length > 0) {
+        container.innerHTML = history.map(op => {
+            const date = new Date(op.created_at);
+            const dateStr = date.toLocaleString('ru-RU');
+            return `
+                <div class="history-item">
+                    <div>
+                        <strong>${op.username}</strong>
+                        <p>${op.description}</p>
                     </div>
-                    ` : ''}
-                    ${stats.creditors_count ? `
-                    <div class="stat-card">
-                        <h3>${stats.creditors_count}</h3>
-                        <p>Кредиторов</p>
-                    </div>
-                    ` : ''}
+                    <span class="history-date">${dateStr}</span>
                 </div>
             `;
-        }
-    } catch (error) {
-        container.innerHTML = `<div class="empty-state"><h3>❌ Ошибка загрузки</h3><p>${error.message}</p></div>`;
+        }).join('');
+    } else {
+        container.innerHTML = `
+            <div class="empty-state">
+                <h3>📜 История пуста</h3>
+                <p>Операций пока нет</p>
+            </div>
+        `;
     }
 }
 
-// Загрузка истории
-async function loadHistory() {
-    const container = document.getElementById('history-list');
-    container.innerHTML = '<div class="loading">Загрузка...</div>';
+// Живые обновления: сервер сообщает о записи через Server-Sent Events,
+// а сами изменения забираются одним запросом /api/changes
+function subscribeToChanges() {
+    if (!window.EventSource) {
+        return;
+    }
+    const source = new EventSource(`${API_BASE}/stream`);
+    // reset: пропущенные события уже удалены из журнала - всё равно сверяемся через /api/changes
+    ['expense_created', 'payment', 'expense_cancelled', 'expense_amended', 'ledger_imported', 'reset'].forEach(type => {
+        source.addEventListener(type, () => syncChanges());
+    });
+}
+
+// Синхронизации выполняются по очереди, чтобы не применить дельту дважды
+let syncQueue = Promise.resolve();
+
+function syncChanges() {
+    syncQueue = syncQueue.then(fetchChanges).catch(() => loadDashboard());
+    return syncQueue;
+}
+
+async function fetchChanges() {
+    if (state.version === null) {
+        return loadDashboard();
+    }
+    const response = await fetch(`${API_BASE}/changes?since=${state.version}`);
+    const data = await response.json();
     
-    try {
-        const response = await fetch(`${API_BASE}/history?limit=20`);
-        const data = await response.json();
-        
-        if (data.success && data.history.length > 0) {
-            container.innerHTML = data.history.map(op => {
-                const date = new Date(op.created_at);
-                const dateStr = date.toLocaleString('ru-RU');
-                return `
-                    <div class="history-item">
-                        <div>
-                            <strong>${op.username}</strong>
-                            <p>${op.description}</p>
-                        </div>
-                        <span class="history-date">${dateStr}</span>
-                    </div>
-                `;
-            }).join('');
-        } else {
-            container.innerHTML = `
-                <div class="empty-state">
-                    <h3>📜 История пуста</h3>
-                    <p>Операций пока нет</p>
-                </div>
-            `;
-        }
-    } catch (error) {
-        container.innerHTML = `<div class="empty-state"><h3>❌ Ошибка загрузки</h3><p>${error.message}</p></div>`;
+    if (!data.success || data.reset) {
+        return loadDashboard();
+    }
+    if (data.version !== state.version) {
+        applyChanges(data);
+    }
+}
+
+// Заменить, добавить или убрать карточку долга, не трогая остальные
+function patchDebtCard(debtId) {
+    const container = document.getElementById('debts-list');
+    const card = container.querySelector(`[data-debt-id="${debtId}"]`);
+    const debt = state.debts.get(debtId);
+    
+    if (!debt) {
+        if (card) card.remove();
+    } else if (card) {
+        card.outerHTML = debtCard(debt);
+    } else {
+        if (!container.querySelector('.debt-card')) container.innerHTML = '';
+        container.insertAdjacentHTML('beforeend', debtCard(debt));
+    }
+    if (state.debts.size === 0) {
+        container.innerHTML = EMPTY_DEBTS;
     }
 }
 
+// Применить дельту к кэшу и перерисовать только изменённое
+function applyChanges(changes) {
+    changes.debts.forEach(debt => {
+        state.debts.set(debt.id, debt);
+        patchDebtCard(debt.id);
+    });
+    changes.deleted_debts.forEach(id => {
+        state.debts.delete(id);
+        patchDebtCard(id);
+    });
+    state.version = changes.version;
+    
+    if (changes.debts.length || changes.deleted_debts.length) {
+        renderStatistics(computeStatistics([...state.debts.values()]));
+    }
+    if (changes.expenses.length || changes.deleted_expenses.length) {
+        changes.expenses.forEach(expense => state.expenses.set(expense.id, expense));
+        changes.deleted_expenses.forEach(id => state.expenses.delete(id));
+        renderExpenses(latestExpenses());
+    }
+    if (changes.history.length) {
+        state.history = changes.history.concat(state.history).slice(0, HISTORY_LIMIT);
+        renderHistory(state.history);
+    }
+}
+
+// Последние расходы из кэша (как в /api/dashboard: новые первыми)
+function latestExpenses() {
+    const expenses = [...state.expenses.values()].sort((a, b) =>
+        b.created_at.localeCompare(a.created_at) || b.id - a.id);
+    expenses.slice(EXPENSES_LIMIT).forEach(expense => state.expenses.delete(expense.id));
+    return expenses.slice(0, EXPENSES_LIMIT);
+}
+
+function computeStatistics(debts) {
+    return {
+        debt_count: debts.length,
+        total_debt: debts.reduce((sum, d) => sum + d.remaining, 0),
+        debtors_count: new Set(debts.map(d => d.debtor)).size,
+        creditors_count: new Set(debts.map(d => d.creditor)).size
+    };
+}
+
+// Повтор той же отправки (двойной клик, обрыв сети) уходит с тем же
+// Idempotency-Key, и сервер не выполняет операцию второй раз
+let pendingPost = null;
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+async function postOnce(url, data) {
+    const body = JSON.stringify(data);
+    if (!pendingPost || pendingPost.url !== url || pendingPost.body !== body) {
+        pendingPost = {url, body, key: newIdempotencyKey()};
+    }
+    const request = pendingPost;
+    
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': request.key
+        },
+        body
+    });
+    // Ответ получен: следующая такая же отправка - уже новая операция
+    if (pendingPost === request) {
+        pendingPost = null;
+    }
+    return response.json();
+}
+
 // Показать форму создания расхода
 function showCreateExpenseForm() {
     document.getElementById('expense-modal').style.display = 'block';
@@ -211,23 +345,13 @@ async function createExpense(event) {
     };
     
     try {
-        const response = await fetch(`${API_BASE}/expenses`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(data)
-        });
-        
-        const result = await response.json();
+        const result = await postOnce(`${API_BASE}/expenses`, data);
         
         if (result.success) {
             alert('✅ Расход создан!');
             closeModal();
             form.reset();
-            loadExpenses();
-            loadDebts();
-            loadStatistics();
+            syncChanges();
         } else {
             alert(`❌ Ошибка: ${result.error}`);
         }
@@ -261,23 +385,13 @@ async function createPayment(event) {
     };
     
     try {
-        const response = await fetch(`${API_BASE}/payments`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(data)
-        });
-        
-        const result = await response.json();
+        const result = await postOnce(`${API_BASE}/payments`, data);
         
         if (result.success) {
             alert('✅ Выплата принята!');
             closeModal();
             form.reset();
-            loadDebts();
-            loadStatistics();
-            loadHistory();
+            syncChanges();
         } else {
             alert(`❌ Ошибка: ${result.error}`);
         }
@@ -0,0 +1,129 @@
+"""
+Поток изменений реестра для веб-приложения (Server-Sent Events)
+Роль: Разработчик - живые обновления без опроса со стороны браузера
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+from src.database import Database
+
+# Сколько событий отдавать за одно чтение журнала
+STREAM_BATCH_SIZE = 100
+# Комментарий-пульс для прокси и обнаружения обрыва соединения, секунды
+HEARTBEAT_INTERVAL = 15.0
+
+
+class EventFeed:
+    """
+    Общий наблюдатель за журналом событий
+
+    Один фоновый поток на БД проверяет PRAGMA data_version (меняется,
+    когда любое другое соединение зафиксировало запись) и будит ждущих
+    клиентов. Простаивающий клиент просто спит на условной переменной и
+    не делает запросов к БД.
+    """
+
+    def __init__(self, db_path: str, poll_interval: float = 0.2):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._last_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _read_last_id(self, conn) -> int:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def _watch(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        version = None
+        while True:
+            current = conn.execute("PRAGMA data_version").fetchone()[0]
+            if current != version:
+                version = current
+                last_id = self._read_last_id(conn)
+                with self._condition:
+                    if last_id != self._last_id:
+                        self._last_id = last_id
+                        self._condition.notify_all()
+            time.sleep(self.poll_interval)
+
+    def _ensure_started(self):
+        with self._condition:
+            if self._thread is None:
+                conn = sqlite3.connect(self.db_path)
+                self._last_id = self._read_last_id(conn)
+                conn.close()
+                self._thread = threading.Thread(target=self._watch, name='event-feed', daemon=True)
+                self._thread.start()
+
+    def last_id(self) -> int:
+        """id последнего события в журнале"""
+        self._ensure_started()
+        with self._condition:
+            return self._last_id
+
+    def wait(self, after_id: int, timeout: float) -> bool:
+        """
+        Дождаться события новее after_id
+
+        Returns:
+            True если новые события есть, False если истёк timeout
+        """
+        self._ensure_started()
+        with self._condition:
+            return self._condition.wait_for(lambda: self._last_id > after_id, timeout)
+
+
+_feeds: Dict[str, EventFeed] = {}
+_feeds_lock = threading.Lock()
+
+
+def get_feed(db: Database) -> EventFeed:
+    """Наблюдатель для БД (один на файл БД в процессе)"""
+    with _feeds_lock:
+        feed = _feeds.get(db.db_path)
+        if feed is None:
+            feed = _feeds[db.db_path] = EventFeed(db.db_path)
+        return feed
+
+
+def format_sse(event: Dict) -> str:
+    """Событие журнала в формате text/event-stream"""
+    data = json.dumps(event['payload'], ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event['id']}\nevent: {event['event_type']}\ndata: {data}\n\n"
+
+
+def stream_events(db: Database, after_id: Optional[int] = None,
+                  heartbeat: float = HEARTBEAT_INTERVAL) -> Iterator[str]:
+    """
+    Поток событий для одного клиента
+
+    Если события после after_id уже удалены из журнала
+    (Database.prune_change_logs), клиент получает событие reset и должен
+    перечитать данные целиком.
+
+    Args:
+        db: База данных
+        after_id: Last-Event-ID клиента; None - только новые события
+        heartbeat: Интервал пульса при отсутствии событий, секунды
+    """
+    feed = get_feed(db)
+    if after_id is None:
+        after_id = feed.last_id()
+
+    # Клиент переподключится через 3 секунды и пришлёт Last-Event-ID
+    yield "retry: 3000\n\n"
+    while True:
+        events = db.get_events(after_id, STREAM_BATCH_SIZE)
+        if events and events[0]['id'] > after_id + 1:
+            yield f"id: {events[0]['id'] - 1}\nevent: reset\ndata: {{}}\n\n"
+        for event in events:
+            yield format_sse(event)
+            after_id = event['id']
+        if len(events) == STREAM_BATCH_SIZE:
+            continue
+        if not feed.wait(after_id, heartbeat):
+            yield ": heartbeat\n\n"
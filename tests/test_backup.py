@@ -0,0 +1,123 @@
+"""
+Unit тесты для backup.py
+Роль: Тестировщик
+"""
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from src.backup import (
+    BackupError, BackupScheduler, _copy, check_integrity, create_backup, find_backup,
+    list_backups, main, restore_backup, rotate_backups
+)
+
+
+def test_backup_is_verified_and_rotated(db, tmp_path):
+    """Тест: копия проходит integrity_check, лишние старые копии удаляются"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    backup_dir = str(tmp_path / "backups")
+    for hour in range(4):
+        result = create_backup(db.db_path, backup_dir, keep=3,
+                               now=datetime(2024, 5, 1, hour), pause=0)
+
+    assert check_integrity(result['path']) == []
+    backups = list_backups(backup_dir)
+    assert [b['created_at'].hour for b in backups] == [1, 2, 3]
+    assert result['removed'] == [str(tmp_path / "backups" / "debts-20240501-000000.db")]
+    assert len(list(tmp_path.joinpath("backups").iterdir())) == 3
+
+
+def test_keep_below_one_is_rejected(db, tmp_path):
+    """Тест: keep < 1 не удаляет все копии, а отклоняется до копирования"""
+    backup_dir = str(tmp_path / "backups")
+    create_backup(db.db_path, backup_dir, keep=1, pause=0)
+
+    for keep in (0, -1):
+        with pytest.raises(ValueError):
+            rotate_backups(backup_dir, keep=keep)
+        with pytest.raises(ValueError):
+            create_backup(db.db_path, backup_dir, keep=keep, pause=0)
+    with pytest.raises(ValueError):
+        BackupScheduler(db, backup_dir, keep=0)
+    with pytest.raises(SystemExit):
+        main(['--db', db.db_path, '--dir', backup_dir, 'create', '--keep', '0'])
+    assert len(list_backups(backup_dir)) == 1
+
+
+def test_copy_restarts_then_finishes_in_one_step(db, tmp_path):
+    """Тест: запись между шагами перезапускает копию, после лимита копия идёт одним шагом"""
+    for i in range(300):
+        db.create_expense(f"e{i}" * 50, 100, "Вася", ["Петя"])
+    writer = sqlite3.connect(db.db_path)
+    source = sqlite3.connect(db.db_path)
+    target = sqlite3.connect(str(tmp_path / "copy.db"))
+
+    original = source.backup
+
+    def backup_with_writes(target, pages, progress):
+        def write_between_steps(status, remaining, total):
+            writer.execute("INSERT INTO events (event_type, payload) VALUES ('test', '{}')")
+            writer.commit()
+            progress(status, remaining, total)
+        return original(target, pages=pages, progress=write_between_steps)
+
+    class Source:
+        backup = staticmethod(backup_with_writes)
+
+    restarts = _copy(Source(), target, pages=2, pause=0, max_restarts=2)
+    target.close()
+    assert restarts == 2
+    assert check_integrity(str(tmp_path / "copy.db")) == []
+
+
+def test_corrupted_copy_is_rejected(tmp_path):
+    """Тест: повреждённая копия не проходит проверку и не восстанавливается"""
+    broken = tmp_path / "debts-20240501-000000.db"
+    broken.write_bytes(b"not a database" * 100)
+
+    assert check_integrity(str(broken))
+    with pytest.raises(BackupError):
+        restore_backup(str(broken), str(tmp_path / "restored.db"))
+
+
+def test_restore_point_in_time_into_new_db(db, tmp_path):
+    """Тест: восстановление копии на момент времени только в новый файл"""
+    backup_dir = str(tmp_path / "backups")
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    create_backup(db.db_path, backup_dir, now=datetime(2024, 5, 1, 10), pause=0)
+    db.create_expense("кофе", 300, "Маша", ["Петя"])
+    create_backup(db.db_path, backup_dir, now=datetime(2024, 5, 2, 10), pause=0)
+
+    backup = find_backup("2024-05-01 23:00", backup_dir)
+    restored = restore_backup(backup['path'], str(tmp_path / "analysis.db"))
+    assert [d['description'] for d in restored.get_debts()] == ["пицца"]
+    assert find_backup("2024-04-30", backup_dir) is None
+
+    with pytest.raises(BackupError):
+        restore_backup(backup['path'], db.db_path)
+
+
+def test_cli(db, tmp_path, capsys):
+    """Тест: CLI снимает копию и разворачивает её по --at"""
+    backup_dir = str(tmp_path / "backups")
+    assert main(['--db', db.db_path, '--dir', backup_dir, 'create']) == 0
+    [backup] = list_backups(backup_dir)
+    assert main(['--dir', backup_dir, 'verify', backup['path']]) == 0
+
+    target = str(tmp_path / "restored.db")
+    at = backup['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+    assert main(['--dir', backup_dir, 'restore', '--at', at, target]) == 0
+    assert check_integrity(target) == []
+    assert main(['--dir', backup_dir, 'restore', '--at', '2000-01-01', target + '2']) == 1
+
+
+async def test_scheduler_run_once(db, tmp_path):
+    """Тест: планировщик снимает копию в отдельном потоке; interval 0 - выключен"""
+    scheduler = BackupScheduler(db, directory=str(tmp_path), interval=0)
+    result = await scheduler.run_once()
+    assert check_integrity(result['path']) == []
+
+    scheduler.start()
+    assert scheduler._task is None
+    await scheduler.stop()
@@ -100,3 +100,31 @@ def test_process_message_empty(bot):
     # Проверяем что бот обрабатывает пустое сообщение
     assert len(response) > 0
 
+
+
+def test_process_message_amend_expense(bot, db):
+    """Тест обработки команды изменения расхода"""
+    db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+    
+    response = bot.process_message("изменить пицца 3000", "Вася")
+    assert "сумма 2000→3000р" in response
+    assert db.get_debt_amount("Петя", "Вася") == 1500
+    
+    response = bot.process_message("изменить пицца 3000", "Петя")
+    assert "Только создатель" in response
+
+
+def test_amend_expense_without_changes(bot, db):
+    """Тест: изменение без разницы в сумме и участниках"""
+    db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+    
+    response = bot.process_message("изменить пицца 2000", "Вася")
+    assert response == "Расход 'пицца' не изменился: сумма и участники те же"
+
+
+def test_amend_expense_cancelled_concurrently(bot, db):
+    """Тест: расход отменён, пока команда изменения его искала"""
+    db.create_expense("пицца", 2000, "Вася", ["Петя"])
+    db.amend_expense = lambda *args, **kwargs: None
+    
+    assert bot.process_message("изменить пицца 3000", "Вася") == "Расход не найден"
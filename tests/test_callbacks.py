@@ -0,0 +1,103 @@
+"""
+Unit тесты для callbacks.py
+Роль: Тестировщик
+"""
+from src.callbacks import CallbackRegistry, SQLiteCallbackRegistry, TOKEN_LENGTH
+from src.keyboards import get_debts_keyboard, MAX_CALLBACK_DATA_BYTES
+
+
+class FakeClock:
+    """Управляемые часы для проверки истечения токенов"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_issue_and_resolve():
+    """Тест: данные действия возвращаются по токену, а не из кнопки"""
+    registry = CallbackRegistry()
+    data = registry.issue("pay_debt", {'debtor': 'Петя', 'amount': 1000})
+
+    action, token = data.split(":")
+    assert action == "pay_debt"
+    assert len(token) == TOKEN_LENGTH
+    assert registry.resolve(data) == {'debtor': 'Петя', 'amount': 1000}
+
+    # Токен не подходит к другому действию
+    assert registry.resolve(f"confirm_payment:{token}") is None
+    assert registry.resolve("pay_debt:unknown0") is None
+
+
+def test_expiry_and_eviction():
+    """Тест: токены истекают по ttl и вытесняются при переполнении"""
+    clock = FakeClock()
+    registry = CallbackRegistry(ttl=60, max_entries=2, clock=clock)
+    first = registry.issue("a", {'n': 1})
+    second = registry.issue("a", {'n': 2})
+    third = registry.issue("a", {'n': 3})
+
+    assert registry.resolve(first) is None
+    assert registry.resolve(second) == {'n': 2}
+    assert len(registry) == 2
+
+    clock.now = 61
+    assert registry.resolve(third) is None
+    registry.issue("a", {'n': 4})
+    assert len(registry) == 1
+
+
+def test_discard_makes_button_single_use():
+    """Тест: удалённый токен больше не распознаётся"""
+    registry = CallbackRegistry()
+    data = registry.issue("confirm_payment", {'amount': 500})
+    registry.discard(data)
+    assert registry.resolve(data) is None
+
+
+def test_same_payload_reuses_live_token():
+    """Тест: то же действие с теми же данными получает тот же токен, пока он жив"""
+    clock = FakeClock()
+    registry = CallbackRegistry(ttl=60, clock=clock)
+    data = registry.issue("pay_debt", {'debtor': 'Петя', 'amount': 1000})
+    assert registry.issue("pay_debt", {'amount': 1000, 'debtor': 'Петя'}) == data
+    assert registry.issue("pay_debt", {'debtor': 'Петя', 'amount': 900}) != data
+    assert len(registry) == 2
+
+    # Повторная выдача продлевает токен
+    clock.now = 50
+    assert registry.issue("pay_debt", {'debtor': 'Петя', 'amount': 1000}) == data
+    clock.now = 100
+    assert registry.resolve(data) == {'debtor': 'Петя', 'amount': 1000}
+
+    # После удаления выдаётся новый токен
+    registry.discard(data)
+    assert registry.issue("pay_debt", {'debtor': 'Петя', 'amount': 1000}) != data
+
+
+def test_sqlite_registry(tmp_path):
+    """Тест: реестр в SQLite переживает пересоздание объекта"""
+    clock = FakeClock()
+    path = str(tmp_path / "tokens.db")
+    data = SQLiteCallbackRegistry(path, ttl=60, clock=clock).issue("pay_debt", {'debtor': 'Петя'})
+
+    registry = SQLiteCallbackRegistry(path, ttl=60, clock=clock)
+    assert registry.resolve(data) == {'debtor': 'Петя'}
+    assert registry.issue("pay_debt", {'debtor': 'Петя'}) == data
+
+    clock.now = 61
+    assert registry.resolve(data) is None
+    registry.discard(data)
+    assert len(registry) == 0
+    assert registry.issue("pay_debt", {'debtor': 'Петя'}) != data
+
+
+def test_debts_keyboard_callback_data_is_short():
+    """Тест: длинные имена с двоеточиями не ломают callback_data"""
+    debts = [{'creditor': 'очень:длинное:имя:кредитора_' * 3, 'remaining': 1000, 'description': 'пицца'}]
+    keyboard = get_debts_keyboard('Должник:с:двоеточиями', debts)
+
+    button = keyboard.inline_keyboard[0][0]
+    assert len(button.callback_data.encode()) <= MAX_CALLBACK_DATA_BYTES
@@ -129,3 +129,450 @@ def test_get_debts_grouped_by_expense(db):
     assert len(grouped) > 0
     assert "пицца" in grouped or "кофе" in grouped
 
+
+
+def test_get_debts_filters(db):
+    """Тест фильтров долгов по должнику, кредитору и расходу"""
+    pizza_id = db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+    db.create_expense("кофе", 600, "Петя", ["Маша"])
+
+    masha_debts = db.get_debts(debtor_username="Маша")
+    assert len(masha_debts) == 2
+    assert all(d['debtor'] == "Маша" for d in masha_debts)
+
+    assert len(db.get_debts(debtor_username="Маша", creditor_username="Петя")) == 1
+    assert len(db.get_debts(expense_id=pizza_id)) == 2
+    assert db.get_debts(debtor_username="Неизвестный") == []
+    assert db.get_debts(date_from="2000-01-01", date_to="2000-01-02") == []
+
+
+def test_get_debts_summary(db):
+    """Тест итога по долгам, посчитанного в SQL"""
+    db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+    db.create_expense("кофе", 600, "Петя", ["Маша"])
+    db.pay_debt("Маша", "Вася", 400)
+
+    summary = db.get_debts_summary(debtor_username="Маша")
+    assert summary == {'total': 1200, 'count': 2}
+    assert db.get_debts_summary(debtor_username="Неизвестный") == {'total': 0.0, 'count': 0}
+
+
+def test_get_debts_page_navigation(db):
+    """Тест: постраничный вывод долгов по курсору вперёд и назад"""
+    for i in range(7):
+        db.create_expense(f"расход {i}", 100 * (i + 1), "Вася", ["Петя"])
+
+    first = db.get_debts_page("Петя", limit=3)
+    assert [d['description'] for d in first['debts']] == ["расход 0", "расход 1", "расход 2"]
+    assert first['has_prev'] is False and first['has_next'] is True
+
+    last_debt = first['debts'][-1]
+    second = db.get_debts_page("Петя", after=(last_debt['created_at'], last_debt['id']), limit=3)
+    assert [d['description'] for d in second['debts']] == ["расход 3", "расход 4", "расход 5"]
+    assert second['has_prev'] is True and second['has_next'] is True
+
+    first_debt = second['debts'][0]
+    back = db.get_debts_page("Петя", before=(first_debt['created_at'], first_debt['id']), limit=3)
+    assert [d['id'] for d in back['debts']] == [d['id'] for d in first['debts']]
+    assert back['has_prev'] is False and back['has_next'] is True
+
+    # Перед первой страницей пусто, но дальше долги есть
+    empty = db.get_debts_page("Петя", before=(first_debt['created_at'], 0), limit=3)
+    assert empty == {'debts': [], 'has_prev': False, 'has_next': True}
+
+    # Оплаченные долги не попадают на страницы
+    db.pay_debt("Петя", "Вася", 100)
+    assert db.get_debts_page("Петя", limit=3)['debts'][0]['description'] == "расход 1"
+
+
+def test_get_debts_page_flags_after_payments(db):
+    """Тест: соседние страницы проверяются запросом, а не по наличию курсора"""
+    for i in range(4):
+        db.create_expense(f"расход {i}", 100, "Вася", ["Петя"])
+    first = db.get_debts_page("Петя", limit=2)
+    second_debt = first['debts'][-1]
+    last = db.get_debts_page("Петя", after=(second_debt['created_at'], second_debt['id']), limit=2)
+
+    # Всё после курсора выплачено: страница "назад" пуста и дальше ничего нет
+    db.pay_debt("Петя", "Вася", 400)
+    last_debt = last['debts'][-1]
+    back = db.get_debts_page("Петя", before=(last_debt['created_at'], last_debt['id']), limit=2)
+    assert back == {'debts': [], 'has_prev': False, 'has_next': False}
+    forward = db.get_debts_page("Петя", after=(second_debt['created_at'], second_debt['id']), limit=2)
+    assert forward == {'debts': [], 'has_prev': False, 'has_next': False}
+
+
+def test_pay_debt_and_summarize(db):
+    """Тест: выплата с итогом в одной транзакции"""
+    db.create_expense("пицца", 3000, "Вася", ["Петя", "Маша", "Коля"])
+    db.create_expense("кофе", 300, "Вася", ["Маша"])
+    db.pay_debt("Коля", "Вася", 1000)
+
+    assert db.pay_debt_and_summarize("Петя", "Маша", 100)['status'] == 'no_debt'
+
+    too_much = db.pay_debt_and_summarize("Петя", "Вася", 5000)
+    assert too_much['status'] == 'too_much'
+    assert too_much['owed'] == 1000
+    assert db.get_debt_amount("Петя", "Вася") == 1000
+
+    partial = db.pay_debt_and_summarize("Петя", "Вася", 400)
+    assert partial['status'] == 'paid'
+    assert partial['remaining'] == 600
+
+    full = db.pay_debt_and_summarize("Петя", "Вася", 600)
+    assert full['remaining'] == 0
+    assert full['other_debtors'] == [{'debtor': "Маша", 'remaining': 1300}]
+    assert db.get_debt_amount("Петя", "Вася") == 0
+
+
+def test_expense_details_cache_invalidation(db):
+    """Тест: кэш деталей расхода сбрасывается при выплате и отмене"""
+    expense_id = db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+
+    details = db.get_expense_details(expense_id)
+    assert [d['remaining'] for d in details['debts']] == [1000, 1000]
+
+    # Изменение копии не портит кэш
+    details['debts'][0]['remaining'] = 0
+    assert db.get_expense_by_description("пицца")['debts'][0]['remaining'] == 1000
+
+    db.pay_debt("Петя", "Вася", 400)
+    assert db.get_expense_details(expense_id)['debts'][0]['remaining'] == 600
+
+    db.cancel_expense(expense_id, "Вася")
+    assert db.get_expense_details(expense_id) is None
+
+
+def test_expense_details_cache_sees_other_process(db):
+    """Тест: выплата через другой экземпляр Database сбрасывает кэш"""
+    from src.database import Database
+
+    expense_id = db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    assert db.get_expense_details(expense_id)['debts'][0]['remaining'] == 1000
+
+    Database(db_path=db.db_path).pay_debt("Петя", "Вася", 300)
+    assert db.get_expense_details(expense_id)['debts'][0]['remaining'] == 700
+
+
+def test_expense_details_cache_resets_after_pruned_events(db):
+    """Тест: события удалены до того, как кэш их прочитал, - кэш сбрасывается целиком"""
+    from src.database import Database
+
+    web = Database(db_path=db.db_path)
+    expense_id = db.create_expense("пицца", 300, "Вася", ["Петя"])
+    db.create_expense("кофе", 100, "Вася", ["Маша"])
+    assert web.get_expense_details(expense_id)['debts'][0]['remaining'] == 300
+
+    db.pay_debt("Петя", "Вася", 300)
+    db.create_expense("такси", 50, "Вася", ["Коля"])
+    db.set_event_cursor('notifications', db.get_last_event_id())
+    assert db.prune_change_logs(keep_events=1)['events'] == 3
+    assert web.get_expense_details(expense_id)['debts'][0]['remaining'] == 0
+
+
+def test_amend_expense_keeps_payments(db):
+    """Тест: изменение расхода меняет только нужные долги и сохраняет выплаты"""
+    expense_id = db.create_expense("пицца", 3000, "Вася", ["Петя", "Маша", "Коля"])
+    db.pay_debt("Петя", "Вася", 400)
+    db.pay_debt("Маша", "Вася", 1000)
+    untouched = {d['debtor']: d['id'] for d in db.get_debts(expense_id=expense_id)}
+
+    assert db.amend_expense(expense_id, "Петя", total_amount=100) is None
+
+    diff = db.amend_expense(expense_id, "Вася", total_amount=2000, participants=["Петя", "Маша", "Лена"])
+    assert diff['total_amount'] == (3000, 2000)
+    assert [name for name, _ in diff['added']] == ["Лена"]
+    assert diff['removed'] == ["Коля"]
+    assert diff['refunds'] == {"Маша": 1000 - 2000 / 3}
+
+    debts = {d['debtor']: d for d in db.get_expense_details(expense_id)['debts']}
+    assert debts["Петя"]['paid'] == 400
+    assert round(debts["Петя"]['remaining']) == 267
+    assert debts["Маша"]['remaining'] == 0
+    assert "Коля" not in debts
+    assert db.get_debt_amount("Петя", "Вася") == pytest.approx(2000 / 3 - 400)
+    assert db.get_debts(debtor_username="Петя")[0]['id'] == untouched["Петя"]
+
+    history = db.get_operation_history(expense_id=expense_id)
+    assert history[0]['operation_type'] == 'expense_amended'
+    assert "сумма 3000→2000р" in history[0]['description']
+
+
+def test_amend_removed_participant_keeps_paid_part(db):
+    """Тест: удалённый участник с частичной выплатой остаётся с погашенным долгом"""
+    expense_id = db.create_expense("кофе", 600, "Вася", ["Петя", "Маша"])
+    db.pay_debt("Петя", "Вася", 100)
+
+    db.amend_expense(expense_id, "Вася", participants=["Маша"])
+    debts = {d['debtor']: d for d in db.get_expense_details(expense_id)['debts']}
+    assert debts["Петя"]['amount'] == 100 and debts["Петя"]['remaining'] == 0
+    assert debts["Маша"]['amount'] == 600
+    assert db.amend_expense(expense_id, "Вася", participants=["Маша"])['changed'] == []
+
+
+def test_amend_amount_after_removal_keeps_participant_removed(db):
+    """Тест: изменение суммы без списка участников не возвращает удалённого"""
+    expense_id = db.create_expense("ужин", 3000, "alice", ["bob", "carol", "dave"])
+    db.pay_debt("carol", "alice", 500)
+    assert db.amend_expense(expense_id, "alice", participants=["bob", "dave"])['removed'] == ["carol"]
+
+    diff = db.amend_expense(expense_id, "alice", total_amount=2000)
+    assert [name for name, _, _ in diff['changed']] == ["bob", "dave"]
+    assert diff['added'] == [] and diff['removed'] == []
+    debts = {d['debtor']: d for d in db.get_expense_details(expense_id)['debts']}
+    assert debts["carol"]['amount'] == 500 and debts["carol"]['remaining'] == 0
+    assert debts["bob"]['amount'] == 1000 and debts["dave"]['amount'] == 1000
+
+    # Явно вернуть удалённого участника можно
+    diff = db.amend_expense(expense_id, "alice", participants=["bob", "carol", "dave"])
+    assert diff['added'] == [("carol", 2000 / 3)]
+    assert db.get_debt_amount("carol", "alice") == 2000 / 3 - 500
+
+
+def test_get_changes_since_version(db):
+    """Тест: дельта содержит только строки, изменённые после версии клиента"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя", "Маша"])
+    version = db.get_ledger_version()
+    assert db.get_changes(version)['debts'] == []
+
+    expense_id = db.create_expense("кофе", 300, "Маша", ["Петя"])
+    db.pay_debt("Петя", "Вася", 500)
+    changes = db.get_changes(version)
+    assert changes['version'] == db.get_ledger_version()
+    assert changes['reset'] is False
+    assert [d['description'] for d in changes['debts']] == ["кофе"]
+    assert len(changes['deleted_debts']) == 1
+    assert [op['operation_type'] for op in changes['history']] == ['payment', 'expense_created']
+
+    db.cancel_expense(expense_id, "Маша")
+    changes = db.get_changes(changes['version'])
+    assert changes['debts'] == []
+    assert len(changes['deleted_debts']) == 1
+
+
+def test_get_changes_requests_reset(db):
+    """Тест: после переименования или с неизвестной версией нужна полная загрузка"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    version = db.get_ledger_version()
+    assert db.get_changes(version + 1)['reset'] is True
+
+    db.register_user(1, "Вася")
+    db.register_user(1, "Василий")
+    assert db.get_changes(version)['reset'] is True
+    assert db.get_changes(db.get_ledger_version())['reset'] is False
+
+
+def test_prune_change_logs(db):
+    """Тест: журналы чистятся до самого отстающего подписчика и окна поколений"""
+    for amount in (100, 200, 300):
+        db.create_expense("пицца", amount, "Вася", ["Петя"])
+    # Без подписчиков события не трогаем
+    assert db.prune_change_logs()['events'] == 0
+
+    events = db.get_events()
+    db.set_event_cursor('notifications', events[-1]['id'])
+    db.set_event_cursor('audit', events[1]['id'])
+    old_version = db.get_ledger_version() - 1
+    db.pay_debt("Петя", "Вася", 50)
+    version = db.get_ledger_version()
+
+    pruned = db.prune_change_logs(keep_generations=1, keep_events=1)
+    assert pruned['events'] == 1
+    assert pruned['row_changes'] > 0
+    assert [e['id'] for e in db.get_events()][0] == events[1]['id']
+
+    # Версия до окна - полная перезагрузка, внутри окна - обычная дельта
+    assert db.get_changes(old_version)['reset'] is True
+    assert db.get_changes(version - 1)['reset'] is False
+    assert db.get_changes(version - 1)['history'][0]['operation_type'] == 'payment'
+    assert db.prune_change_logs(keep_generations=1, keep_events=1)['row_changes'] == 0
+
+
+def test_list_expenses_aggregates_by_id(db):
+    """Тест: расходы с одинаковым описанием не сливаются, итоги считаются по расходу"""
+    first = db.create_expense("пицца", 1000, "Вася", ["Петя", "Маша"])
+    second = db.create_expense("пицца", 600, "Маша", ["Петя"])
+    db.pay_debt("Маша", "Вася", 500)
+
+    page = db.list_expenses()
+    assert [e['id'] for e in page['expenses']] == [second, first]
+    settled = page['expenses'][1]
+    assert sorted(settled['participants']) == ["Маша", "Петя"]
+    assert settled['paid_total'] == 500 and settled['outstanding'] == 500
+    assert settled['status'] == 'open'
+
+    db.pay_debt("Петя", "Вася", 500)
+    assert [e['id'] for e in db.list_expenses(status='settled')['expenses']] == [first]
+    assert [e['id'] for e in db.list_expenses(status='open')['expenses']] == [second]
+    assert [e['id'] for e in db.list_expenses(creator_username="Маша")['expenses']] == [second]
+    assert db.list_expenses(participant_username="Маша")['expenses'][0]['id'] == first
+    assert db.list_expenses(creator_username="Незнакомец")['expenses'] == []
+
+
+def test_list_expenses_keyset_pagination(db):
+    """Тест: страницы по курсору без пропусков и повторов при любой сортировке"""
+    ids = [db.create_expense(f"e{i}", 100 * (i % 3 + 1), "Вася", ["Петя"]) for i in range(7)]
+    db.cancel_expense(ids[0], "Вася")
+
+    for sort in ('created_at', 'total_amount', 'outstanding'):
+        seen, after = [], None
+        while True:
+            page = db.list_expenses(sort=sort, after=after, limit=3)
+            seen += [e['id'] for e in page['expenses']]
+            if not page['has_next']:
+                break
+            after = page['next_cursor']
+        assert sorted(seen) == ids[1:]
+
+    assert [e['id'] for e in db.list_expenses(status='cancelled')['expenses']] == [ids[0]]
+    with pytest.raises(ValueError):
+        db.list_expenses(sort='description')
+
+
+def test_execute_batch_is_atomic(db):
+    """Тест: пакет выполняется целиком или откатывается целиком"""
+    result = db.execute_batch([
+        {'type': 'expense', 'description': 'пицца', 'amount': 1000, 'creator': 'Вася',
+         'participants': ['Петя', 'Маша']},
+        {'type': 'payment', 'debtor': 'Петя', 'creditor': 'Вася', 'amount': 200},
+    ])
+    assert result['success'] is True
+    assert result['results'][1] == {'index': 1, 'status': 'ok', 'owed': 500, 'remaining': 300}
+    version = db.get_ledger_version()
+
+    result = db.execute_batch([
+        {'type': 'expense', 'description': 'кофе', 'amount': 300, 'creator': 'Новичок',
+         'participants': ['Петя']},
+        {'type': 'payment', 'debtor': 'Маша', 'creditor': 'Вася', 'amount': 900},
+        {'type': 'payment', 'debtor': 'Маша', 'creditor': 'Вася', 'amount': 100},
+    ])
+    assert result['success'] is False
+    assert [r['status'] for r in result['results']] == ['rolled_back', 'error', 'skipped']
+    assert "больше долга" in result['results'][1]['error']
+    assert db.get_ledger_version() == version
+    assert db.get_user_id('Новичок') is None
+    assert len(db.get_debts()) == 2
+
+
+def test_idempotency_key_replays_result(db):
+    """Тест: повтор с тем же ключом возвращает прежний результат без записи"""
+    first = db.create_expense("пицца", 1000, "Вася", ["Петя"], idempotency_key="k1")
+    assert db.create_expense("пицца", 1000, "Вася", ["Петя"], idempotency_key="k1") == first
+    assert len(db.get_debts()) == 1
+
+    assert db.pay_debt("Петя", "Вася", 600, idempotency_key="k2") is True
+    assert db.pay_debt("Петя", "Вася", 600, idempotency_key="k2") is True
+    assert db.get_debt_amount("Петя", "Вася") == 400
+
+    from src.database import IdempotencyKeyConflict
+    with pytest.raises(IdempotencyKeyConflict):
+        db.pay_debt("Петя", "Вася", 100, idempotency_key="k2")
+
+
+def test_idempotency_key_expires(db):
+    """Тест: по истечении срока ключ можно использовать снова"""
+    db.idempotency_ttl = 0
+    db.create_expense("пицца", 1000, "Вася", ["Петя"], idempotency_key="k1")
+    db.create_expense("пицца", 1000, "Вася", ["Петя"], idempotency_key="k1")
+    assert len(db.get_debts()) == 2
+
+
+def test_history_rendered_from_structured_fields(db):
+    """Тест: текст истории собирается при чтении и следует за переименованием"""
+    user_id = db.register_user(11, "Вася")
+    expense_id = db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    db.pay_debt("Петя", "Вася", 400.5)
+
+    history = db.get_operation_history()
+    assert [op['description'] for op in history] == [
+        "Выплата 400.5р Вася", "Создан расход 'пицца' на 1000р"]
+    assert history[0]['counterparty'] == "Вася"
+
+    db.register_user(11, "Василий")
+    db.amend_expense(expense_id, "Василий", description="пицца большая")
+    history = db.get_operation_history()
+    assert history[0]['description'].startswith("Изменён расход 'пицца большая': описание")
+    assert history[1]['description'] == "Выплата 400.5р Василий"
+    assert [op['id'] for op in db.get_operation_history(counterparty=user_id)] == [history[1]['id']]
+    assert db.get_operation_history(counterparty="Незнакомец") == []
+
+
+def test_history_migration_parses_descriptions(db):
+    """Тест: старые записи с готовым текстом переводятся на структурные поля"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    conn = db.get_connection()
+    conn.executescript("""
+        DROP TABLE operation_history;
+        CREATE TABLE operation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            expense_id INTEGER,
+            operation_type TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            description TEXT,
+            amount REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO operation_history (expense_id, operation_type, user_id, description, amount, created_at) VALUES
+            (1, 'expense_created', 1, 'Создан расход ''пицца'' на 1000р', 1000, '2024-05-01 10:00:00'),
+            (1, 'payment', 2, 'Выплата 100.0р Вася', 100, '2024-05-01 11:00:00'),
+            (1, 'payment', 2, 'Выплата 50р Удалённый', 50, '2024-05-01 12:00:00'),
+            (1, 'expense_amended', 1, 'Изменён расход ''пицца'': сумма 1000→900р', 900, '2024-05-01 13:00:00'),
+            (NULL, 'comment', 1, 'Просто заметка', NULL, '2024-05-01 14:00:00');
+    """)
+    conn.commit()
+    conn.close()
+
+    migrated = Database(db_path=db.db_path)
+    history = migrated.get_operation_history()
+    assert [op['description'] for op in history] == [
+        "Просто заметка",
+        "Изменён расход 'пицца': сумма 1000→900р",
+        "Выплата 50р Удалённый",
+        "Выплата 100р Вася",
+        "Создан расход 'пицца' на 1000р",
+    ]
+    assert [op['operation_type'] for op in history] == [
+        'note', 'expense_amended', 'payment', 'payment', 'expense_created']
+    assert history[3]['counterparty'] == "Вася" and history[2]['counterparty'] is None
+
+    conn = migrated.get_connection()
+    columns = [row['name'] for row in conn.execute("PRAGMA table_info(operation_history)")]
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM operation_history "
+                        "WHERE counterparty_id = 1 ORDER BY created_at DESC, id DESC").fetchall()
+    conn.close()
+    assert 'description' not in columns and 'operation_type' not in columns
+    assert 'idx_history_counterparty_created' in plan[0]['detail']
+
+
+def test_amend_and_cancel_roll_back_on_error(db, monkeypatch):
+    """Тест: ошибка посреди изменения или отмены расхода откатывает всё"""
+    expense_id = db.create_expense("пицца", 3000, "Вася", ["Петя", "Маша"])
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("сбой")
+
+    monkeypatch.setattr(db, '_emit_event', fail)
+    with pytest.raises(RuntimeError):
+        db.amend_expense(expense_id, "Вася", total_amount=1000)
+    with pytest.raises(RuntimeError):
+        db.cancel_expense(expense_id, "Вася")
+    monkeypatch.undo()
+
+    assert sorted(d['amount'] for d in db.get_debts()) == [1500, 1500]
+    assert db.amend_expense(expense_id, "Вася", total_amount=1000)['total_amount'] == (3000, 1000)
+
+
+def test_pay_debt_and_summarize_rolls_back_on_error(db, monkeypatch):
+    """Тест: ошибка посреди выплаты с итогом откатывает её и не держит блокировку"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("сбой")
+
+    monkeypatch.setattr(db, '_emit_event', fail)
+    with pytest.raises(RuntimeError):
+        db.pay_debt_and_summarize("Петя", "Вася", 400)
+    monkeypatch.undo()
+
+    assert db.get_debt_amount("Петя", "Вася") == 1000
+    assert db.pay_debt_and_summarize("Петя", "Вася", 400)['remaining'] == 600
@@ -0,0 +1,61 @@
+"""
+Unit тесты для export.py и Database.iter_export
+Роль: Тестировщик
+"""
+import csv
+import json
+
+import pytest
+
+from src.export import main
+
+
+def test_iter_export_filters_and_cursor(db):
+    """Тест: выгрузка включает погашенное и отменённое, фильтрует и продолжается с курсора"""
+    first = db.create_expense("пицца", 1000, "Вася", ["Петя", "Маша"])
+    second = db.create_expense("кофе", 300, "Маша", ["Петя"])
+    db.pay_debt("Маша", "Вася", 500)
+    db.cancel_expense(second, "Маша")
+
+    expenses = list(db.iter_export('expenses', batch_size=1))
+    assert [(e['id'], e['cancelled']) for e in expenses] == [(first, 0), (second, 1)]
+    assert expenses[0]['paid_total'] == 500 and expenses[0]['outstanding'] == 500
+
+    debts = list(db.iter_export('debts'))
+    assert [d['remaining'] for d in debts] == [500, 0]
+    assert [d['id'] for d in db.iter_export('debts', after=debts[0]['id'])] == [debts[1]['id']]
+    assert [d['debtor'] for d in db.iter_export('debts', username="Маша")] == ["Маша"]
+
+    history = list(db.iter_export('history', username="Маша", batch_size=2))
+    assert [op['operation_type'] for op in history] == ['expense_created', 'payment', 'expense_cancelled']
+    assert list(db.iter_export('history', date_to="2000-01-01")) == []
+    assert list(db.iter_export('history', username="Незнакомец")) == []
+    with pytest.raises(ValueError):
+        list(db.iter_export('users'))
+
+
+def test_cli_export_resumes_interrupted_file(db, tmp_path):
+    """Тест: --resume дописывает выгрузку после последней целой строки"""
+    for i in range(5):
+        db.create_expense(f"e{i}", 100, "Вася", ["Петя"])
+    path = tmp_path / "debts.csv"
+    main(['debts', '--db', db.db_path, '-o', str(path)])
+    full = path.read_text(encoding='utf-8')
+
+    # Обрыв посреди четвёртой строки данных
+    lines = full.splitlines(keepends=True)
+    path.write_text(''.join(lines[:4]) + lines[4][:5], encoding='utf-8')
+    main(['debts', '--db', db.db_path, '-o', str(path), '--resume'])
+    assert path.read_text(encoding='utf-8') == full
+
+    rows = list(csv.DictReader(full.splitlines()))
+    assert [row['description'] for row in rows] == [f"e{i}" for i in range(5)]
+
+
+def test_cli_export_ndjson(db, tmp_path, capsys):
+    """Тест: выгрузка NDJSON в stdout с фильтром по пользователю"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    db.create_expense("кофе", 300, "Маша", ["Коля"])
+    main(['expenses', '--db', db.db_path, '--format', 'ndjson', '--user', 'Коля'])
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [row['description'] for row in rows] == ["кофе"]
@@ -0,0 +1,109 @@
+"""
+Unit тесты для importer.py и Database.bulk_import
+Роль: Тестировщик
+"""
+import io
+
+from src.importer import import_csv, main, parse_rows
+
+CSV = """type,date,description,amount,creditor,debtor,participants
+expense,2024-05-01,пицца,900,Вася,,Петя;Маша;Вася
+expense,2024-05-02 19:30:00,такси,900,Маша,,
+split,,,600,,Петя,
+split,,,300,,Вася,
+payment,2024-05-03,,200,Вася,Петя,
+"""
+
+
+def test_parse_rows_validates_and_skips_bad_rows():
+    """Тест: неверные строки и расход с неверной долей пропускаются с номером строки"""
+    errors = []
+    text = CSV + """expense,,кофе,300,Маша,,
+split,,,abc,,Петя,
+split,,,100,,Вася,
+payment,вчера,,100,Вася,Петя,
+split,,,100,,Петя,
+expense,,чай,100,Петя,,
+refund,,,100,Вася,Петя,
+"""
+    records = list(parse_rows(io.StringIO(text), errors))
+
+    assert [r['type'] for r in records] == ['expense', 'expense', 'payment']
+    assert records[0]['shares'] == [("Петя", 300), ("Маша", 300), ("Вася", 300)]
+    assert records[1]['shares'] == [("Петя", 600), ("Вася", 300)]
+    assert records[1]['created_at'] == '2024-05-02 19:30:00'
+    assert [e['line'] for e in errors] == [7, 10, 11, 12, 13]
+    assert 'расход пропущен' in errors[0]['error']
+
+
+def test_import_applies_rows_and_payment_errors(db):
+    """Тест: импорт пишет расходы с датами, гасит долги и отклоняет лишнюю выплату"""
+    progress = []
+    text = CSV + "payment,,,10000,Маша,Петя,\n"
+    summary = import_csv(db, io.StringIO(text), chunk_size=2, progress=progress.append)
+
+    assert (summary['expenses'], summary['payments'], summary['error_count']) == (2, 1, 1)
+    assert summary['errors'][0]['line'] == 7
+    assert len(progress) >= 2
+    debts = {(d['debtor'], d['creditor']): d['remaining'] for d in db.get_debts()}
+    assert debts == {("Петя", "Вася"): 100, ("Маша", "Вася"): 300,
+                     ("Петя", "Маша"): 600, ("Вася", "Маша"): 300}
+    history = db.get_operation_history(limit=10)
+    assert {op['operation_type'] for op in history} == {'expense_created', 'payment'}
+
+
+def test_dry_run_writes_nothing(db):
+    """Тест: пробный импорт проверяет выплаты, но ничего не сохраняет"""
+    summary = import_csv(db, io.StringIO(CSV), dry_run=True)
+
+    assert summary['dry_run'] is True
+    assert (summary['expenses'], summary['payments'], summary['error_count']) == (2, 1, 0)
+    assert db.get_debts() == []
+    assert db.get_operation_history(limit=10) == []
+
+
+def test_dry_run_does_not_lock_while_reading(db):
+    """Тест: пока пробный импорт читает источник, другие процессы могут писать"""
+    from src.database import Database
+
+    other = Database(db_path=db.db_path)
+    errors = []
+
+    def slow_upload():
+        for record in parse_rows(io.StringIO(CSV), errors):
+            # Запись другого процесса посреди чтения загрузки
+            other.create_expense("кофе", 100, "Коля", ["Оля"])
+            yield record
+
+    summary = db.bulk_import(slow_upload(), dry_run=True)
+    assert (summary['expenses'], summary['payments']) == (2, 1)
+    assert len(db.get_debts()) == 3
+
+
+def test_imported_overdue_debts_are_not_reminded(db):
+    """Тест: долги, просроченные уже при импорте, не дают волну напоминаний"""
+    from datetime import datetime, timedelta
+
+    assert db.get_newly_overdue_debts()['debts'] == []
+    recent = (datetime.utcnow() - timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S')
+    import_csv(db, io.StringIO(CSV + f"expense,{recent},кофе,100,Коля,,Оля\n"))
+    assert db.get_newly_overdue_debts()['debts'] == []
+
+    # Свежий импортированный долг напоминается, когда станет просроченным
+    conn = db.get_connection()
+    conn.execute("UPDATE debts SET created_at = datetime('now', '-9 days') WHERE created_at = ?",
+                 (recent,))
+    conn.commit()
+    conn.close()
+    assert [d['debtor'] for d in db.get_newly_overdue_debts()['debts']] == ["Оля"]
+
+
+def test_cli_import(db, tmp_path, capsys):
+    """Тест: CLI возвращает 1 при ошибках и печатает их"""
+    path = tmp_path / "ledger.csv"
+    path.write_text(CSV + "payment,,,1,Вася,,\n", encoding='utf-8')
+
+    assert main([str(path), '--db', db.db_path]) == 1
+    out = capsys.readouterr().out
+    assert "расходов 2, выплат 1, ошибок 1" in out
+    assert "строка 7: Не заполнено поле debtor" in out
@@ -8,8 +8,12 @@ from src.keyboards import (
     get_debts_keyboard,
     get_payment_confirmation_keyboard,
     get_back_to_menu_keyboard,
-    get_expense_list_keyboard
+    get_expense_list_keyboard,
+    encode_debt_cursor,
+    decode_debt_cursor,
+    MAX_CALLBACK_DATA_BYTES
 )
+from datetime import datetime
 
 
 def test_get_main_menu_keyboard():
@@ -84,3 +88,45 @@ def test_get_expense_list_keyboard():
     assert keyboard is not None
     assert len(keyboard.inline_keyboard) >= len(expenses) + 1  # +1 для кнопки "Назад"
 
+
+
+def test_debt_cursor_roundtrip():
+    """Тест: курсор долга кодируется и декодируется без потерь"""
+    debt = {'id': 123456, 'created_at': datetime(2024, 5, 17, 12, 30, 45)}
+    cursor = encode_debt_cursor(debt)
+    assert decode_debt_cursor(cursor) == (debt['created_at'], 123456)
+
+
+def test_get_debts_keyboard_navigation():
+    """Тест: кнопки навигации помещаются в лимит callback_data"""
+    debts = [
+        {'id': 10 ** 12, 'creditor': 'Вася', 'remaining': 1000, 'description': 'пицца',
+         'created_at': datetime(2099, 12, 31, 23, 59, 59)},
+        {'id': 10 ** 12 + 1, 'creditor': 'Петя', 'remaining': 500, 'description': 'кофе',
+         'created_at': datetime(2099, 12, 31, 23, 59, 59)}
+    ]
+
+    keyboard = get_debts_keyboard('Пользователь', debts, has_prev=True, has_next=True)
+    navigation = keyboard.inline_keyboard[-2]
+    assert [b.callback_data.split(":")[1] for b in navigation] == ["p", "n"]
+    for button in navigation:
+        assert len(button.callback_data.encode()) <= MAX_CALLBACK_DATA_BYTES
+    assert decode_debt_cursor(navigation[1].callback_data.split(":")[2])[1] == 10 ** 12 + 1
+
+    # Без соседних страниц навигации нет
+    keyboard = get_debts_keyboard('Пользователь', debts)
+    assert len(keyboard.inline_keyboard) == 3
+
+
+def test_get_expense_list_keyboard_next_page():
+    """Тест: кнопка следующей страницы расходов несёт курсор последнего расхода"""
+    expenses = [
+        {'id': 7, 'description': 'пицца', 'total_amount': 4200, 'status': 'settled',
+         'created_at': datetime(2024, 5, 17, 12, 30, 45)}
+    ]
+
+    keyboard = get_expense_list_keyboard(expenses, has_next=True)
+    assert keyboard.inline_keyboard[0][0].text.startswith("✅")
+    callback_data = keyboard.inline_keyboard[1][0].callback_data
+    assert callback_data.startswith("expenses:n:")
+    assert decode_debt_cursor(callback_data.split(":")[2]) == (expenses[0]['created_at'], 7)
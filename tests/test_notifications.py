@@ -0,0 +1,78 @@
+"""
+Unit тесты для notifications.py и журнала событий
+Роль: Тестировщик
+"""
+import pytest
+from src.notifications import NotificationWorker, build_digests, format_digest
+
+
+class FakeOutbox:
+    """Очередь исходящих сообщений, запоминающая уведомления"""
+
+    def __init__(self):
+        self.notifications = []
+
+    def notify(self, chat_id, text):
+        self.notifications.append((chat_id, text))
+
+
+def test_writes_emit_events(db):
+    """Тест: создание, выплата и отмена записывают события"""
+    expense_id = db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+    db.pay_debt("Петя", "Вася", 500)
+    db.cancel_expense(expense_id, "Вася")
+
+    events = db.get_events()
+    assert [e['event_type'] for e in events] == ['expense_created', 'payment', 'expense_cancelled']
+    assert events[0]['payload']['debts'][0]['debtor'] == "Петя"
+    assert events[1]['payload']['debts'][0]['remaining'] == 500
+    assert sorted(events[2]['payload']['debtors']) == ["Маша", "Петя"]
+
+
+def test_build_digests_groups_by_recipient(db):
+    """Тест: уведомления группируются по получателям"""
+    db.create_expense("пицца", 2000, "Вася", ["Петя", "Вася"])
+    db.create_expense("кофе", 300, "Маша", ["Петя"])
+    db.pay_debt("Петя", "Вася", 1000)
+
+    digests = build_digests(db.get_events())
+
+    assert len(digests["Петя"]) == 2
+    assert "Вася" in digests
+    assert "Маша" not in digests
+    assert format_digest(digests["Петя"]).startswith("🔔")
+
+
+async def test_worker_sends_digest_per_recipient(db):
+    """Тест: фоновый обработчик отправляет одну сводку на получателя"""
+    outbox = FakeOutbox()
+    worker = NotificationWorker(db, outbox)
+    db.register_user(11, "Петя")
+    db.register_user(22, "Вася")
+
+    # Первый запуск только запоминает позицию
+    db.create_expense("старый", 100, "Вася", ["Петя"])
+    assert await worker.run_once() == 0
+
+    db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+    db.create_expense("кофе", 300, "Вася", ["Петя"])
+    assert await worker.run_once() == 2
+
+    assert len(outbox.notifications) == 1
+    chat_id, text = outbox.notifications[0]
+    assert chat_id == 11
+    assert "пицца" in text and "кофе" in text and "старый" not in text
+
+    # События не отправляются повторно
+    assert await worker.run_once() == 0
+    assert len(outbox.notifications) == 1
+
+
+def test_amend_notifies_participants(db):
+    """Тест: изменение расхода уведомляет оставшихся и удалённых участников"""
+    expense_id = db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+    db.amend_expense(expense_id, "Вася", total_amount=3000, participants=["Петя"])
+
+    digests = build_digests(db.get_events()[1:])
+    assert "3000р" in digests["Петя"][0]
+    assert "убрал вас" in digests["Маша"][0]
@@ -0,0 +1,127 @@
+"""
+Unit тесты для outbox.py
+Роль: Тестировщик - проверка очереди на локальной фейковой сессии Bot
+"""
+import pytest
+from datetime import datetime
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message
+from src.outbox import SendScheduler, TokenBucket, INTERACTIVE, NOTIFICATION
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot API, которая ничего не отправляет в сеть"""
+
+    def __init__(self, flood_errors=0):
+        super().__init__()
+        self.sent = []
+        self.flood_errors = flood_errors
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            if self.flood_errors:
+                self.flood_errors -= 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+            self.sent.append((method.chat_id, method.text))
+            return Message(
+                message_id=len(self.sent),
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text
+            )
+        raise NotImplementedError(type(method).__name__)
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def session():
+    return FakeSession()
+
+
+@pytest.fixture
+def scheduler(session):
+    bot = Bot(token="42:TEST", session=session)
+    return SendScheduler(bot, global_rate=1000, per_chat_rate=1000, per_chat_burst=1000)
+
+
+def test_token_bucket_limits_rate():
+    """Тест: ведро токенов не даёт превысить лимит"""
+    now = [0.0]
+    bucket = TokenBucket(rate=1, capacity=2, clock=lambda: now[0])
+
+    for _ in range(2):
+        assert bucket.delay() == 0
+        bucket.consume()
+    assert bucket.delay() == pytest.approx(1.0)
+
+    now[0] += 1
+    assert bucket.delay() == 0
+
+
+async def test_send_returns_message(scheduler, session):
+    """Тест: send возвращает отправленное сообщение"""
+    future = scheduler.send(100, "привет")
+    await scheduler.drain()
+
+    message = await future
+    assert message.text == "привет"
+    assert session.sent == [(100, "привет")]
+
+
+async def test_interactive_before_notifications(scheduler, session):
+    """Тест: интерактивные ответы отправляются раньше уведомлений"""
+    scheduler.notify(1, "уведомление")
+    scheduler.send(2, "ответ", priority=INTERACTIVE)
+    await scheduler.drain()
+
+    assert [text for _, text in session.sent] == ["ответ", "уведомление"]
+
+
+async def test_notifications_are_coalesced(scheduler, session):
+    """Тест: уведомления в один чат склеиваются в одно сообщение"""
+    scheduler.notify(1, "первое")
+    scheduler.notify(1, "второе")
+    scheduler.notify(2, "другой чат")
+    await scheduler.drain()
+
+    assert session.sent == [(1, "первое\n\nвторое"), (2, "другой чат")]
+    assert scheduler.stats.coalesced == 1
+
+
+async def test_retry_after_is_retried(session):
+    """Тест: после retry_after сообщение отправляется повторно"""
+    session.flood_errors = 2
+    bot = Bot(token="42:TEST", session=session)
+    scheduler = SendScheduler(bot, global_rate=1000, per_chat_rate=1000, per_chat_burst=1000)
+
+    future = scheduler.send(1, "текст", priority=NOTIFICATION)
+    await scheduler.drain()
+
+    assert (await future).text == "текст"
+    assert scheduler.stats.retried == 2
+    assert scheduler.stats.sent == 1
+
+
+async def test_per_chat_limit_does_not_block_other_chats(session):
+    """Тест: исчерпанный лимит одного чата не задерживает другие чаты"""
+    now = [0.0]
+    bot = Bot(token="42:TEST", session=session)
+    scheduler = SendScheduler(bot, global_rate=1000, per_chat_rate=1, per_chat_burst=1,
+                              clock=lambda: now[0])
+
+    scheduler.send(1, "первое")
+    scheduler.send(1, "второе")
+    scheduler.send(2, "третье")
+    await scheduler.run_once()
+    await scheduler.run_once()
+
+    assert [text for _, text in session.sent] == ["первое", "третье"]
+    assert scheduler.pending == 1
@@ -0,0 +1,162 @@
+"""
+Unit тесты для reminders.py
+Роль: Тестировщик
+"""
+import pytest
+from src.reminders import ReminderScheduler
+
+
+class FakeOutbox:
+    """Очередь исходящих сообщений, запоминающая уведомления"""
+
+    def __init__(self):
+        self.notifications = []
+
+    def notify(self, chat_id, text):
+        self.notifications.append((chat_id, text))
+
+
+def make_old(db, days):
+    """Состарить все долги на указанное количество дней"""
+    conn = db.get_connection()
+    conn.execute("UPDATE debts SET created_at = datetime('now', ?)", (f'-{days} days',))
+    conn.commit()
+    conn.close()
+
+
+def test_debts_are_marked_overdue(db):
+    """Тест: просрочка вычисляется в SQL"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    assert db.get_debts()[0]['overdue'] is False
+
+    make_old(db, 8)
+    assert db.get_debts()[0]['overdue'] is True
+
+
+def test_newly_overdue_uses_watermark(db):
+    """Тест: каждый долг попадает в выборку один раз"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя", "Маша"])
+    assert db.get_newly_overdue_debts()['debts'] == []
+
+    make_old(db, 8)
+    debts = db.get_newly_overdue_debts()['debts']
+    assert len(debts) == 2
+
+    db.advance_reminder_watermark(debts[0]['created_at'], debts[0]['id'])
+    remaining = db.get_newly_overdue_debts()['debts']
+    assert [d['id'] for d in remaining] == [debts[1]['id']]
+
+
+async def test_watermark_passes_paid_and_cancelled_debts(db):
+    """Тест: погашенные и отменённые долги не просматриваются повторно"""
+    outbox = FakeOutbox()
+    scheduler = ReminderScheduler(db, outbox)
+    assert await scheduler.run_once() == 0
+
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    cancelled_id = db.create_expense("кофе", 300, "Вася", ["Маша"])
+    db.pay_debt("Петя", "Вася", 1000)
+    db.cancel_expense(cancelled_id, "Вася")
+    make_old(db, 10)
+
+    scan = db.get_newly_overdue_debts()
+    assert scan['debts'] == [] and scan['last_scanned'] is not None
+    assert await scheduler.run_once() == 0
+    assert db.get_newly_overdue_debts() == {'debts': [], 'last_scanned': None}
+
+
+async def test_reminder_reaches_debtor_without_username(db):
+    """Тест: напоминание находит чат должника по id, а не по имени"""
+    debtor_id = db.register_user(12, None, "Маша")
+    outbox = FakeOutbox()
+    scheduler = ReminderScheduler(db, outbox)
+    assert await scheduler.run_once() == 0
+
+    db.create_expense("пицца", 1000, "Вася", [debtor_id])
+    make_old(db, 10)
+    assert await scheduler.run_once() == 1
+    assert outbox.notifications[0][0] == 12
+
+
+def test_overdue_after_more_than_seven_full_days(db):
+    """Тест: долг просрочен, когда прошло больше OVERDUE_DAYS полных дней"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    make_old(db, 7.5)
+    assert db.get_debts()[0]['overdue'] is False
+
+    make_old(db, 8)
+    assert db.get_debts()[0]['overdue'] is True
+
+
+async def test_first_run_skips_existing_overdue_debts(db):
+    """Тест: первый запуск не рассылает долги, просроченные до него"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    db.register_user(11, "Петя")
+    make_old(db, 30)
+
+    outbox = FakeOutbox()
+    scheduler = ReminderScheduler(db, outbox)
+    assert await scheduler.run_once() == 0
+
+    db.create_expense("кофе", 300, "Маша", ["Петя"])
+    conn = db.get_connection()
+    conn.execute("UPDATE debts SET created_at = datetime('now', '-9 days') WHERE id = 2")
+    conn.commit()
+    conn.close()
+    assert await scheduler.run_once() == 1
+    assert "кофе" in outbox.notifications[0][1]
+    assert "пицца" not in outbox.notifications[0][1]
+
+
+async def test_reminders_batched_per_debtor(db):
+    """Тест: одно напоминание на должника, без повторов"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    db.create_expense("кофе", 300, "Маша", ["Петя"])
+    db.create_expense("такси", 500, "Петя", ["Коля"])
+    db.register_user(11, "Петя")
+    outbox = FakeOutbox()
+    scheduler = ReminderScheduler(db, outbox)
+    assert await scheduler.run_once() == 0
+    make_old(db, 10)
+
+    assert await scheduler.run_once() == 1
+    chat_id, text = outbox.notifications[0]
+    assert chat_id == 11
+    assert "пицца" in text and "кофе" in text
+
+    assert await scheduler.run_once() == 0
+    assert len(outbox.notifications) == 1
+
+
+async def test_reminders_throttled(db):
+    """Тест: за один запуск отправляется не больше max_reminders напоминаний"""
+    for telegram_id, name in enumerate(["Петя", "Маша", "Коля"], start=1):
+        db.create_expense("пицца", 100, "Вася", [name])
+        db.register_user(telegram_id, name)
+    outbox = FakeOutbox()
+    scheduler = ReminderScheduler(db, outbox, max_reminders=2)
+    assert await scheduler.run_once() == 0
+    make_old(db, 10)
+
+    assert await scheduler.run_once() == 2
+    assert await scheduler.run_once() == 1
+
+
+async def test_scheduler_prunes_change_logs(db):
+    """Тест: запуск напоминаний заодно чистит прочитанные события"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    db.create_expense("кофе", 300, "Вася", ["Петя"])
+    db.set_event_cursor('notifications', db.get_last_event_id())
+
+    calls = []
+    prune = db.prune_change_logs
+
+    def prune_all_read():
+        calls.append(prune(keep_events=1))
+        return calls[-1]
+
+    db.prune_change_logs = prune_all_read
+
+    await ReminderScheduler(db, FakeOutbox()).run_once()
+    assert calls == [{'events': 1, 'row_changes': 0}]
+    assert [e['id'] for e in db.get_events()] == [db.get_last_event_id()]
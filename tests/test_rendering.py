@@ -0,0 +1,113 @@
+"""
+Unit тесты для rendering.py
+Роль: Тестировщик
+"""
+import pytest
+from types import SimpleNamespace
+from aiogram.exceptions import TelegramBadRequest
+from src.rendering import MessageRenderer
+from src.keyboards import get_back_to_menu_keyboard, get_debts_keyboard, get_main_menu_keyboard
+
+
+class FakeMessage:
+    """Сообщение Telegram с подсчётом вызовов API"""
+
+    def __init__(self, message_id=1, chat_id=100, edit_error=None):
+        self.message_id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.edit_error = edit_error
+        self.edits = []
+        self.answers = []
+
+    async def edit_text(self, text, reply_markup=None):
+        self.edits.append(text)
+        if self.edit_error:
+            raise TelegramBadRequest(method=None, message=self.edit_error)
+
+    async def answer(self, text, reply_markup=None):
+        self.answers.append(text)
+        return FakeMessage(message_id=self.message_id + 1, chat_id=self.chat.id)
+
+
+async def test_edit_then_skip_same_content():
+    """Тест: повторная правка с тем же содержимым не вызывает API"""
+    renderer = MessageRenderer()
+    message = FakeMessage()
+
+    await renderer.edit(message, "📱 Главное меню:", reply_markup=get_main_menu_keyboard())
+    await renderer.edit(message, "📱 Главное меню:", reply_markup=get_main_menu_keyboard())
+
+    assert len(message.edits) == 1
+    assert renderer.stats.edits == 1
+    assert renderer.stats.skipped == 1
+    assert renderer.stats.saved_calls == 2
+
+
+async def test_same_debts_page_is_skipped():
+    """Тест: повторная отрисовка той же страницы долгов не вызывает API"""
+    renderer = MessageRenderer()
+    message = FakeMessage()
+    debts = [{'creditor': 'Вася', 'remaining': 1000, 'description': 'пицца',
+              'debtor_id': 1, 'creditor_id': 2}]
+
+    await renderer.edit(message, "💳 Ваши долги:", reply_markup=get_debts_keyboard('Петя', debts))
+    await renderer.edit(message, "💳 Ваши долги:", reply_markup=get_debts_keyboard('Петя', debts))
+
+    assert len(message.edits) == 1
+    assert renderer.stats.skipped == 1
+
+
+async def test_changed_markup_is_edited():
+    """Тест: изменение клавиатуры приводит к правке"""
+    renderer = MessageRenderer()
+    message = FakeMessage()
+
+    await renderer.edit(message, "текст", reply_markup=get_main_menu_keyboard())
+    await renderer.edit(message, "текст", reply_markup=get_back_to_menu_keyboard())
+
+    assert len(message.edits) == 2
+
+
+async def test_not_modified_is_not_fallback():
+    """Тест: 'message is not modified' не приводит к отправке нового сообщения"""
+    renderer = MessageRenderer()
+    message = FakeMessage(edit_error="Bad Request: message is not modified")
+
+    await renderer.edit(message, "текст")
+    await renderer.edit(message, "текст")
+
+    assert message.answers == []
+    assert len(message.edits) == 1
+    assert renderer.stats.not_modified == 1
+    assert renderer.stats.skipped == 1
+
+
+async def test_not_editable_falls_back_to_answer():
+    """Тест: если сообщение нельзя отредактировать, отправляется новое"""
+    renderer = MessageRenderer()
+    message = FakeMessage(edit_error="Bad Request: message can't be edited")
+
+    sent = await renderer.edit(message, "текст")
+
+    assert message.answers == ["текст"]
+    assert sent.message_id == 2
+    assert renderer.stats.fallbacks == 1
+
+
+async def test_real_errors_are_raised():
+    """Тест: прочие ошибки не маскируются отправкой нового сообщения"""
+    renderer = MessageRenderer()
+    message = FakeMessage(edit_error="Bad Request: can't parse entities")
+
+    with pytest.raises(TelegramBadRequest):
+        await renderer.edit(message, "текст")
+    assert message.answers == []
+
+
+async def test_cache_is_bounded():
+    """Тест: кэш отпечатков ограничен по размеру"""
+    renderer = MessageRenderer(max_entries=2)
+    for message_id in range(5):
+        await renderer.edit(FakeMessage(message_id=message_id), "текст")
+
+    assert len(renderer._fingerprints) == 2
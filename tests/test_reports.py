@@ -0,0 +1,74 @@
+"""
+Unit тесты для reports.py и постраничных отчётов бота
+Роль: Тестировщик
+"""
+from src.bot import DebtBot
+from src.outbox import MAX_MESSAGE_LENGTH
+from src.reports import ReportPage, ReportSessions, split_lines
+
+
+def test_split_lines_respects_limit():
+    """Тест: строки раскладываются по сообщениям без разрывов"""
+    chunks = split_lines(["a" * 40, "b" * 40, "c" * 40, "d" * 200], max_length=100)
+    assert chunks == ["a" * 40 + "\n" + "b" * 40, "c" * 40, "d" * 99 + "…"]
+    assert all(len(chunk) <= 100 for chunk in chunks)
+
+
+def test_report_reads_rows_lazily():
+    """Тест: страница берёт из источника не больше page_rows + 1 строк"""
+    pulled = []
+
+    def rows():
+        for i in range(1000):
+            pulled.append(i)
+            yield f"строка {i}"
+
+    sessions = ReportSessions()
+    page = sessions.start("Петя", "Отчёт", rows(), page_rows=10)
+    assert page.has_more
+    assert len(pulled) == 11
+    assert str(page).splitlines()[1:] == [f"строка {i}" for i in range(10)]
+
+    page = sessions.more("Петя")
+    assert page.chunks[0].startswith("Отчёт (продолжение)\nстрока 10")
+    assert len(pulled) == 21
+
+
+def test_report_sessions_are_bounded():
+    """Тест: завершённые и вытесненные отчёты не хранятся"""
+    sessions = ReportSessions(max_entries=1)
+    sessions.start("Петя", "Отчёт", iter(["1", "2"]), page_rows=1)
+    sessions.start("Маша", "Отчёт", iter(["1", "2"]), page_rows=1)
+    assert sessions.more("Петя") is None
+
+    assert sessions.more("Маша").has_more is False
+    assert sessions.more("Маша") is None
+
+
+def test_long_debts_report_is_chunked(db):
+    """Тест: большой реестр не превышает лимит сообщения и продолжается по "ещё" """
+    long_name = "участник_с_очень_длинным_именем_" * 2
+    for i in range(60):
+        db.create_expense(f"расход{i}", 100, "Вася", [f"{long_name}{i}"])
+
+    bot = DebtBot(db)
+    page = bot.handle_command("долги", "Вася")
+    assert isinstance(page, ReportPage)
+    assert page.has_more
+    assert len(page.chunks) > 1
+    assert all(len(chunk) <= MAX_MESSAGE_LENGTH for chunk in page.chunks)
+
+    rest = bot.handle_command("ещё", "Вася")
+    assert rest.has_more is False
+    assert len(str(page).splitlines()) + len(str(rest).splitlines()) == 60 + 2
+    assert bot.handle_command("ещё", "Вася").startswith("Продолжения нет")
+
+
+def test_iter_operation_history_pages(db):
+    """Тест: ленивая история совпадает с get_operation_history"""
+    for i in range(7):
+        db.create_expense(f"расход{i}", 100, "Вася", ["Петя"])
+
+    lazy = list(db.iter_operation_history(batch_size=3))
+    assert [op['id'] for op in lazy] == [op['id'] for op in db.get_operation_history(limit=100)]
+    assert [d['id'] for d in db.iter_debts(batch_size=2)] == [d['id'] for d in db.get_debts()]
@@ -0,0 +1,59 @@
+"""
+Unit тесты для router.py и маршрутизации команд бота
+Роль: Тестировщик
+"""
+from src.bot import DebtBot
+from src.router import CommandRouter
+
+
+def test_router_exact_keyword_fallback():
+    """Тест: фраза, ключевое слово и шаблон без префикса"""
+    router = CommandRouter()
+    router.exact("долги", lambda user: "все")
+    router.keyword("долги", r'@?(\w+)', lambda user, name: f"перед {name}")
+    router.fallback(r'^(\w+)\s+(\d+)\s+(.+)$', lambda user, *groups: "расход")
+
+    assert router.dispatch("  долги ", "Петя") == "все"
+    assert router.dispatch("долги @Вася", "Петя") == "перед Вася"
+    assert router.dispatch("пицца 100 @Вася", "Петя") == "расход"
+    assert router.dispatch("просто текст", "Петя") is None
+    assert router.dispatch("", "Петя") is None
+
+
+def test_keyword_is_not_parsed_as_expense(db):
+    """Тест: ключевое слово с числом не создаёт расход"""
+    bot = DebtBot(db)
+    assert bot.handle_command("скинул 700 @Вася", "Петя") is None
+    assert db.get_debts() == []
+
+
+def test_text_without_mentions_is_not_a_command(db):
+    """Тест: фраза с числом без @ показывает меню, а не просит участников"""
+    bot = DebtBot(db)
+    assert bot.handle_command("купил 2 батона", "Петя") is None
+    assert bot.handle_command("пицца 100 @", "Петя") == "Укажите участников через @"
+    assert db.get_debts() == []
+
+
+def test_parse_debts_command_uses_router(db):
+    """Тест: разбор команды долгов идёт через маршрутизатор"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    bot = DebtBot(db)
+    assert bot.parse_debts_command("долги @Вася", "Петя").startswith("💳 Долги перед Вася")
+    assert bot.parse_debts_command("долги по расходам", "Петя").startswith("💳 Долги по расходам")
+    assert bot.parse_debts_command("скинул @Вася 100", "Петя") is None
+    assert db.get_debt_amount("Петя", "Вася") == 1000
+
+
+def test_debts_by_expense_phrase(db):
+    """Тест: "долги по расходам" не путается с "долги @кредитор" """
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    bot = DebtBot(db)
+    assert str(bot.handle_command("долги по расходам", "Петя")).startswith("💳 Долги по расходам")
+
+
+def test_payment_command(db):
+    """Тест: выплата через текстовую команду"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    bot = DebtBot(db)
+    assert bot.handle_command("скинул @Вася 400", "Петя") == "Принял! Петя должен ещё 600р"
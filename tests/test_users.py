@@ -0,0 +1,135 @@
+"""
+Unit тесты для таблицы users и миграции со строковых имён
+Роль: Тестировщик
+"""
+import os
+import sqlite3
+import tempfile
+import pytest
+from src.database import Database
+
+
+@pytest.fixture
+def legacy_db_path():
+    """БД в старой схеме, где пользователи хранились строками"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            total_amount REAL NOT NULL,
+            creator_username TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_cancelled INTEGER DEFAULT 0
+        );
+        CREATE TABLE debts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            expense_id INTEGER NOT NULL,
+            debtor_username TEXT NOT NULL,
+            creditor_username TEXT NOT NULL,
+            amount REAL NOT NULL,
+            paid_amount REAL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE operation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            expense_id INTEGER,
+            operation_type TEXT NOT NULL,
+            username TEXT NOT NULL,
+            description TEXT,
+            amount REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE user_chats (username TEXT PRIMARY KEY, chat_id INTEGER NOT NULL);
+        INSERT INTO expenses (description, total_amount, creator_username) VALUES ('пицца', 2000, 'Вася');
+        INSERT INTO debts (expense_id, debtor_username, creditor_username, amount, paid_amount)
+            VALUES (1, 'Петя', 'Вася', 1000, 200), (1, 'Маша', 'Вася', 1000, 0);
+        INSERT INTO operation_history (expense_id, operation_type, username, description, amount)
+            VALUES (1, 'expense_created', 'Вася', 'Создан расход ''пицца'' на 2000р', 2000);
+        INSERT INTO user_chats VALUES ('Петя', 11);
+    """)
+    conn.commit()
+    conn.close()
+    yield path
+    os.unlink(path)
+
+
+def test_migration_from_usernames(legacy_db_path):
+    """Тест: старые данные переносятся на id пользователей"""
+    db = Database(db_path=legacy_db_path)
+
+    assert db.get_debt_amount("Петя", "Вася") == 800
+    assert len(db.get_debts(creditor_username="Вася")) == 2
+    assert db.get_operation_history()[0]['username'] == "Вася"
+    assert db.get_chat_ids(["Петя"]) == {"Петя": 11}
+
+    # Новые записи продолжают нумерацию
+    expense_id = db.create_expense("кофе", 300, "Маша", ["Петя"])
+    assert expense_id == 2
+
+    # Повторная инициализация ничего не ломает
+    Database(db_path=legacy_db_path)
+    assert db.get_debt_amount("Петя", "Маша") == 300
+
+
+def test_rename_keeps_debts(db):
+    """Тест: переименование в Telegram не теряет долги и историю"""
+    user_id = db.register_user(11, "Петя", "Пётр")
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+
+    assert db.register_user(11, "Пётр_1", "Пётр") == user_id
+
+    debts = db.get_debts()
+    assert debts[0]['debtor'] == "Пётр_1"
+    assert debts[0]['debtor_id'] == user_id
+    assert db.get_debt_amount("Пётр_1", "Вася") == 1000
+    assert db.get_debt_amount("Петя", "Вася") == 0
+
+
+def test_mentioned_user_is_linked_on_first_message(db):
+    """Тест: пользователь из упоминаний привязывается к telegram_id"""
+    db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    mentioned_id = db.get_user_id("Петя")
+
+    assert db.register_user(11, "Петя", "Пётр") == mentioned_id
+    assert db.get_chat_ids(["Петя"]) == {"Петя": 11}
+
+
+def test_user_without_username_uses_id(db):
+    """Тест: пользователь без username работает через id"""
+    user_id = db.register_user(12, None, "Маша")
+    db.create_expense("кофе", 300, user_id, ["Петя"])
+
+    debts = db.get_debts()
+    assert debts[0]['creditor'] == "Маша"
+    assert debts[0]['creditor_id'] == user_id
+    assert db.pay_debt("Петя", user_id, 300) is True
+    assert db.get_chat_ids([user_id]) == {user_id: 12}
+
+
+def test_user_cache_follows_merges_in_other_process(db):
+    """Тест: слияние пользователей в боте сбрасывает кэш id в веб-приложении"""
+    web = Database(db_path=db.db_path)
+    web.create_expense("пицца", 100, "alice", ["bob"])
+    mentioned_id = web.get_user_id("bob")
+
+    # Бот: bob пишет под другим username, затем берёт упомянутый - записи сливаются
+    real_id = db.register_user(22, "bobby", "Боб")
+    assert db.register_user(22, "bob", "Боб") == real_id != mentioned_id
+
+    web.create_expense("taxi", 50, "alice", ["bob"])
+    assert web.get_user_id("bob") == real_id
+    assert sorted(d['debtor_id'] for d in web.get_debts()) == [real_id, real_id]
+    assert web.get_debt_amount("bob", "alice") == 150
+
+
+def test_unknown_user_id_is_rejected(db):
+    """Тест: несуществующий id пользователя не попадает в расходы и долги"""
+    with pytest.raises(ValueError):
+        db.create_expense("пицца", 100, 777, ["Петя"])
+    with pytest.raises(ValueError):
+        db.create_expense("пицца", 100, "Вася", [888])
+    assert db.get_debts() == []
+    assert db.get_debt_amount(888, "Вася") == 0
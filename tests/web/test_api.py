@@ -139,3 +139,449 @@ def test_get_history(client):
     assert data['success'] is True
     assert 'history' in data
 
+
+def test_get_history_by_counterparty(client):
+    """Тест: история выплат конкретному человеку"""
+    import src.web.api
+    src.web.api.db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    src.web.api.db.create_expense("кофе", 300, "Маша", ["Петя"])
+    src.web.api.db.pay_debt("Петя", "Маша", 100)
+
+    data = json.loads(client.get('/api/history?counterparty=Маша').data)
+    assert [op['description'] for op in data['history']] == ["Выплата 100р Маша"]
+    assert json.loads(client.get('/api/history?counterparty=Коля').data)['history'] == []
+
+
+def test_get_debts_filtered_by_debtor(client):
+    """Тест фильтрации долгов по должнику"""
+    expense_data = {
+        'description': 'пицца',
+        'amount': 3000,
+        'creator': 'Вася',
+        'participants': ['Петя', 'Маша']
+    }
+    client.post(
+        '/api/expenses',
+        data=json.dumps(expense_data),
+        content_type='application/json'
+    )
+    
+    response = client.get('/api/debts?debtor=Петя')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['count'] == 1
+    assert data['debts'][0]['debtor'] == 'Петя'
+    assert data['total'] == 1500
+
+
+def test_get_expense_details(client):
+    """Тест получения деталей расхода по id"""
+    import src.web.api
+    expense_id = src.web.api.db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+
+    response = client.get(f'/api/expenses/{expense_id}')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['expense']['description'] == "пицца"
+    assert len(data['expense']['debts']) == 2
+
+    assert client.get('/api/expenses/999').status_code == 404
+
+
+def test_amend_expense(client):
+    """Тест изменения расхода через PATCH"""
+    import src.web.api
+    expense_id = src.web.api.db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+
+    response = client.patch(
+        f'/api/expenses/{expense_id}',
+        data=json.dumps({'user': 'Вася', 'amount': 3000, 'participants': ['Петя']}),
+        content_type='application/json'
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['changes']['removed'] == ['Маша']
+    assert src.web.api.db.get_debt_amount('Петя', 'Вася') == 3000
+
+    response = client.patch(
+        f'/api/expenses/{expense_id}',
+        data=json.dumps({'user': 'Петя', 'amount': 100}),
+        content_type='application/json'
+    )
+    assert response.status_code == 403
+
+
+def test_amend_expense_rejects_invalid_fields(client):
+    """Тест: PATCH отклоняет участников не списком строк и неверные суммы"""
+    import src.web.api
+    expense_id = src.web.api.db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+
+    for body in ({'participants': 'bob'}, {'participants': ['bob', 1]}, {'participants': []},
+                 {'amount': 'abc'}, {'amount': True}, {'amount': -5}, {'amount': 'nan'},
+                 {'amount': [100]}, {'description': 5}):
+        response = client.patch(f'/api/expenses/{expense_id}', json={'user': 'Вася', **body})
+        assert response.status_code == 400, body
+    response = client.patch(f'/api/expenses/{expense_id}', json=['Вася'])
+    assert response.status_code == 400
+
+    assert sorted(d['debtor'] for d in src.web.api.db.get_debts()) == ["Маша", "Петя"]
+    response = client.patch(f'/api/expenses/{expense_id}', json={'user': 'Вася', 'amount': '3000'})
+    assert response.status_code == 200
+
+
+def test_api_rejects_user_ids_instead_of_names(client):
+    """Тест: в JSON пользователи только по имени, числовые id не принимаются"""
+    import src.web.api
+    response = client.post('/api/expenses', json={'description': 'пицца', 'amount': 100,
+                                                   'creator': 777, 'participants': [888]})
+    assert response.status_code == 400
+    response = client.post('/api/payments', json={'debtor': 888, 'creditor': 'Вася', 'amount': 10})
+    assert response.status_code == 400
+    assert src.web.api.db.get_debts() == []
+
+
+def test_conditional_get_by_ledger_version(client):
+    """Тест: 304 пока реестр не менялся, новый ETag после записи"""
+    import src.web.api
+    response = client.get('/api/debts')
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = client.get('/api/statistics', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    src.web.api.db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    response = client.get('/api/debts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_etag_changes_when_debt_becomes_overdue(client):
+    """Тест: долг стал просроченным без записи в реестр - ETag другой"""
+    import sqlite3
+    import src.web.api
+    src.web.api.db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    response = client.get('/api/debts')
+    etag = response.headers['ETag']
+    assert json.loads(response.data)['debts'][0]['overdue'] is False
+
+    # Время прошло: сдвигаем дату долга, поколение реестра не меняется
+    version = src.web.api.db.get_ledger_version()
+    conn = sqlite3.connect(src.web.api.db.db_path)
+    conn.execute("UPDATE debts SET created_at = datetime('now', '-8 days')")
+    conn.commit()
+    conn.close()
+    assert src.web.api.db.get_ledger_version() == version
+
+    response = client.get('/api/debts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert json.loads(response.data)['debts'][0]['overdue'] is True
+    assert client.get('/api/dashboard', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_static_assets_are_versioned(client):
+    """Тест: ссылки на статику содержат версию и кэшируются надолго"""
+    page = client.get('/').data.decode()
+    assert 'js/app.js?v=' in page
+
+    response = client.get('/static/js/app.js')
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    response.close()
+
+
+def test_get_dashboard(client):
+    """Тест: главная страница получает все разделы одним запросом"""
+    import src.web.api
+    src.web.api.db.create_expense("пицца", 2000, "Вася", ["Петя", "Маша"])
+    src.web.api.db.create_expense("кофе", 300, "Маша", ["Петя"])
+    src.web.api.db.pay_debt("Петя", "Вася", 1000)
+
+    response = client.get('/api/dashboard')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['success'] is True
+    assert [d['debtor'] for d in data['debts']] == ["Маша", "Петя"]
+    assert [e['description'] for e in data['expenses']] == ["кофе", "пицца"]
+    assert [e['outstanding'] for e in data['expenses']] == [300, 1000]
+    assert data['statistics'] == {'debt_count': 2, 'total_debt': 1300,
+                                  'debtors_count': 2, 'creditors_count': 2}
+    assert len(data['history']) == 3
+    assert data['version'] == src.web.api.db.get_ledger_version()
+
+    etag = response.headers['ETag']
+    assert client.get('/api/dashboard', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_stream_resumes_from_last_event_id(client):
+    """Тест: поток SSE отдаёт события после Last-Event-ID"""
+    import src.web.api
+    src.web.api.db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    src.web.api.db.pay_debt("Петя", "Вася", 400)
+
+    response = client.get('/api/stream', headers={'Last-Event-ID': '1'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b"retry:")
+    event = next(chunks).decode()
+    assert event.startswith("id: 2\nevent: payment\n")
+    payload = json.loads(event.split("data: ", 1)[1])
+    assert payload['debts'][0]['remaining'] == 600
+    response.close()
+
+
+def test_stream_resets_after_pruned_events(client):
+    """Тест: если события после Last-Event-ID удалены, поток сначала шлёт reset"""
+    import src.web.api
+    for amount in (100, 200, 300):
+        src.web.api.db.create_expense("пицца", amount, "Вася", ["Петя"])
+    src.web.api.db.set_event_cursor('notifications', 3)
+    src.web.api.db.prune_change_logs(keep_events=1)
+
+    response = client.get('/api/stream', headers={'Last-Event-ID': '1'})
+    chunks = iter(response.response)
+    next(chunks)
+    assert next(chunks).decode() == "id: 2\nevent: reset\ndata: {}\n\n"
+    assert next(chunks).decode().startswith("id: 3\nevent: expense_created\n")
+    response.close()
+
+
+def test_event_feed_wakes_on_write(client):
+    """Тест: ожидающий клиент просыпается после записи из другого соединения"""
+    import threading
+    import src.web.api
+    from src.web.stream import EventFeed
+
+    feed = EventFeed(src.web.api.db.db_path, poll_interval=0.01)
+    last_id = feed.last_id()
+    assert feed.wait(last_id, timeout=0.05) is False
+
+    writer = threading.Timer(0.05, src.web.api.db.create_expense, ("пицца", 1000, "Вася", ["Петя"]))
+    writer.start()
+    assert feed.wait(last_id, timeout=5) is True
+    writer.join()
+
+
+def test_get_changes(client):
+    """Тест: клиент получает только изменения со своей версии"""
+    import src.web.api
+    src.web.api.db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    version = json.loads(client.get('/api/dashboard').data)['version']
+
+    src.web.api.db.pay_debt("Петя", "Вася", 400)
+    data = json.loads(client.get(f'/api/changes?since={version}').data)
+    assert data['success'] is True
+    assert data['version'] > version
+    assert [d['remaining'] for d in data['debts']] == [600]
+    assert data['deleted_debts'] == []
+    assert [op['operation_type'] for op in data['history']] == ['payment']
+    assert [(e['description'], e['outstanding']) for e in data['expenses']] == [("пицца", 600)]
+    assert data['deleted_expenses'] == []
+
+    assert client.get('/api/changes').status_code == 400
+
+
+def test_dashboard_expenses_by_id(client):
+    """Тест: расходы с одинаковым описанием не сливаются ни в снимке, ни в изменениях"""
+    import src.web.api
+    first = src.web.api.db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    second = src.web.api.db.create_expense("пицца", 600, "Вася", ["Маша"])
+    data = json.loads(client.get('/api/dashboard').data)
+    assert [(e['id'], e['total_amount']) for e in data['expenses']] == [(second, 600), (first, 1000)]
+
+    src.web.api.db.pay_debt("Петя", "Вася", 1000)
+    src.web.api.db.cancel_expense(second, "Вася")
+    changes = json.loads(client.get(f"/api/changes?since={data['version']}").data)
+    assert [(e['id'], e['status']) for e in changes['expenses']] == [(first, 'settled')]
+    assert changes['deleted_expenses'] == [second]
+
+
+def test_list_expenses_pages(client):
+    """Тест: список расходов постранично, с фильтрами и итогами"""
+    import src.web.api
+    for i in range(3):
+        src.web.api.db.create_expense("пицца", 1000, "Вася", ["Петя"])
+
+    data = json.loads(client.get('/api/expenses?limit=2').data)
+    assert data['count'] == 2 and data['has_next'] is True
+    assert data['expenses'][0]['outstanding'] == 1000
+    rest = json.loads(client.get('/api/expenses', query_string={'limit': 2, 'after': data['next_cursor']}).data)
+    assert rest['count'] == 1 and rest['has_next'] is False
+    assert len({e['id'] for e in data['expenses'] + rest['expenses']}) == 3
+
+    assert client.get('/api/expenses?sort=description').status_code == 400
+    assert client.get('/api/expenses?after=bad').status_code == 400
+
+
+def test_batch(client, monkeypatch):
+    """Тест: пакетный запрос с результатами по операциям и ограничением размера"""
+    import src.web.api
+    operations = [
+        {'type': 'expense', 'description': 'пицца', 'amount': 1000, 'creator': 'Вася',
+         'participants': ['Петя']},
+        {'type': 'payment', 'debtor': 'Петя', 'creditor': 'Вася', 'amount': 1000},
+    ]
+    response = client.post('/api/batch', json={'operations': operations})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [r['status'] for r in data['results']] == ['ok', 'ok']
+    assert src.web.api.db.get_debts() == []
+
+    response = client.post('/api/batch', json={'operations': [{'type': 'unknown', 'amount': 1}]})
+    assert response.status_code == 400
+    assert json.loads(response.data)['results'][0]['status'] == 'error'
+
+    monkeypatch.setattr(src.web.api, 'BATCH_MAX_OPERATIONS', 1)
+    assert client.post('/api/batch', json={'operations': operations}).status_code == 413
+
+
+def test_batch_rejects_invalid_operations(client):
+    """Тест: неверные суммы, описания и имена - ошибка операции, а не 500"""
+    import src.web.api
+    expense = {'type': 'expense', 'description': 'пицца', 'amount': 100, 'creator': 'Вася',
+               'participants': ['Петя']}
+    payment = {'type': 'payment', 'debtor': 'Петя', 'creditor': 'Вася', 'amount': 10}
+    for operation in ({**expense, 'amount': 'inf'}, {**expense, 'amount': True},
+                      {**expense, 'amount': 'NaN'}, {**expense, 'amount': [1]},
+                      {**expense, 'description': {'a': 1}}, {**expense, 'creator': 5},
+                      {**expense, 'participants': [{'a': 1}]}, {**expense, 'participants': [9999]},
+                      {**payment, 'debtor': ['Петя']}, {**payment, 'amount': '-inf'}):
+        response = client.post('/api/batch', json={'operations': [operation]})
+        assert response.status_code == 400, operation
+        assert json.loads(response.data)['results'][0]['status'] == 'error'
+    # Те же проверки суммы в одиночных запросах
+    response = client.post('/api/expenses', json={**expense, 'amount': 'inf'})
+    assert response.status_code == 400
+    response = client.post('/api/payments', json={**payment, 'amount': True})
+    assert response.status_code == 400
+    assert src.web.api.db.get_debts() == []
+
+
+def test_idempotent_payment(client):
+    """Тест: повтор POST с тем же Idempotency-Key не проводит выплату дважды"""
+    import src.web.api
+    src.web.api.db.create_expense("пицца", 1000, "Вася", ["Петя"])
+    payment = {'debtor': 'Петя', 'creditor': 'Вася', 'amount': 300}
+    headers = {'Idempotency-Key': 'retry-1'}
+
+    for _ in range(3):
+        response = client.post('/api/payments', json=payment, headers=headers)
+        assert response.status_code == 200
+    assert src.web.api.db.get_debt_amount("Петя", "Вася") == 700
+
+    response = client.post('/api/payments', json={**payment, 'amount': 100}, headers=headers)
+    assert response.status_code == 422
+    assert client.post('/api/payments', json=payment,
+                       headers={'Idempotency-Key': 'x' * 300}).status_code == 400
+
+
+def test_history_streams_ndjson(client):
+    """Тест: история отдаётся построчным JSON по запросу"""
+    import src.web.api
+    for i in range(3):
+        src.web.api.db.create_expense(f"e{i}", 100, "Вася", ["Петя"])
+
+    response = client.get('/api/history?format=ndjson&limit=2')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.data.decode().splitlines()
+    assert [json.loads(line)['description'] for line in lines] == [
+        "Создан расход 'e2' на 100р", "Создан расход 'e1' на 100р"]
+
+
+def test_large_debts_list_is_gzipped(client):
+    """Тест: большой список долгов сжимается, итоги считаются по потоку"""
+    import gzip
+    import src.web.api
+    src.web.api.db.create_expense("пицца", 3000, "Вася", [f"user{i}" for i in range(30)])
+
+    response = client.get('/api/debts', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    data = json.loads(gzip.decompress(response.data))
+    assert data['count'] == 30 and data['total'] == 3000
+    assert data['debts'][0]['created_at'].count('T') == 1
+
+    plain = json.loads(client.get('/api/debts?debtor=user1').data)
+    assert plain['count'] == 1 and plain['total'] == 100
+
+
+def test_encoders_handle_dates_and_models():
+    """Тест: оба кодировщика понимают datetime и модели БД"""
+    from datetime import datetime
+    from src.database import User
+    from src.web import encoding
+
+    value = {'at': datetime(2024, 5, 17, 12, 30), 'user': User(1, None, 'vasya', None)}
+    expected = {'at': '2024-05-17T12:30:00',
+                'user': {'id': 1, 'telegram_id': None, 'username': 'vasya', 'display_name': None}}
+    assert json.loads(encoding.dumps_std(value)) == expected
+    if encoding.orjson is not None:
+        assert json.loads(encoding.dumps_orjson(value)) == expected
+
+
+def test_export_csv_with_cursor(client):
+    """Тест: выгрузка CSV потоком и её продолжение по id"""
+    import src.web.api
+    for i in range(3):
+        src.web.api.db.create_expense(f"e{i}", 100, "Вася", ["Петя"])
+
+    response = client.get('/api/export/debts')
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    lines = response.data.decode().splitlines()
+    assert lines[0].startswith('id,created_at,expense_id')
+    assert len(lines) == 4
+
+    last_id = lines[2].split(',')[0]
+    rest = client.get(f'/api/export/debts?after={last_id}').data.decode().splitlines()
+    assert rest == [lines[3]]
+
+    assert client.get('/api/export/users').status_code == 404
+    assert client.get('/api/export/debts?format=xml').status_code == 400
+
+
+def test_period_is_parsed_as_dates(client):
+    """Тест: from/to сравниваются как даты, неверная дата - 400"""
+    import src.web.api
+    src.web.api.db.create_expense("пицца", 100, "Вася", ["Петя"])
+    conn = src.web.api.db.get_connection()
+    conn.execute("UPDATE debts SET created_at = '2024-01-05 09:00:00'")
+    conn.commit()
+    conn.close()
+
+    debts = client.get('/api/debts?from=2024-01-05T00:00&to=2024-01-06').get_json()['debts']
+    assert len(debts) == 1
+    assert client.get('/api/debts?from=2024-01-05T10:00%2B03:00').get_json()['debts'] == debts
+    assert client.get('/api/debts?to=2024-01-05T08:59').get_json()['debts'] == []
+    lines = client.get('/api/export/debts?from=2024-01-05T00:00').data.decode().splitlines()
+    assert len(lines) == 2
+
+    for url in ('/api/debts?from=вчера', '/api/debts?to=2024-13-01', '/api/export/debts?to=2024/01/05'):
+        response = client.get(url)
+        assert response.status_code == 400
+        assert response.get_json()['success'] is False
+
+
+def test_import_csv_upload_and_dry_run(client):
+    """Тест: импорт CSV файлом формы и телом запроса, пробный режим ничего не пишет"""
+    import io
+    import src.web.api
+    text = ("type,date,description,amount,creditor,debtor,participants\n"
+            "expense,2024-05-01,пицца,1000,Вася,,Петя;Маша\n"
+            "payment,2024-05-02,,100,Вася,Петя,\n"
+            "payment,,,100,Вася,,\n")
+
+    response = client.post('/api/import?dry_run=1', data=text.encode(), content_type='text/csv')
+    data = response.get_json()
+    assert data['dry_run'] is True and data['success'] is False
+    assert data['errors'] == [{'line': 4, 'error': 'Не заполнено поле debtor'}]
+    assert src.web.api.db.get_debts() == []
+
+    response = client.post('/api/import', data={'file': (io.BytesIO(text.encode()), 'ledger.csv')},
+                           content_type='multipart/form-data')
+    data = response.get_json()
+    assert (data['expenses'], data['payments'], data['error_count']) == (1, 1, 1)
+    assert src.web.api.db.get_debt_amount("Петя", "Вася") == 400
+
+    response = client.post('/api/import', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400